@@ -1,14 +1,40 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context, g
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import get_input_stream
 from flask_sqlalchemy import SQLAlchemy
-from models import db, User, FileRecord, TextRecord
+from sqlalchemy import and_, or_, func
+from sqlalchemy.orm import load_only
+from models import db, User, FileRecord, TextRecord, ensure_schema
+from db_settings import engine_options, configure_engine, report_database_settings
 from auth import register_user, authenticate_user
-from excel_utils import create_excel_from_table
+from session_tokens import SessionTokens, InvalidToken
+from rate_limit import create_rate_limiter
+from profiler import RequestProfiler
+from query_stats import QueryInstrumentation
+from metrics import (
+    REGISTRY as METRICS_REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE, Gauge,
+    REQUEST_LATENCY, STAGE_LATENCY, ROWS_PROCESSED, CELLS_PROCESSED, DB_QUERIES, DB_QUERY_SECONDS,
+    observe_table, instrument_session_commits,
+)
+from excel_utils import iter_excel_from_table, iter_excel_from_sheets, iter_zip_of_files, XLSX_MIMETYPE, ZIP_MIMETYPE
+from text_parser import parse_text_table, iter_text_table, sniff_format, FORMATS as TEXT_FORMATS
+from workbook_cache import WorkbookCache, ParseCache, multi_page_digest
+from render_queue import RenderQueue, QueueFullError
+from janitor import OrphanJanitor
+from unlink_queue import UnlinkQueue
+from write_coalescer import SaveCoalescer
+from batch_render import BatchRenderer
 from datetime import datetime, timedelta, timezone
 import os
 from dotenv import load_dotenv
-import uuid
 import json
+import base64
+import gzip
+import io
+import time
+import zlib
+from urllib.parse import quote
 
 # ===== 统一路径配置 =====
 # 获取项目根目录（backend 的父目录）
@@ -46,6 +72,28 @@ if os.path.exists(backend_env_path):
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
 
+# 会话令牌有效期（秒）和进程内已校验令牌的缓存条数
+app.config['SESSION_TOKEN_MAX_AGE'] = int(os.getenv('SESSION_TOKEN_MAX_AGE', 7 * 24 * 3600))
+app.config['SESSION_CACHE_SIZE'] = int(os.getenv('SESSION_CACHE_SIZE', 10000))
+# 下载令牌有效期（秒）：浏览器直接下载文件时代替 Authorization 头，只需覆盖从签发到开始下载的时间
+app.config['DOWNLOAD_TOKEN_MAX_AGE'] = int(os.getenv('DOWNLOAD_TOKEN_MAX_AGE', 60))
+# 为 true 时所有按用户操作的接口都必须携带会话令牌（默认兼容只传 user_id 的旧客户端）
+app.config['AUTH_REQUIRED'] = os.getenv('AUTH_REQUIRED', 'false').lower() in ('1', 'true', 'yes')
+# 示例配置（.env、docker-compose.yml、README）中的默认密钥：任何人都能用它伪造会话令牌
+INSECURE_SECRET_KEYS = {'', 'dev-secret-key', 'dev-secret-key-change-in-production',
+                        'your-secret-key', 'your-secret-key-change-in-production'}
+if app.config['AUTH_REQUIRED'] and app.config['SECRET_KEY'] in INSECURE_SECRET_KEYS:
+    raise RuntimeError('AUTH_REQUIRED 已开启，但 SECRET_KEY 仍是默认值，请设置随机的 SECRET_KEY 后再启动')
+
+# 生成接口的按用户限流（令牌桶）：每秒补充的次数、允许的突发次数；
+# 多进程部署（WEB_WORKERS > 1，由 gunicorn.conf.py 写入）时默认使用 instance 目录下共享的 SQLite 文件，
+# 所有工作进程共用同一份限额，否则实际限额会随工作进程数成倍放大；单进程时使用进程内存
+app.config['RATE_LIMIT_PER_SECOND'] = float(os.getenv('RATE_LIMIT_PER_SECOND', 1))
+app.config['RATE_LIMIT_BURST'] = float(os.getenv('RATE_LIMIT_BURST', 3))
+app.config['RATE_LIMIT_STORE'] = os.getenv('RATE_LIMIT_STORE') or (
+    os.path.join(INSTANCE_DIR, 'rate_limit.db') if int(os.getenv('WEB_WORKERS') or 1) > 1 else ''
+)
+
 # 统一数据库路径：使用根目录的 instance/table_extractor.db
 # 确保 instance 目录存在
 os.makedirs(INSTANCE_DIR, exist_ok=True)
@@ -61,15 +109,144 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', db_uri)
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# SQLite 连接设置：WAL 模式下读写可以并发，synchronous=NORMAL 在 WAL 下只在检查点时 fsync
+app.config['SQLITE_JOURNAL_MODE'] = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+app.config['SQLITE_SYNCHRONOUS'] = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+app.config['SQLITE_CACHE_SIZE_KB'] = int(os.getenv('SQLITE_CACHE_SIZE_KB', 64 * 1024))
+app.config['SQLITE_MMAP_SIZE'] = int(os.getenv('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+app.config['SQLITE_BUSY_TIMEOUT_MS'] = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+# 服务器数据库（DATABASE_URL 指定 PostgreSQL / MySQL 等）的连接池设置
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 10))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 20))
+app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+# SQL 查询统计：每个请求的查询次数和耗时写入响应头，慢查询和 N+1 查询打印日志
+app.config['SQL_INSTRUMENTATION'] = os.getenv('SQL_INSTRUMENTATION', 'true').lower() in ('1', 'true', 'yes')
+app.config['SQL_SLOW_QUERY_MS'] = float(os.getenv('SQL_SLOW_QUERY_MS', 200))
+app.config['SQL_LOG_PARAMETERS'] = os.getenv('SQL_LOG_PARAMETERS', 'true').lower() in ('1', 'true', 'yes')
+app.config['SQL_N_PLUS_ONE_THRESHOLD'] = int(os.getenv('SQL_N_PLUS_ONE_THRESHOLD', 10))
+# 为每个请求打印一行查询统计（默认只通过响应头返回）
+app.config['SQL_LOG_REQUESTS'] = os.getenv('SQL_LOG_REQUESTS', 'false').lower() in ('1', 'true', 'yes')
+
 # 统一 uploads 路径：使用根目录的 uploads
 app.config['UPLOAD_FOLDER'] = os.getenv('UPLOAD_FOLDER', 'uploads')
 # 确保 uploads 目录在项目根目录
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 os.makedirs(os.path.join(UPLOADS_DIR, 'excel'), exist_ok=True)
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_FILE_SIZE', 10485760))  # 10MB
+# 临时下载模式：解析时不生成Excel文件，下载时按需生成并直接流式返回（请求体中的 ephemeral 字段可覆盖）
+app.config['MANUAL_PARSE_EPHEMERAL'] = os.getenv('MANUAL_PARSE_EPHEMERAL', 'false').lower() in ('1', 'true', 'yes')
+# 临时下载模式下载时需要把整张表格重新提交给 /api/manual/download-stream，受 MAX_CONTENT_LENGTH 限制；
+# 文本超过该大小（字节，默认为请求体上限的 1/4）时改为生成Excel文件，通过 download-temp 下载
+app.config['EPHEMERAL_MAX_TEXT_BYTES'] = int(os.getenv('EPHEMERAL_MAX_TEXT_BYTES', app.config['MAX_CONTENT_LENGTH'] // 4))
+
+# Excel文件缓存容量上限（字节，0 表示不限制）：超过后按最近使用时间淘汰，下载时由 table_json 重新生成
+app.config['EXCEL_CACHE_MAX_BYTES'] = int(os.getenv('EXCEL_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+# 流式导入（/api/manual/parse-stream）的大小上限：请求体字节数（压缩后）、解压后的文本字节数
+# 独立于全局的 MAX_CONTENT_LENGTH，只对该接口生效
+app.config['STREAM_MAX_BYTES'] = int(os.getenv('STREAM_MAX_BYTES', 200 * 1024 * 1024))
+app.config['STREAM_MAX_TEXT_BYTES'] = int(os.getenv('STREAM_MAX_TEXT_BYTES', 500 * 1024 * 1024))
+# 后台删除Excel文件失败时的最大重试次数和首次重试间隔（之后按指数退避）
+app.config['UNLINK_MAX_ATTEMPTS'] = int(os.getenv('UNLINK_MAX_ATTEMPTS', 5))
+app.config['UNLINK_RETRY_DELAY_SECONDS'] = float(os.getenv('UNLINK_RETRY_DELAY_SECONDS', 2))
+# 保存历史记录的合并提交窗口（毫秒）和单批最大条数
+app.config['SAVE_COALESCE_WINDOW_MS'] = float(os.getenv('SAVE_COALESCE_WINDOW_MS', 5))
+app.config['SAVE_COALESCE_MAX_BATCH'] = int(os.getenv('SAVE_COALESCE_MAX_BATCH', 100))
+# 批量导出ZIP时单次最多包含的记录数
+app.config['EXPORT_MAX_RECORDS'] = int(os.getenv('EXPORT_MAX_RECORDS', 500))
+# 批量解析：每个 Web 工作进程的进程池大小和单次请求的最大条数
+# 进程池默认按 Web 工作进程数均分 CPU 核心（至少 1 个），避免多个工作进程的进程池互相争抢 CPU；
+# WEB_WORKERS 由 gunicorn.conf.py 写入环境变量，开发服务器为单进程
+app.config['BATCH_PARSE_WORKERS'] = int(os.getenv('BATCH_PARSE_WORKERS', 0)) or max(1, (os.cpu_count() or 1) // int(os.getenv('WEB_WORKERS') or 1))
+app.config['BATCH_PARSE_MAX_ITEMS'] = int(os.getenv('BATCH_PARSE_MAX_ITEMS', 200))
+# 多页解析：分页符（支持 \f、\n 等转义写法，默认换页符，即 PDF 转文本工具输出的分页符）和最大页数
+app.config['MULTI_PAGE_SEPARATOR'] = os.getenv('MULTI_PAGE_SEPARATOR', '\\f').encode('latin-1', 'backslashreplace').decode('unicode_escape')
+app.config['MULTI_PAGE_MAX_PAGES'] = int(os.getenv('MULTI_PAGE_MAX_PAGES', 200))
+# 解析结果缓存容量（按原始文本字符数计算）
+app.config['PARSE_CACHE_MAX_CHARS'] = int(os.getenv('PARSE_CACHE_MAX_CHARS', 32 * 1024 * 1024))
+# 孤立Excel文件后台清理：执行间隔、未保存文件的最长保留时间（秒）
+app.config['JANITOR_INTERVAL_SECONDS'] = int(os.getenv('JANITOR_INTERVAL_SECONDS', 300))
+app.config['ORPHAN_MAX_AGE_SECONDS'] = int(os.getenv('ORPHAN_MAX_AGE_SECONDS', 3600))
+# 后台渲染队列：工作线程数、最多排队任务数
+app.config['RENDER_WORKERS'] = int(os.getenv('RENDER_WORKERS', 2))
+app.config['RENDER_QUEUE_MAX_PENDING'] = int(os.getenv('RENDER_QUEUE_MAX_PENDING', 100))
+# 后台解析任务：提交后超过该时间仍未完成的标记为失败（秒）、结束后保留多久再删除（秒），0 表示不处理
+app.config['RENDER_JOB_STALE_SECONDS'] = int(os.getenv('RENDER_JOB_STALE_SECONDS', 900))
+app.config['RENDER_JOB_TTL_SECONDS'] = int(os.getenv('RENDER_JOB_TTL_SECONDS', 86400))
+# 按需性能剖析（默认关闭）：管理员请求头 X-Profile-Token 或按比例抽样
+app.config['PROFILE_ADMIN_TOKEN'] = os.getenv('PROFILE_ADMIN_TOKEN', '')
+app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_ENDPOINTS'] = os.getenv('PROFILE_ENDPOINTS', '')  # 逗号分隔的接口函数名，为空时不限
+app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', os.path.join(INSTANCE_DIR, 'profiles'))
+app.config['PROFILE_DIR_MAX_BYTES'] = int(os.getenv('PROFILE_DIR_MAX_BYTES', 100 * 1024 * 1024))
+app.config['PROFILE_TRACEMALLOC_FRAMES'] = int(os.getenv('PROFILE_TRACEMALLOC_FRAMES', 1))
 
 # 初始化扩展
 db.init_app(app)
+query_instrumentation = None
+if app.config['SQL_INSTRUMENTATION']:
+    query_instrumentation = QueryInstrumentation(
+        slow_query_seconds=app.config['SQL_SLOW_QUERY_MS'] / 1000,
+        n_plus_one_threshold=app.config['SQL_N_PLUS_ONE_THRESHOLD'],
+        log_parameters=app.config['SQL_LOG_PARAMETERS'],
+    )
+with app.app_context():
+    configure_engine(db.engine, app.config)
+    if query_instrumentation:
+        query_instrumentation.install(db.engine)
+
+# 内容寻址的工作簿缓存：相同表格共享同一个Excel文件
+workbook_cache = WorkbookCache(
+    os.path.join(PROJECT_ROOT, app.config['UPLOAD_FOLDER'], 'excel'),
+    max_bytes=app.config['EXCEL_CACHE_MAX_BYTES'],
+)
+parse_cache = ParseCache(app.config['PARSE_CACHE_MAX_CHARS'])
+
+# 孤立文件清理在后台线程中定时执行，不再占用解析/保存请求的时间
+janitor = OrphanJanitor(
+    app,
+    workbook_cache.directory,
+    PROJECT_ROOT,
+    max_age_seconds=app.config['ORPHAN_MAX_AGE_SECONDS'],
+    interval_seconds=app.config['JANITOR_INTERVAL_SECONDS'],
+)
+
+# 删除历史记录后，不再被引用的Excel文件由后台线程删除
+unlink_queue = UnlinkQueue(
+    app,
+    max_attempts=app.config['UNLINK_MAX_ATTEMPTS'],
+    retry_delay_seconds=app.config['UNLINK_RETRY_DELAY_SECONDS'],
+)
+
+rate_limiter = create_rate_limiter(
+    app.config['RATE_LIMIT_PER_SECOND'],
+    app.config['RATE_LIMIT_BURST'],
+    shared_path=app.config['RATE_LIMIT_STORE'] or None,
+)
+
+session_tokens = SessionTokens(
+    app.config['SECRET_KEY'],
+    max_age_seconds=app.config['SESSION_TOKEN_MAX_AGE'],
+    cache_size=app.config['SESSION_CACHE_SIZE'],
+    download_max_age_seconds=app.config['DOWNLOAD_TOKEN_MAX_AGE'],
+)
+
+request_profiler = RequestProfiler(
+    app.config['PROFILE_DIR'],
+    admin_token=app.config['PROFILE_ADMIN_TOKEN'],
+    sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+    endpoints=[e.strip() for e in app.config['PROFILE_ENDPOINTS'].split(',') if e.strip()],
+    max_bytes=app.config['PROFILE_DIR_MAX_BYTES'],
+    tracemalloc_frames=app.config['PROFILE_TRACEMALLOC_FRAMES'],
+)
+
+# 并发的历史记录保存合并为批量事务提交
+save_coalescer = SaveCoalescer(
+    app,
+    window_seconds=app.config['SAVE_COALESCE_WINDOW_MS'] / 1000,
+    max_batch=app.config['SAVE_COALESCE_MAX_BATCH'],
+)
 
 # 自动生成CORS配置
 def get_cors_origins():
@@ -117,145 +294,264 @@ def get_china_time():
     return china_time.replace(tzinfo=None)
 
 
+def sanitize_filename(filename):
+    """替换文件名中的非法字符"""
+    for ch in [' ', ':', '/', '\\', '*', '?', '"', '<', '>', '|']:
+        filename = filename.replace(ch, '_')
+    return filename
+
+
+def attachment_headers(filename):
+    """生成附件下载的 Content-Disposition 头（非ASCII文件名使用 RFC 5987 编码）"""
+    try:
+        filename.encode('ascii')
+        disposition = f'attachment; filename="{filename}"'
+    except UnicodeEncodeError:
+        fallback = 'excel' + (os.path.splitext(filename)[1] or '.xlsx')
+        disposition = f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"
+    return {'Content-Disposition': disposition}
+
+
+def is_valid_table_data(table_data):
+    """检查表格数据结构是否为 {"headers": [...], "rows": [[...], ...]}"""
+    return (
+        isinstance(table_data, dict)
+        and isinstance(table_data.get('headers', []), list)
+        and isinstance(table_data.get('rows', []), list)
+        and all(isinstance(r, list) for r in table_data.get('rows', []))
+    )
+
+
+def current_principal(allow_download_token=False):
+    """
+    请求携带的会话令牌对应的用户（Principal），未携带令牌时返回 None；令牌无效时抛出 InvalidToken
+
+    Args:
+        allow_download_token: 未携带 Authorization 头时是否接受查询参数 download_token（只用于下载接口）
+    """
+    auth_header = request.headers.get('Authorization', '')
+    token = auth_header[len('Bearer '):].strip() if auth_header.startswith('Bearer ') else ''
+    if token:
+        return session_tokens.verify(token, load_user=lambda uid: db.session.get(User, uid))
+    download_token = request.args.get('download_token') if allow_download_token else None
+    if download_token:
+        return session_tokens.verify_download(download_token)
+    return None
+
+
+def authorize_user(user_id, allow_download_token=False):
+    """
+    确认请求操作的用户
+
+    - 携带有效令牌：以令牌中的用户为准，不再查询用户表；请求中的 user_id 与令牌不一致时拒绝
+    - 令牌无效或已过期：401
+    - 未携带令牌：兼容旧客户端，按 user_id 查询用户是否存在（AUTH_REQUIRED 开启时直接拒绝）
+    - allow_download_token 为 True 时（下载接口），查询参数中的下载令牌等同于会话令牌
+
+    Returns:
+        (user_id, None) 或 (None, 错误响应)
+    """
+    try:
+        principal = current_principal(allow_download_token)
+    except InvalidToken as e:
+        return None, (jsonify({'success': False, 'error': str(e)}), 401)
+
+    if principal is not None:
+        if user_id and str(user_id) != str(principal.user_id):
+            return None, (jsonify({'success': False, 'error': '无权访问其他用户的数据'}), 403)
+        return principal.user_id, None
+
+    if app.config['AUTH_REQUIRED']:
+        return None, (jsonify({'success': False, 'error': '请先登录'}), 401)
+    if not user_id:
+        return None, (jsonify({'success': False, 'error': '需要用户ID'}), 400)
+    if db.session.get(User, user_id) is None:
+        return None, (jsonify({'success': False, 'error': '用户不存在'}), 404)
+    return user_id, None
+
+
+def get_owned_record(record_id, allow_download_token=False):
+    """
+    获取属于当前用户的历史记录（用户ID取自查询参数 user_id，携带会话令牌时可省略）
+
+    Returns:
+        (record, None) 或 (None, 错误响应)；记录属于其他用户时与不存在一样返回 404
+    """
+    user_id, error = authorize_user(request.args.get('user_id', type=int), allow_download_token)
+    if error:
+        return None, error
+    record = TextRecord.query.filter_by(id=record_id, user_id=user_id).first()
+    if record is None:
+        return None, (jsonify({'success': False, 'error': '记录不存在'}), 404)
+    return record, None
+
+
+# ===== 运行指标 =====
+
+instrument_session_commits(db.session)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def observe_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        REQUEST_LATENCY.observe(
+            time.perf_counter() - started,
+            endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+            method=request.method,
+            status=str(response.status_code),
+        )
+    return response
+
+
+# ===== 按需性能剖析 =====
+
+@app.before_request
+def start_request_profile():
+    g.profile_session = request_profiler.start(request.endpoint, request.headers)
+
+
+@app.after_request
+def add_profile_header(response):
+    session = g.get('profile_session')
+    if session is not None:
+        response.headers['X-Profile-Id'] = session.profile_id
+        g.profile_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def finish_request_profile(exc):
+    # 流式响应在响应体发送完毕后才会执行到这里，剖析结果包含生成响应体的耗时
+    session = g.pop('profile_session', None)
+    if session is not None:
+        request_profiler.finish(session, {
+            '请求': f"{request.method} {request.full_path.rstrip('?')}",
+            '接口': request.endpoint,
+            '状态码': g.pop('profile_status', 500 if exc else None),
+            '请求体字节数': request.content_length,
+            '异常': repr(exc) if exc else None,
+        })
+
+
+# ===== SQL 查询统计 =====
+
+def request_description():
+    return f"{request.method} {request.url_rule.rule if request.url_rule else request.path}"
+
+
+@app.before_request
+def start_query_stats():
+    if query_instrumentation:
+        g.query_stats_token = query_instrumentation.begin()
+
+
+@app.after_request
+def add_query_stats_headers(response):
+    queries = query_instrumentation.current() if query_instrumentation else None
+    if queries is not None:
+        # 流式响应在发送响应头之后执行的查询不包含在响应头中
+        db_ms = queries.seconds * 1000
+        response.headers['X-DB-Query-Count'] = str(queries.count)
+        response.headers['X-DB-Time-Ms'] = f'{db_ms:.1f}'
+        response.headers.add('Server-Timing', f'db;dur={db_ms:.1f};desc="{queries.count} queries"')
+    return response
+
+
+@app.teardown_request
+def finish_query_stats(exc):
+    token = g.pop('query_stats_token', None)
+    if token is None:
+        return
+    description = request_description()
+    queries = query_instrumentation.end(token, description)
+    if queries is None:
+        return
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    if queries.count:
+        DB_QUERIES.inc(queries.count, endpoint=endpoint)
+        DB_QUERY_SECONDS.inc(queries.seconds, endpoint=endpoint)
+    if app.config['SQL_LOG_REQUESTS']:
+        print(f"{description}: {queries.count} 次查询，数据库耗时 {queries.seconds * 1000:.1f} ms")
+
+
+def excel_dir_usage():
+    size, count = workbook_cache.usage()
+    return [({'kind': 'bytes'}, size), ({'kind': 'files'}, count)]
+
+
+METRICS_REGISTRY.register(Gauge('excel_dir_usage', 'uploads/excel 目录当前占用（字节数/文件数）', excel_dir_usage))
+METRICS_REGISTRY.register(Gauge('render_queue_pending', '后台渲染队列中排队和执行中的任务数', lambda: render_queue.pending))
+METRICS_REGISTRY.register(Gauge('unlink_queue_pending', '等待后台删除的Excel文件数', lambda: unlink_queue.pending))
+
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 格式的运行指标"""
+    return Response(METRICS_REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """健康检查端点"""
     return jsonify({'status': 'ok', 'message': '服务运行正常'}), 200
 
 
-def parse_plain_text_table(raw_text: str):
+def parse_plain_text_table(raw_text: str, text_format: str = 'auto'):
     """
     将用户粘贴的纯文本解析为表格结构。
     约定：
-    - 按换行分割为多行
-    - 每行按空白字符分割为多个单元格
-    - 第一行为表头，后续为数据行
+    - 按换行分割为多行，第一行为表头，后续为数据行
+    - 自动识别 Markdown表格 / TSV / CSV / 等宽对齐 / 空白分隔 格式（见 text_parser）
     """
-    import re
+    with STAGE_LATENCY.time(stage='parse'):
+        table_data, _ = parse_text_table(raw_text, text_format)
+    observe_table(table_data)
+    return table_data
 
-    if not raw_text or not raw_text.strip():
-        raise ValueError("文本内容为空")
 
-    lines = [line.strip() for line in raw_text.splitlines() if line.strip()]
-    if not lines:
-        raise ValueError("文本中没有有效内容")
+def resolve_record_excel_path(record):
+    """解析历史记录的Excel文件路径（兼容相对路径和旧的存储位置），文件不存在时返回 None"""
+    if not record.excel_path:
+        return None
 
-    # 解析每一行，使用任意数量的空白字符分隔
-    rows = [re.split(r"\s+", line) for line in lines]
+    # 处理路径：如果是相对路径，转换为绝对路径（基于项目根目录）
+    excel_path = record.excel_path
+    if not os.path.isabs(excel_path):
+        excel_path = os.path.join(PROJECT_ROOT, excel_path)
 
-    if len(rows) < 2:
-        # 只有一行时，也允许作为数据行，但表头仍为第一行
-        headers = rows[0]
-        data_rows = rows[1:]
-    else:
-        headers = rows[0]
-        data_rows = rows[1:]
-
-    # 统一列数：取最大列数，补空字符串
-    max_cols = max(len(r) for r in [headers] + data_rows)
-    headers = headers + [""] * (max_cols - len(headers))
-    normalized_rows = []
-    for r in data_rows:
-        r = r + [""] * (max_cols - len(r))
-        normalized_rows.append(r)
-
-    return {
-        "headers": headers,
-        "rows": normalized_rows,
-    }
+    # 如果还是找不到，尝试基于UPLOAD_FOLDER的绝对路径
+    if not os.path.exists(excel_path):
+        excel_path = os.path.join(PROJECT_ROOT, app.config['UPLOAD_FOLDER'], 'excel', os.path.basename(record.excel_path))
+
+    return excel_path if os.path.exists(excel_path) else None
 
 
-def cleanup_orphaned_excel_files_for_user(user_id=None, exclude_path=None):
+def materialize_record_excel(record):
     """
-    自动清理孤立的Excel文件（不在数据库中的文件）
-    
-    Args:
-        user_id: 如果指定，只清理该用户的临时文件（通过文件创建时间推断）
-        exclude_path: 排除的文件路径（通常是当前正在使用的文件）
-    
-    Returns:
-        删除的文件数量
+    获取历史记录的Excel文件路径，文件不存在（尚未生成或已被缓存淘汰）时由 table_json 重新生成
+
+    生成的文件按内容寻址；如果路径与记录中保存的不同（旧版本的 uuid 文件名），同步更新记录。
     """
-    try:
-        # 获取所有数据库中的Excel文件路径
-        all_records = TextRecord.query.all()
-        db_excel_files = set()
-        
-        for record in all_records:
-            if record.excel_path:
-                excel_path = record.excel_path
-                if not os.path.isabs(excel_path):
-                    excel_path = os.path.abspath(os.path.join(
-                        PROJECT_ROOT, 
-                        excel_path
-                    ))
-                db_excel_files.add(excel_path)
-                db_excel_files.add(os.path.basename(excel_path))
-        
-        # 扫描 uploads/excel 目录（基于项目根目录）
-        excel_dir = os.path.join(PROJECT_ROOT, app.config['UPLOAD_FOLDER'], 'excel')
-        
-        if not os.path.exists(excel_dir):
-            return 0
-        
-        deleted_count = 0
-        now = datetime.now()
-        # 清理超过1小时的未保存文件
-        max_age = timedelta(hours=1)
-        
-        # 遍历目录中的所有文件
-        for filename in os.listdir(excel_dir):
-            if not filename.endswith('.xlsx'):
-                continue
-            
-            file_path = os.path.join(excel_dir, filename)
-            file_path_abs = os.path.abspath(file_path)
-            
-            # 排除当前正在使用的文件
-            if exclude_path and (file_path_abs == exclude_path or os.path.basename(exclude_path) == filename):
-                continue
-            
-            # 检查文件是否在数据库中
-            is_in_db = False
-            for record in all_records:
-                if record.excel_path:
-                    record_path = record.excel_path
-                    if not os.path.isabs(record_path):
-                        record_path = os.path.abspath(os.path.join(
-                            PROJECT_ROOT, 
-                            record_path
-                        ))
-                    if record_path == file_path_abs or os.path.basename(record_path) == filename:
-                        is_in_db = True
-                        break
-            
-            # 如果不在数据库中，检查文件创建时间
-            if not is_in_db:
-                try:
-                    # 获取文件修改时间（作为创建时间的近似值）
-                    file_mtime = datetime.fromtimestamp(os.path.getmtime(file_path_abs))
-                    file_age = now - file_mtime
-                    
-                    # 如果文件超过1小时，或者用户指定了user_id且文件是最近生成的（可能是该用户的临时文件）
-                    if file_age > max_age:
-                        # 超过1小时，直接删除
-                        os.remove(file_path_abs)
-                        deleted_count += 1
-                    elif user_id is not None:
-                        # 如果指定了user_id，且文件是最近生成的（可能是该用户的临时文件），也删除
-                        # 这里假设最近5分钟内生成的文件可能是该用户的临时文件
-                        if file_age < timedelta(minutes=5):
-                            os.remove(file_path_abs)
-                            deleted_count += 1
-                except Exception as e:
-                    # 删除失败不影响主流程
-                    pass
-        
-        return deleted_count
-    except Exception as e:
-        # 清理失败不影响主流程
-        print(f"清理孤立文件时出错: {str(e)}")
-        return 0
+    excel_path = resolve_record_excel_path(record)
+    if excel_path:
+        workbook_cache.touch(excel_path)
+        return excel_path
+
+    table_data = record.get_table_data()
+    if table_data is None:
+        return None
+
+    excel_path, _ = workbook_cache.get_or_create(table_data)
+    if record.excel_path != excel_path:
+        record.excel_path = excel_path
+        db.session.commit()
+    return excel_path
 
 
 @app.route('/api/register', methods=['POST'])
@@ -299,6 +595,7 @@ def login():
         return jsonify({
             'success': True,
             'user': user.to_dict(),
+            'token': session_tokens.issue(user),
             'message': '登录成功'
         }), 200
     except Exception as e:
@@ -309,6 +606,50 @@ def login():
 # ===== 手动文本模式接口（不调用大模型，也不上传文件） =====
 
 
+def generate_title(custom_title=None):
+    """生成标题：2026年01月16日13:45:30（时分秒用冒号），返回 (标题, 当前时间)"""
+    now = get_china_time()  # 使用中国时区时间
+    if custom_title and str(custom_title).strip():
+        return str(custom_title).strip(), now
+    return now.strftime("%Y年%m月%d日%H:%M:%S"), now
+
+
+def rate_limited_response(user_id):
+    """按用户限流，超过限额时返回 429 响应（带 Retry-After），否则返回 None；不访问数据库"""
+    retry_after = rate_limiter.check(user_id)
+    if retry_after is None:
+        return None
+    response = jsonify({
+        'success': False,
+        'error': '生成表格过于频繁，请稍后再试！',
+        'retry_after': retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def parse_text_cached(raw_text, text_format='auto'):
+    """
+    解析文本为表格（重复粘贴的文本直接使用缓存的解析结果）
+
+    Returns:
+        (表格数据, 实际使用的文本格式)
+    """
+    if text_format in (None, '', 'auto'):
+        text_format = sniff_format(raw_text)
+    cache_key = f"{text_format}\n{raw_text}"
+    table_data = parse_cache.get(cache_key)
+    if table_data is None:
+        table_data = parse_plain_text_table(raw_text, text_format)
+        parse_cache.put(cache_key, table_data)
+    return table_data, text_format
+
+
+def is_valid_text_format(text_format):
+    return text_format in (None, '', 'auto') or text_format in TEXT_FORMATS
+
+
 @app.route('/api/manual/parse', methods=['POST'])
 def manual_parse():
     """
@@ -317,71 +658,52 @@ def manual_parse():
     {
         "user_id": 1,
         "raw_text": "……",
-        "title": "可选，自定义标题"
+        "title": "可选，自定义标题",
+        "text_format": "可选，auto（默认，自动识别）/ whitespace / tsv / csv / markdown / fixed",
+        "ephemeral": false  // 可选，为 true 时不生成Excel文件，下载时通过 /api/manual/download-stream 按需生成
     }
+    文本超过 EPHEMERAL_MAX_TEXT_BYTES 时忽略 ephemeral，照常生成Excel文件（响应中的 ephemeral 为 false）。
     """
     data = request.get_json() or {}
     user_id = data.get('user_id')
     raw_text = data.get('raw_text', '')
     custom_title = data.get('title')
-
-    if not user_id:
-        return jsonify({'success': False, 'error': '需要用户ID'}), 400
+    text_format = data.get('text_format', 'auto')
+    ephemeral = bool(data.get('ephemeral', app.config['MANUAL_PARSE_EPHEMERAL']))
 
     if not raw_text or not raw_text.strip():
         return jsonify({'success': False, 'error': '文本内容不能为空'}), 400
 
+    if not is_valid_text_format(text_format):
+        return jsonify({'success': False, 'error': f'不支持的文本格式: {text_format}'}), 400
+
+    if ephemeral and len(raw_text.encode('utf-8')) > app.config['EPHEMERAL_MAX_TEXT_BYTES']:
+        # 表格太大，下载时无法再整体提交回来，改为生成文件
+        ephemeral = False
+
     try:
-        # 确认用户存在
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({'success': False, 'error': '用户不存在'}), 404
-
-        # 生成标题：2026年01月16日13:45:30（时分秒用冒号）
-        # 先检查同一秒是否已有生成记录，防止频繁生成（在生成Excel之前检查）
-        now = get_china_time()  # 使用中国时区时间
-        title_format = now.strftime("%Y年%m月%d日%H:%M:%S")
-        
-        if custom_title and str(custom_title).strip():
-            title = str(custom_title).strip()
-        else:
-            title = title_format
-        
-        # 检查同一秒是否已有生成记录（检查用户的最近一条记录）
-        existing_record = TextRecord.query.filter_by(user_id=user_id).order_by(
-            TextRecord.created_at.desc()
-        ).first()
-        
-        if existing_record:
-            # 检查是否是同一秒
-            existing_time = existing_record.created_at
-            # 比较到秒级别
-            if (existing_time.year == now.year and 
-                existing_time.month == now.month and 
-                existing_time.day == now.day and
-                existing_time.hour == now.hour and
-                existing_time.minute == now.minute and
-                existing_time.second == now.second):
-                return jsonify({
-                    'success': False,
-                    'error': '生成表格过于频繁，请稍后再试！'
-                }), 400
+        user_id, error = authorize_user(user_id)
+        if error:
+            return error
+
+        # 按用户限流（在生成Excel之前检查）
+        limited = rate_limited_response(user_id)
+        if limited:
+            return limited
+
+        title, _ = generate_title(custom_title)
 
         # 解析文本为表格
-        table_data = parse_plain_text_table(raw_text)
+        table_data, text_format = parse_text_cached(raw_text, text_format)
 
-        # 在生成新Excel之前，自动清理该用户之前生成的未保存临时文件
-        cleanup_orphaned_excel_files_for_user(user_id=user_id)
-        
-        # 生成 Excel
-        excel_filename = f"{uuid.uuid4().hex}.xlsx"
-        # 确保路径是绝对路径，基于项目根目录
-        excel_dir = os.path.join(PROJECT_ROOT, app.config['UPLOAD_FOLDER'], 'excel')
-        os.makedirs(excel_dir, exist_ok=True)
-        excel_path = os.path.join(excel_dir, excel_filename)
-        # 转换为绝对路径
-        excel_path_abs = os.path.abspath(excel_path)
-        create_excel_from_table(table_data, excel_path_abs)
+        if ephemeral:
+            # 临时下载模式：不写磁盘，下载时按需生成
+            excel_path_abs = None
+            excel_filename = None
+        else:
+            # 生成 Excel（相同表格内容直接复用已生成的文件）
+            excel_path_abs, _ = workbook_cache.get_or_create(table_data)
+            excel_filename = os.path.basename(excel_path_abs)
 
         # 不自动保存到历史记录，只返回Excel信息
         # 用户需要点击"存入历史记录"按钮才会保存
@@ -393,25 +715,677 @@ def manual_parse():
                 'excel_path': excel_path_abs,
                 'excel_filename': excel_filename,
                 'table_data': table_data,
-                'raw_text': raw_text
+                'raw_text': raw_text,
+                'text_format': text_format,
+                'ephemeral': ephemeral
+            },
+            'message': '解析成功' if ephemeral else '解析并生成Excel成功'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'解析失败: {str(e)}'}), 500
+
+
+# 流式导入结果中返回的预览行数
+STREAM_PREVIEW_ROWS = 100
+
+
+class SizeLimitedReader(io.RawIOBase):
+    """限制可读取的总字节数（用于解压后的数据，防止压缩炸弹）"""
+
+    def __init__(self, stream, limit):
+        self._stream = stream
+        self._limit = limit
+        self._total = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._stream.read(len(buffer))
+        n = len(data)
+        self._total += n
+        if self._total > self._limit:
+            raise RequestEntityTooLarge()
+        buffer[:n] = data
+        return n
+
+
+def open_request_text_stream():
+    """
+    以文本行迭代器的形式读取请求体（支持 Content-Encoding: gzip 和分块传输），不把整个请求体读入内存
+    """
+    stream = get_input_stream(
+        request.environ, safe_fallback=False, max_content_length=app.config['STREAM_MAX_BYTES']
+    )
+    if request.headers.get('Content-Encoding', '').lower() == 'gzip':
+        stream = gzip.GzipFile(fileobj=stream, mode='rb')
+    stream = SizeLimitedReader(stream, app.config['STREAM_MAX_TEXT_BYTES'])
+    charset = request.mimetype_params.get('charset', 'utf-8')
+    return io.TextIOWrapper(io.BufferedReader(stream), encoding=charset, errors='replace', newline='')
+
+
+@app.route('/api/manual/parse-stream', methods=['POST'])
+def manual_parse_stream():
+    """
+    流式导入大文本：请求体为纯文本（Content-Type: text/plain，可选 Content-Encoding: gzip），
+    边读取边解析边写入Excel，内存占用与文本大小无关。
+    查询参数：
+    - user_id: 用户ID
+    - title: 可选，自定义标题
+    - text_format: 可选，同 /api/manual/parse
+
+    返回Excel信息、表格尺寸和前 100 行预览（不返回完整表格数据，因此不能保存到历史记录）。
+    """
+    user_id = request.args.get('user_id', type=int)
+    custom_title = request.args.get('title')
+    text_format = request.args.get('text_format', 'auto')
+
+    if request.mimetype != 'text/plain':
+        return jsonify({'success': False, 'error': '请求体必须是 text/plain'}), 415
+
+    if request.headers.get('Content-Encoding', 'identity').lower() not in ('identity', 'gzip'):
+        return jsonify({'success': False, 'error': '只支持 gzip 压缩的请求体'}), 415
+
+    if not is_valid_text_format(text_format):
+        return jsonify({'success': False, 'error': f'不支持的文本格式: {text_format}'}), 400
+
+    try:
+        user_id, error = authorize_user(user_id)
+        if error:
+            return error
+
+        # 按用户限流（在生成Excel之前检查）
+        limited = rate_limited_response(user_id)
+        if limited:
+            return limited
+
+        title, _ = generate_title(custom_title)
+
+        try:
+            headers, rows, text_format = iter_text_table(open_request_text_stream(), text_format)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+
+        stats = {'rows': 0, 'cols': len(headers), 'cells': len(headers)}
+        preview = []
+
+        def counted_rows():
+            for row in rows:
+                stats['rows'] += 1
+                stats['cells'] += len(row)
+                if len(row) > stats['cols']:
+                    stats['cols'] = len(row)
+                if len(preview) < STREAM_PREVIEW_ROWS:
+                    preview.append(row)
+                yield row
+
+        with STAGE_LATENCY.time(stage='stream_import'):
+            excel_path, _ = workbook_cache.create_from_rows(headers, counted_rows())
+        ROWS_PROCESSED.inc(stats['rows'])
+        CELLS_PROCESSED.inc(stats['cells'])
+
+        return jsonify({
+            'success': True,
+            'data': {
+                'title': title,
+                'excel_path': excel_path,
+                'excel_filename': os.path.basename(excel_path),
+                'text_format': text_format,
+                'row_count': stats['rows'],
+                'col_count': stats['cols'],
+                'preview': {'headers': headers, 'rows': preview},
             },
             'message': '解析并生成Excel成功'
         }), 200
 
+    except RequestEntityTooLarge:
+        return jsonify({'success': False, 'error': '文本内容过大'}), 413
+    except (gzip.BadGzipFile, EOFError, zlib.error):
+        return jsonify({'success': False, 'error': '无效的 gzip 数据'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': f'解析失败: {str(e)}'}), 500
 
 
+batch_renderer = BatchRenderer(
+    workbook_cache.directory,
+    max_workers=app.config['BATCH_PARSE_WORKERS'],
+)
+
+
+@app.route('/api/manual/batch-parse', methods=['POST'])
+def manual_batch_parse():
+    """
+    批量解析多段文本，解析和生成Excel在进程池中并行执行，按顺序返回每一项的结果。
+    请求体示例：
+    {
+        "user_id": 1,
+        "items": [
+            {"raw_text": "……", "title": "可选", "text_format": "可选，同 /api/manual/parse"},
+            ...
+        ],
+        "include_table_data": true  // 可选，为 false 时结果中不返回表格数据，只返回行列数
+    }
+    单项解析失败不影响其他项，失败项的 success 为 false 并带有 error。
+    """
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    items = data.get('items')
+    include_table_data = bool(data.get('include_table_data', True))
+
+    if not isinstance(items, list) or not items:
+        return jsonify({'success': False, 'error': 'items 必须是非空数组'}), 400
+
+    if len(items) > app.config['BATCH_PARSE_MAX_ITEMS']:
+        return jsonify({
+            'success': False,
+            'error': f"单次最多解析 {app.config['BATCH_PARSE_MAX_ITEMS']} 项"
+        }), 400
+
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            return jsonify({'success': False, 'error': f'第 {index + 1} 项格式不正确'}), 400
+        if not is_valid_text_format(item.get('text_format', 'auto')):
+            return jsonify({
+                'success': False,
+                'error': f"第 {index + 1} 项不支持的文本格式: {item.get('text_format')}"
+            }), 400
+
+    try:
+        user_id, error = authorize_user(user_id)
+        if error:
+            return error
+
+        # 按用户限流（在生成Excel之前检查）
+        limited = rate_limited_response(user_id)
+        if limited:
+            return limited
+
+        default_title, _ = generate_title()
+
+        # 空文本不提交到进程池
+        pending = [
+            index for index, item in enumerate(items)
+            if (item.get('raw_text') or '').strip()
+        ]
+        rendered = dict(zip(pending, batch_renderer.render([
+            (items[index]['raw_text'], items[index].get('text_format', 'auto')) for index in pending
+        ])))
+
+        results = []
+        for index, item in enumerate(items):
+            custom_title = item.get('title')
+            if custom_title and str(custom_title).strip():
+                title = str(custom_title).strip()
+            else:
+                # 同一批次生成时间相同，用序号区分默认标题
+                title = default_title if len(items) == 1 else f'{default_title}-{index + 1}'
+
+            outcome = rendered.get(index, {'error': '文本内容不能为空'})
+            if 'error' in outcome:
+                results.append({'index': index, 'success': False, 'title': title, 'error': outcome['error']})
+                continue
+
+            if outcome['created']:
+                workbook_cache.adopt(outcome['excel_path'])
+            table_data = outcome['table_data']
+            observe_table(table_data)
+            result = {
+                'index': index,
+                'success': True,
+                'title': title,
+                'excel_path': outcome['excel_path'],
+                'excel_filename': os.path.basename(outcome['excel_path']),
+                'text_format': outcome['text_format'],
+                'row_count': len(table_data['rows']),
+                'col_count': len(table_data['headers']),
+            }
+            if include_table_data:
+                result['table_data'] = table_data
+            results.append(result)
+
+        succeeded = sum(1 for result in results if result['success'])
+        return jsonify({
+            'success': True,
+            'data': {
+                'items': results,
+                'succeeded': succeeded,
+                'failed': len(results) - succeeded,
+            },
+            'message': f'批量解析完成：成功 {succeeded} 项，失败 {len(results) - succeeded} 项'
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'批量解析失败: {str(e)}'}), 500
+
+
+@app.route('/api/manual/parse-multi-page', methods=['POST'])
+def manual_parse_multi_page():
+    """
+    按分页符把文本拆成多页，每页解析为一个工作表，生成一个包含所有页的Excel。
+    各页的解析和工作表渲染在进程池中并行执行，最后拼装为一个工作簿。
+    请求体示例：
+    {
+        "user_id": 1,
+        "raw_text": "第一页……\f第二页……",
+        "title": "可选，自定义标题",
+        "text_format": "可选，同 /api/manual/parse，对每一页分别识别",
+        "page_separator": "可选，分页符，默认为服务端配置的 MULTI_PAGE_SEPARATOR（换页符）",
+        "include_table_data": true  // 可选，为 false 时结果中不返回各页的表格数据，只返回行列数
+    }
+    空白页跳过；单页解析失败时该页不写入工作簿，并在结果中带有 error。
+    """
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    raw_text = data.get('raw_text', '')
+    custom_title = data.get('title')
+    text_format = data.get('text_format', 'auto')
+    separator = data.get('page_separator') or app.config['MULTI_PAGE_SEPARATOR']
+    include_table_data = bool(data.get('include_table_data', True))
+
+    if not raw_text or not raw_text.strip():
+        return jsonify({'success': False, 'error': '文本内容不能为空'}), 400
+
+    if not isinstance(separator, str):
+        return jsonify({'success': False, 'error': '分页符必须是字符串'}), 400
+
+    if not is_valid_text_format(text_format):
+        return jsonify({'success': False, 'error': f'不支持的文本格式: {text_format}'}), 400
+
+    # 页码按原文中的位置计算，空白页不占用工作表但保留页码
+    pages = [
+        (page_num, page_text)
+        for page_num, page_text in enumerate(raw_text.split(separator), start=1)
+        if page_text.strip()
+    ]
+    if len(pages) > app.config['MULTI_PAGE_MAX_PAGES']:
+        return jsonify({
+            'success': False,
+            'error': f"单次最多解析 {app.config['MULTI_PAGE_MAX_PAGES']} 页"
+        }), 400
+
+    try:
+        user_id, error = authorize_user(user_id)
+        if error:
+            return error
+
+        # 按用户限流（在生成Excel之前检查）
+        limited = rate_limited_response(user_id)
+        if limited:
+            return limited
+
+        title, _ = generate_title(custom_title)
+
+        rendered = batch_renderer.render_sheets([(page_text, text_format) for _, page_text in pages])
+        try:
+            parts = []
+            results = []
+            for (page_num, _), outcome in zip(pages, rendered):
+                if 'error' in outcome:
+                    results.append({'page': page_num, 'success': False, 'error': outcome['error']})
+                    continue
+                table_data = outcome['table_data']
+                observe_table(table_data)
+                parts.append((f"第{page_num}页", outcome['part_path'], outcome['part'], outcome['digest']))
+                result = {
+                    'page': page_num,
+                    'success': True,
+                    'text_format': outcome['text_format'],
+                    'row_count': len(table_data['rows']),
+                    'col_count': len(table_data['headers']),
+                }
+                if include_table_data:
+                    result['table_data'] = table_data
+                results.append(result)
+
+            if not parts:
+                return jsonify({
+                    'success': False,
+                    'error': '没有可以解析的页面',
+                    'data': {'pages': results}
+                }), 400
+
+            digest = multi_page_digest([(sheet_title, page_digest) for sheet_title, _, _, page_digest in parts])
+            excel_path, _ = workbook_cache.create_from_sheet_parts(
+                digest, [(sheet_title, path, part) for sheet_title, path, part, _ in parts]
+            )
+        finally:
+            for outcome in rendered:
+                if outcome.get('part_path'):
+                    try:
+                        os.remove(outcome['part_path'])
+                    except FileNotFoundError:
+                        pass
+
+        failed = sum(1 for result in results if not result['success'])
+        return jsonify({
+            'success': True,
+            'data': {
+                'title': title,
+                'excel_path': excel_path,
+                'excel_filename': os.path.basename(excel_path),
+                'page_count': len(parts),
+                'failed': failed,
+                'pages': results,
+            },
+            'message': f'解析并生成Excel成功，共 {len(parts)} 页' + (f'，{failed} 页解析失败' if failed else '')
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'多页解析失败: {str(e)}'}), 500
+
+
+def run_render_job(job_id, raw_text):
+    """
+    后台渲染任务：解析文本并生成Excel，状态记录在 FileRecord 中
+
+    超时检查可能同时把任务标记为失败，所有状态变更都是条件更新：
+    排队期间已失败的任务不再处理；处理期间被标记为失败的任务丢弃结果，客户端不会先看到失败又看到完成。
+    """
+    try:
+        started = FileRecord.update_if_status(job_id, ['uploaded'], FileRecord.processing_values())
+        db.session.commit()
+        if not started:
+            return
+
+        try:
+            table_data, _ = parse_text_cached(raw_text)
+            excel_path, _ = workbook_cache.get_or_create(table_data)
+            values = FileRecord.completed_values(table_data, excel_path)
+        except Exception as e:
+            db.session.rollback()
+            values = FileRecord.failed_values(f'解析失败: {str(e)}')
+
+        if not FileRecord.update_if_status(job_id, ['processing'], values):
+            print(f"后台解析任务 {job_id} 已超时被标记为失败，丢弃结果")
+        db.session.commit()
+    finally:
+        db.session.remove()
+
+
+render_queue = RenderQueue(
+    app,
+    run_render_job,
+    max_workers=app.config['RENDER_WORKERS'],
+    max_pending=app.config['RENDER_QUEUE_MAX_PENDING'],
+)
+
+
+def fail_stale_render_jobs():
+    """启动时将上次进程退出前未完成的渲染任务标记为失败（任务输入只保存在内存中）"""
+    stale_jobs = FileRecord.query.filter(
+        FileRecord.file_type == 'text',
+        FileRecord.status.in_(['uploaded', 'processing'])
+    ).all()
+    for job in stale_jobs:
+        job.mark_failed('服务重启，任务已中断，请重新提交')
+    db.session.commit()
+    return len(stale_jobs)
+
+
+def is_stale_render_job(job, now=None):
+    """
+    任务排队或处理超过 RENDER_JOB_STALE_SECONDS 仍未完成（执行它的工作进程可能已被回收或重启）
+
+    排队中的任务从提交时间（uploaded_at）算起，处理中的任务从开始处理的时间（processed_at）算起。
+    """
+    stale_seconds = app.config['RENDER_JOB_STALE_SECONDS']
+    if not stale_seconds:
+        return False
+    if job.status == 'uploaded':
+        since = job.uploaded_at
+    elif job.status == 'processing':
+        since = job.processed_at or job.uploaded_at
+    else:
+        return False
+    return since is not None and since < (now or datetime.utcnow()) - timedelta(seconds=stale_seconds)
+
+
+def expire_render_jobs():
+    """
+    后台解析任务维护，由清理线程定时执行：
+    - 超时未完成的任务标记为失败（工作进程被 gunicorn max_requests 回收时，不会等到下次启动才处理）
+    - 结束超过 RENDER_JOB_TTL_SECONDS 的任务连同结果一起删除
+
+    Returns:
+        (标记失败的任务数, 删除的任务数)
+    """
+    now = datetime.utcnow()
+    failed = 0
+    if app.config['RENDER_JOB_STALE_SECONDS']:
+        # 与 is_stale_render_job 相同的判断，在一条条件更新语句中完成，不会覆盖刚刚完成的任务
+        stale_before = now - timedelta(seconds=app.config['RENDER_JOB_STALE_SECONDS'])
+        failed = FileRecord.query.filter(
+            FileRecord.file_type == 'text',
+            or_(
+                and_(FileRecord.status == 'uploaded', FileRecord.uploaded_at < stale_before),
+                and_(FileRecord.status == 'processing',
+                     func.coalesce(FileRecord.processed_at, FileRecord.uploaded_at) < stale_before),
+            ),
+        ).update(FileRecord.failed_values('任务超时未完成，请重新提交'), synchronize_session=False)
+
+    purged = 0
+    if app.config['RENDER_JOB_TTL_SECONDS']:
+        expire_before = now - timedelta(seconds=app.config['RENDER_JOB_TTL_SECONDS'])
+        purged = FileRecord.query.filter(
+            FileRecord.file_type == 'text',
+            FileRecord.status.in_(['completed', 'failed']),
+            func.coalesce(FileRecord.completed_at, FileRecord.uploaded_at) < expire_before,
+        ).delete(synchronize_session=False)
+
+    db.session.commit()
+    if failed or purged:
+        print(f"后台解析任务：{failed} 个超时标记为失败，删除 {purged} 个过期任务")
+    return failed, purged
+
+
+janitor.add_task(expire_render_jobs)
+
+
+@app.route('/api/manual/parse-async', methods=['POST'])
+def manual_parse_async():
+    """
+    提交后台解析任务，立即返回任务ID，解析和生成Excel在工作线程中完成
+    请求体与 /api/manual/parse 相同：
+    {
+        "user_id": 1,
+        "raw_text": "……",
+        "title": "可选，自定义标题"
+    }
+    """
+    data = request.get_json() or {}
+    user_id = data.get('user_id')
+    raw_text = data.get('raw_text', '')
+    custom_title = data.get('title')
+
+    if not raw_text or not raw_text.strip():
+        return jsonify({'success': False, 'error': '文本内容不能为空'}), 400
+
+    try:
+        user_id, error = authorize_user(user_id)
+        if error:
+            return error
+
+        # 按用户限流（在生成Excel之前检查）
+        limited = rate_limited_response(user_id)
+        if limited:
+            return limited
+
+        title, _ = generate_title(custom_title)
+
+        job = FileRecord(
+            user_id=user_id,
+            filename=f"{title}.xlsx",
+            file_type='text',
+            file_path='',
+            file_size=len(raw_text.encode('utf-8')),
+            status='uploaded',
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        try:
+            render_queue.submit(job.id, raw_text)
+        except QueueFullError as e:
+            job.mark_failed(str(e))
+            db.session.commit()
+            return jsonify({'success': False, 'error': str(e)}), 503
+
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'message': '任务已提交'
+        }), 202
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'提交任务失败: {str(e)}'}), 500
+
+
+@app.route('/api/manual/jobs/<int:job_id>', methods=['GET'])
+def get_render_job(job_id):
+    """查询后台解析任务的状态；完成后返回与 /api/manual/parse 相同结构的结果，查询参数 user_id 同其他接口"""
+    user_id, error = authorize_user(request.args.get('user_id', type=int))
+    if error:
+        return error
+
+    job = FileRecord.query.filter_by(id=job_id, file_type='text', user_id=user_id).first()
+    if not job:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+
+    if is_stale_render_job(job):
+        FileRecord.update_if_status(job.id, [job.status], FileRecord.failed_values('任务超时未完成，请重新提交'))
+        db.session.commit()
+        db.session.refresh(job)
+
+    response = {
+        'success': True,
+        'job': {
+            'id': job.id,
+            'status': job.status,
+            'uploaded_at': job.uploaded_at.isoformat() if job.uploaded_at else None,
+            'processed_at': job.processed_at.isoformat() if job.processed_at else None,
+            'completed_at': job.completed_at.isoformat() if job.completed_at else None,
+        }
+    }
+
+    if job.status == 'completed':
+        table_data = job.get_table_result()
+        excel_path = job.excel_path
+        if table_data is not None and not workbook_cache.touch(excel_path):
+            # 文件已被清理或淘汰，按内容重新生成（路径不变）
+            excel_path, _ = workbook_cache.get_or_create(table_data)
+        response['data'] = {
+            'title': job.filename[:-len('.xlsx')],
+            'excel_path': excel_path,
+            'excel_filename': os.path.basename(excel_path),
+            'table_data': table_data,
+        }
+    elif job.status == 'failed':
+        result = json.loads(job.ai_result) if job.ai_result else {}
+        response['error'] = result.get('error', '解析失败')
+
+    return jsonify(response), 200
+
+
+# 历史记录分页：默认 / 最大每页条数
+HISTORY_PAGE_SIZE = 50
+HISTORY_PAGE_SIZE_MAX = 200
+
+
+def encode_history_cursor(created_at, record_id):
+    """分页游标：最后一条记录的 (created_at, id)，编码为 URL 安全的字符串"""
+    raw = json.dumps([created_at.isoformat() if created_at else None, record_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_history_cursor(cursor):
+    """解析分页游标，格式错误时抛出 ValueError"""
+    try:
+        created_at, record_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(record_id)
+    except (TypeError, ValueError, UnicodeEncodeError) as e:
+        raise ValueError(str(e))
+
+
 @app.route('/api/users/<int:user_id>/manual-records', methods=['GET'])
 def get_manual_records(user_id):
-    """获取用户的手动文本历史记录"""
-    records = TextRecord.query.filter_by(user_id=user_id).order_by(
-        TextRecord.created_at.desc()
-    ).all()
+    """
+    获取用户的手动文本历史记录
+
+    查询参数（均可选，不传时返回全部记录的完整信息，兼容旧版前端）：
+    - limit: 每页条数（默认50，最大200）
+    - cursor: 上一页返回的 next_cursor
+    - view: summary（默认，只返回 id/标题/时间/表格尺寸）或 full（包含原始文本和表格）
+    """
+    user_id, error = authorize_user(user_id)
+    if error:
+        return error
+
+    paginated = any(key in request.args for key in ('limit', 'cursor', 'view'))
+    if not paginated:
+        records = TextRecord.query.filter_by(user_id=user_id).order_by(
+            TextRecord.created_at.desc()
+        ).all()
+        return jsonify({
+            'success': True,
+            'records': [r.to_dict() for r in records],
+        }), 200
+
+    view = request.args.get('view', 'summary')
+    if view not in ('summary', 'full'):
+        return jsonify({'success': False, 'error': 'view 只能是 summary 或 full'}), 400
+
+    try:
+        limit = min(max(int(request.args.get('limit', HISTORY_PAGE_SIZE)), 1), HISTORY_PAGE_SIZE_MAX)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit 必须是整数'}), 400
+
+    query = TextRecord.query.filter_by(user_id=user_id)
+    if view == 'summary':
+        query = query.options(load_only(*[getattr(TextRecord, c) for c in TextRecord.SUMMARY_COLUMNS]))
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            cursor_time, cursor_id = decode_history_cursor(cursor)
+        except ValueError:
+            return jsonify({'success': False, 'error': '无效的分页游标'}), 400
+        query = query.filter(or_(
+            TextRecord.created_at < cursor_time,
+            and_(TextRecord.created_at == cursor_time, TextRecord.id < cursor_id),
+        ))
+
+    # 多取一条用于判断是否还有下一页
+    records = query.order_by(TextRecord.created_at.desc(), TextRecord.id.desc()).limit(limit + 1).all()
+    has_more = len(records) > limit
+    records = records[:limit]
+
+    next_cursor = None
+    if has_more:
+        next_cursor = encode_history_cursor(records[-1].created_at, records[-1].id)
+
+    return jsonify({
+        'success': True,
+        'records': [r.to_summary_dict() if view == 'summary' else r.to_dict() for r in records],
+        'next_cursor': next_cursor,
+        'has_more': has_more,
+    }), 200
+
+
+@app.route('/api/manual/<int:record_id>', methods=['GET'])
+def get_manual_record(record_id):
+    """获取单条历史记录的完整信息（原始文本和表格数据），查询参数 user_id 同其他接口"""
+    record, error = get_owned_record(record_id)
+    if error:
+        return error
     return jsonify({
         'success': True,
-        'records': [r.to_dict() for r in records],
+        'record': record.to_dict(),
     }), 200
 
 
@@ -425,7 +1399,7 @@ def save_to_history():
         "title": "2026年01月16日14_00_22",
         "raw_text": "...",
         "table_data": {...},
-        "excel_path": "..."
+        "excel_path": "..."  // 临时下载模式下可省略，保存时根据 table_data 生成Excel文件
     }
     """
     data = request.get_json() or {}
@@ -435,35 +1409,26 @@ def save_to_history():
     table_data = data.get('table_data', {})
     excel_path = data.get('excel_path')
 
-    if not user_id:
-        return jsonify({'success': False, 'error': '需要用户ID'}), 400
     if not title:
         return jsonify({'success': False, 'error': '需要标题'}), 400
-    if not excel_path:
+    if not is_valid_table_data(table_data):
+        return jsonify({'success': False, 'error': '表格数据格式错误'}), 400
+    if not excel_path and not table_data:
         return jsonify({'success': False, 'error': '需要Excel文件路径'}), 400
 
     try:
-        user = User.query.get(user_id)
-        if not user:
-            return jsonify({'success': False, 'error': '用户不存在'}), 404
+        user_id, error = authorize_user(user_id)
+        if error:
+            return error
+
+        if not excel_path:
+            # 临时下载模式生成的结果：只记录内容寻址路径，Excel文件在首次下载时再生成
+            excel_path = workbook_cache.path_for_table(table_data)
+        elif os.path.basename(workbook_cache.path_for_table(table_data)) != os.path.basename(excel_path):
+            # Excel文件按内容寻址，文件被淘汰后由保存的表格重新生成；表格与文件不一致时
+            # （如流式导入只返回了前 100 行预览）保存后会丢失数据，拒绝保存
+            return jsonify({'success': False, 'error': '表格数据与Excel文件不一致，流式导入的预览结果不能保存到历史记录'}), 400
 
-        # 在保存到历史记录之前，自动清理该用户之前生成的未保存临时文件（排除当前要保存的文件）
-        cleanup_orphaned_excel_files_for_user(user_id=user_id, exclude_path=excel_path)
-        
-        # 检查是否已存在相同的记录（根据 excel_path 判断，防止重复保存）
-        existing_record = TextRecord.query.filter_by(
-            user_id=user_id,
-            excel_path=excel_path
-        ).first()
-        
-        if existing_record:
-            # 如果记录已存在，返回已存在的记录（不重复保存）
-            return jsonify({
-                'success': True,
-                'record': existing_record.to_dict(),
-                'message': '该记录已存在于历史记录中'
-            }), 200
-        
         # 从 title 解析时间，用于设置 created_at（保持与生成时间一致）
         import re
         created_at_time = None
@@ -483,19 +1448,32 @@ def save_to_history():
         record = TextRecord(
             user_id=user_id,
             title=title,
-            raw_text=raw_text,
-            table_json=json.dumps(table_data, ensure_ascii=False),
             excel_path=excel_path,
             created_at=created_at_time,  # 使用从 title 解析的时间（真正的生成时间）
         )
-        db.session.add(record)
-        db.session.commit()
+        record.set_raw_text(raw_text)
+        record.set_table_data(table_data)
+
+        # 并发的保存请求合并到同一个事务中提交；检查是否已存在相同的记录（根据 excel_path 和标题判断，
+        # 防止同一次生成结果重复保存；Excel文件按内容共享，不同时间生成的相同表格仍可分别保存）
+        record_dict, created = save_coalescer.save(record)
+
+        if not created:
+            # 如果记录已存在，返回已存在的记录（不重复保存）
+            return jsonify({
+                'success': True,
+                'record': record_dict,
+                'message': '该记录已存在于历史记录中'
+            }), 200
 
         return jsonify({
             'success': True,
-            'record': record.to_dict(),
+            'record': record_dict,
             'message': '已保存到历史记录'
         }), 200
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'表格数据格式错误: {str(e)}'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': f'保存失败: {str(e)}'}), 500
@@ -503,19 +1481,18 @@ def save_to_history():
 
 @app.route('/api/manual/<int:record_id>', methods=['DELETE'])
 def delete_record(record_id):
-    """删除单条历史记录"""
+    """删除单条历史记录（只能删除属于当前用户的记录），查询参数 user_id 同其他接口"""
     try:
-        record = TextRecord.query.get_or_404(record_id)
-        
-        # 删除Excel文件（如果存在）
-        if record.excel_path and os.path.exists(record.excel_path):
-            try:
-                os.remove(record.excel_path)
-            except Exception as e:
-                print(f"删除Excel文件失败: {str(e)}")
-        
+        record, error = get_owned_record(record_id)
+        if error:
+            return error
+        excel_path = record.excel_path
+
         db.session.delete(record)
         db.session.commit()
+
+        # 删除Excel文件（没有其他记录引用时，后台执行）
+        unlink_queue.submit([excel_path])
         
         return jsonify({'success': True, 'message': '删除成功'}), 200
     except Exception as e:
@@ -523,40 +1500,56 @@ def delete_record(record_id):
         return jsonify({'success': False, 'error': f'删除失败: {str(e)}'}), 500
 
 
+# 批量删除时每条 SQL 语句包含的最大ID数（SQLite 对绑定参数个数有限制）
+DELETE_CHUNK_SIZE = 500
+
+
 @app.route('/api/manual/batch-delete', methods=['POST'])
 def batch_delete_records():
-    """批量删除历史记录
+    """批量删除历史记录（只删除属于该用户的记录）
     请求体：
     {
+        "user_id": 1,
         "record_ids": [1, 2, 3]
     }
+    记录按ID集合批量删除，Excel文件交给后台队列删除，请求不等待文件删除完成。
     """
     try:
         data = request.get_json() or {}
+        user_id = data.get('user_id')
         record_ids = data.get('record_ids', [])
-        
+
+        user_id, error = authorize_user(user_id)
+        if error:
+            return error
+
         if not record_ids or not isinstance(record_ids, list):
             return jsonify({'success': False, 'error': '需要提供记录ID列表'}), 400
-        
-        records = TextRecord.query.filter(TextRecord.id.in_(record_ids)).all()
-        
-        # 删除Excel文件
-        for record in records:
-            if record.excel_path and os.path.exists(record.excel_path):
-                try:
-                    os.remove(record.excel_path)
-                except Exception as e:
-                    print(f"删除Excel文件失败: {str(e)}")
-        
-        # 批量删除记录
-        for record in records:
-            db.session.delete(record)
-        
+
+        try:
+            record_ids = sorted({int(record_id) for record_id in record_ids})
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': '记录ID格式不正确'}), 400
+
+        excel_paths = set()
+        deleted_count = 0
+        for start in range(0, len(record_ids), DELETE_CHUNK_SIZE):
+            chunk = record_ids[start:start + DELETE_CHUNK_SIZE]
+            scope = and_(TextRecord.id.in_(chunk), TextRecord.user_id == user_id)
+            excel_paths.update(
+                row[0] for row in db.session.query(TextRecord.excel_path).filter(scope).distinct()
+            )
+            deleted_count += db.session.query(TextRecord).filter(scope).delete(synchronize_session=False)
+
         db.session.commit()
-        
+
+        # 删除Excel文件（没有其他记录引用时，后台执行）
+        unlink_queue.submit(excel_paths)
+
         return jsonify({
             'success': True,
-            'message': f'成功删除{len(records)}条记录'
+            'deleted': deleted_count,
+            'message': f'成功删除{deleted_count}条记录'
         }), 200
     except Exception as e:
         db.session.rollback()
@@ -583,41 +1576,209 @@ def download_temp_excel():
         excel_path,
         as_attachment=True,
         download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mimetype=XLSX_MIMETYPE
+    )
+
+
+@app.route('/api/manual/download-stream', methods=['POST'])
+def download_stream_excel():
+    """
+    按需生成Excel并直接流式返回（临时下载模式，不写磁盘）
+    请求体：
+    {
+        "table_data": {"headers": [...], "rows": [[...], ...]},
+        "filename": "可选，下载文件名"
+    }
+    """
+    data = request.get_json() or {}
+    table_data = data.get('table_data')
+    filename = data.get('filename') or 'excel.xlsx'
+
+    if not table_data or not is_valid_table_data(table_data):
+        return jsonify({'success': False, 'error': '需要表格数据'}), 400
+
+    if not filename.endswith('.xlsx'):
+        filename += '.xlsx'
+
+    return Response(
+        stream_with_context(iter_excel_from_table(table_data)),
+        mimetype=XLSX_MIMETYPE,
+        headers=attachment_headers(sanitize_filename(filename)),
     )
 
 
 @app.route('/api/manual/<int:record_id>/download-excel', methods=['GET'])
 def download_manual_excel(record_id):
-    """下载手动文本生成的Excel"""
-    record = TextRecord.query.get_or_404(record_id)
-    
-    if not record.excel_path:
-        return jsonify({'success': False, 'error': 'Excel文件路径不存在'}), 404
-    
-    # 处理路径：如果是相对路径，转换为绝对路径（基于项目根目录）
-    excel_path = record.excel_path
-    if not os.path.isabs(excel_path):
-        # 相对路径，需要基于项目根目录
-        excel_path = os.path.join(PROJECT_ROOT, excel_path)
-    
-    # 如果还是找不到，尝试基于UPLOAD_FOLDER的绝对路径
-    if not os.path.exists(excel_path):
-        excel_path = os.path.join(PROJECT_ROOT, app.config['UPLOAD_FOLDER'], 'excel', os.path.basename(record.excel_path))
-    
-    if not os.path.exists(excel_path):
-        return jsonify({'success': False, 'error': f'Excel文件不存在: {excel_path}'}), 404
+    """下载手动文本生成的Excel，查询参数 user_id 同其他接口，也可使用 download_token（同 /api/manual/export-zip）"""
+    record, error = get_owned_record(record_id, allow_download_token=True)
+    if error:
+        return error
+
+    try:
+        excel_path = materialize_record_excel(record)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': f'生成Excel失败: {str(e)}'}), 500
+
+    if not excel_path:
+        return jsonify({'success': False, 'error': 'Excel文件不存在'}), 404
 
-    filename = f"{record.title}.xlsx"
     # 替换标题中的非法文件名字符
-    for ch in [' ', ':', '/', '\\', '*', '?', '"', '<', '>', '|']:
-        filename = filename.replace(ch, '_')
+    filename = sanitize_filename(f"{record.title}.xlsx")
 
     return send_file(
         excel_path,
         as_attachment=True,
         download_name=filename,
-        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        mimetype=XLSX_MIMETYPE
+    )
+
+
+def unique_archive_name(title, used):
+    """归档内的文件名（与单个下载使用相同的文件名规则），重名时追加序号"""
+    base = sanitize_filename(title or 'excel')
+    name = f"{base}.xlsx"
+    n = 2
+    while name in used:
+        name = f"{base}_({n}).xlsx"
+        n += 1
+    used.add(name)
+    return name
+
+
+@app.route('/api/manual/download-token', methods=['POST'])
+def issue_download_token():
+    """
+    签发短期有效的下载令牌（有效期 DOWNLOAD_TOKEN_MAX_AGE 秒）
+    浏览器直接打开下载链接时无法携带 Authorization 头；下载接口接受查询参数 download_token 代替，
+    文件由浏览器边下载边写入磁盘，不在页面内存中缓冲。
+    请求体：{"user_id": 1}（携带会话令牌时可省略）
+    """
+    data = request.get_json(silent=True) or {}
+    user_id, error = authorize_user(data.get('user_id'))
+    if error:
+        return error
+    return jsonify({
+        'success': True,
+        'token': session_tokens.issue_download(user_id),
+        'expires_in': app.config['DOWNLOAD_TOKEN_MAX_AGE'],
+    }), 200
+
+
+@app.route('/api/manual/export-zip', methods=['GET'])
+def export_records_zip():
+    """
+    批量导出历史记录的Excel，打包为ZIP流式返回（边生成边下载，不在内存中缓冲整个归档）
+    查询参数：
+    - ids: 记录ID列表，逗号分隔，例如 ids=1,2,3（按该顺序写入归档）
+    - user_id: 用户ID（携带会话令牌时可省略），只导出属于该用户的记录
+    - download_token: 可选，/api/manual/download-token 签发的下载令牌（浏览器直接下载时代替 Authorization 头）
+
+    Excel文件不存在（尚未生成或已被缓存淘汰）时由 table_json 重新生成；无法生成的记录跳过。
+    """
+    try:
+        record_ids = [int(v) for v in request.args.get('ids', '').split(',') if v.strip()]
+    except ValueError:
+        return jsonify({'success': False, 'error': '记录ID格式不正确'}), 400
+    user_id, error = authorize_user(request.args.get('user_id', type=int), allow_download_token=True)
+    if error:
+        return error
+
+    if not record_ids:
+        return jsonify({'success': False, 'error': '需要提供记录ID列表'}), 400
+
+    if len(record_ids) > app.config['EXPORT_MAX_RECORDS']:
+        return jsonify({
+            'success': False,
+            'error': f"单次最多导出 {app.config['EXPORT_MAX_RECORDS']} 条记录"
+        }), 400
+
+    # 只加载文件名和路径，表格数据在需要重新生成时才按需加载
+    query = TextRecord.query.options(
+        load_only(TextRecord.id, TextRecord.title, TextRecord.excel_path)
+    ).filter(TextRecord.id.in_(record_ids), TextRecord.user_id == user_id)
+    records_by_id = {record.id: record for record in query.all()}
+    records = [records_by_id[i] for i in dict.fromkeys(record_ids) if i in records_by_id]
+
+    if not records:
+        return jsonify({'success': False, 'error': '记录不存在'}), 404
+
+    def entries():
+        used = set()
+        for record in records:
+            try:
+                excel_path = materialize_record_excel(record)
+            except Exception as e:
+                db.session.rollback()
+                print(f"导出记录 {record.id} 时生成Excel失败: {str(e)}")
+                continue
+            if not excel_path:
+                print(f"导出记录 {record.id} 时跳过：Excel文件不存在且无法重新生成")
+                continue
+            yield unique_archive_name(record.title, used), excel_path
+
+    filename = sanitize_filename(f"历史记录_{get_china_time().strftime('%Y%m%d%H%M%S')}.zip")
+    return Response(
+        stream_with_context(iter_zip_of_files(entries())),
+        mimetype=ZIP_MIMETYPE,
+        headers=attachment_headers(filename),
+    )
+
+
+@app.route('/api/manual/export-combined', methods=['GET'])
+def export_records_combined():
+    """
+    将多条历史记录合并为一个Excel（每条记录一个工作表，工作表名称为记录标题），流式返回
+    查询参数：
+    - ids: 记录ID列表，逗号分隔（按该顺序生成工作表）
+    - user_id: 用户ID（携带会话令牌时可省略），只合并属于该用户的记录
+    - download_token: 可选，同 /api/manual/export-zip
+
+    逐条加载记录的表格数据并写出对应的工作表，写完即释放，内存占用只取决于单条记录的大小。
+    """
+    try:
+        record_ids = [int(v) for v in request.args.get('ids', '').split(',') if v.strip()]
+    except ValueError:
+        return jsonify({'success': False, 'error': '记录ID格式不正确'}), 400
+    user_id, error = authorize_user(request.args.get('user_id', type=int), allow_download_token=True)
+    if error:
+        return error
+
+    if not record_ids:
+        return jsonify({'success': False, 'error': '需要提供记录ID列表'}), 400
+
+    if len(record_ids) > app.config['EXPORT_MAX_RECORDS']:
+        return jsonify({
+            'success': False,
+            'error': f"单次最多导出 {app.config['EXPORT_MAX_RECORDS']} 条记录"
+        }), 400
+
+    # 先只查询ID，确认记录存在且属于该用户
+    query = db.session.query(TextRecord.id).filter(TextRecord.id.in_(record_ids), TextRecord.user_id == user_id)
+    found = {record_id for (record_id,) in query.all()}
+    ordered_ids = [i for i in dict.fromkeys(record_ids) if i in found]
+
+    if not ordered_ids:
+        return jsonify({'success': False, 'error': '记录不存在'}), 404
+
+    def sheets():
+        for record_id in ordered_ids:
+            record = db.session.get(TextRecord, record_id)
+            if record is None:
+                continue
+            table_data = record.get_table_data()
+            title = record.title
+            # 从会话中移除，写完工作表后表格数据即可被回收
+            db.session.expunge(record)
+            if not table_data:
+                continue
+            yield title, table_data.get('headers', []), table_data.get('rows', [])
+
+    filename = sanitize_filename(f"合并导出_{get_china_time().strftime('%Y%m%d%H%M%S')}.xlsx")
+    return Response(
+        stream_with_context(iter_excel_from_sheets(sheets())),
+        mimetype=XLSX_MIMETYPE,
+        headers=attachment_headers(filename),
     )
 
 
@@ -641,90 +1802,80 @@ def get_file(file_id):
 
 @app.route('/api/manual/cleanup-orphaned-files', methods=['POST'])
 def cleanup_orphaned_excel_files():
-    """清理孤立的Excel文件（不在数据库中的文件）"""
+    """立即清理孤立的Excel文件（不在数据库中的文件），不受最长保留时间限制"""
     try:
-        # 获取所有数据库中的Excel文件路径
-        all_records = TextRecord.query.all()
-        db_excel_files = set()
-        
-        for record in all_records:
-            if record.excel_path:
-                # 标准化路径（转换为绝对路径）
-                excel_path = record.excel_path
-                if not os.path.isabs(excel_path):
-                    excel_path = os.path.abspath(os.path.join(
-                        PROJECT_ROOT, 
-                        excel_path
-                    ))
-                db_excel_files.add(excel_path)
-                # 也添加文件名（用于匹配）
-                db_excel_files.add(os.path.basename(excel_path))
-        
-        # 扫描 uploads/excel 目录（基于项目根目录）
-        excel_dir = os.path.join(PROJECT_ROOT, app.config['UPLOAD_FOLDER'], 'excel')
-        
-        if not os.path.exists(excel_dir):
-            return jsonify({
-                'success': True,
-                'message': 'Excel目录不存在，无需清理',
-                'deleted_count': 0
-            }), 200
-        
-        deleted_count = 0
-        deleted_files = []
-        
-        # 遍历目录中的所有文件
-        for filename in os.listdir(excel_dir):
-            if not filename.endswith('.xlsx'):
-                continue
-            
-            file_path = os.path.join(excel_dir, filename)
-            file_path_abs = os.path.abspath(file_path)
-            
-            # 检查文件是否在数据库中
-            is_in_db = False
-            for record in all_records:
-                if record.excel_path:
-                    record_path = record.excel_path
-                    if not os.path.isabs(record_path):
-                        record_path = os.path.abspath(os.path.join(
-                            PROJECT_ROOT, 
-                            record_path
-                        ))
-                    # 比较绝对路径或文件名
-                    if record_path == file_path_abs or os.path.basename(record_path) == filename:
-                        is_in_db = True
-                        break
-            
-            # 如果不在数据库中，删除文件
-            if not is_in_db:
-                try:
-                    os.remove(file_path_abs)
-                    deleted_count += 1
-                    deleted_files.append(filename)
-                except Exception as e:
-                    print(f"删除孤立文件失败 {filename}: {str(e)}")
-        
+        deleted_files = janitor.run_once(max_age_seconds=0, full=True)
+        deleted_count = len(deleted_files)
+
         return jsonify({
             'success': True,
             'message': f'清理完成，删除了 {deleted_count} 个孤立文件',
             'deleted_count': deleted_count,
             'deleted_files': deleted_files
         }), 200
-        
+
     except Exception as e:
         return jsonify({'success': False, 'error': f'清理失败: {str(e)}'}), 500
 
 
-if __name__ == '__main__':
+# ===== 启动与关闭 =====
+
+_startup_done = False
+
+
+def run_startup_tasks():
+    """
+    启动时执行一次的初始化：检查数据库设置、补齐表结构、结束上次未完成的渲染任务、清理孤立文件
+
+    多进程部署时只能在主进程中执行（例如 gunicorn 的 preload 阶段），
+    否则工作进程重启时会把其他工作进程正在执行的渲染任务标记为失败。
+    """
+    global _startup_done
+    if _startup_done:
+        return
     with app.app_context():
-        db.create_all()
-        # 启动时自动清理所有超过1小时的孤立文件
-        deleted = cleanup_orphaned_excel_files_for_user()
-        if deleted > 0:
-            print(f"启动时清理了 {deleted} 个孤立文件")
-    
+        report_database_settings(db.engine, app.config)
+        ensure_schema()
+        fail_stale_render_jobs()
+        # 启动时自动清理所有超过保留时间的孤立文件，之后由后台线程定时清理
+        deleted = janitor.run_once(full=True)
+        if deleted:
+            print(f"启动时清理了 {len(deleted)} 个孤立文件")
+    _startup_done = True
+
+
+def start_background_workers():
+    """启动后台线程（孤立文件清理、文件删除队列），需在 fork 之后的工作进程中调用"""
+    janitor.start()
+    unlink_queue.start()
+
+
+def stop_background_workers(timeout=None):
+    """优雅关闭：等待进行中的渲染任务完成，停止后台线程和批量渲染进程池"""
+    janitor.stop(timeout)
+    render_queue.shutdown(wait=True)
+    batch_renderer.shutdown(wait=True)
+    unlink_queue.stop(timeout)
+
+
+def create_app(start_workers=True):
+    """
+    应用工厂：执行启动初始化并返回 Flask 应用
+
+    Args:
+        start_workers: 是否立即启动后台线程。预加载后再 fork 的多进程服务器应传 False，
+            在每个工作进程 fork 之后再调用 start_background_workers（线程不会被 fork 复制）
+    """
+    run_startup_tasks()
+    if start_workers:
+        start_background_workers()
+    return app
+
+
+if __name__ == '__main__':
+    # 本地开发服务器；生产环境使用 gunicorn -c gunicorn.conf.py wsgi:app
+    create_app()
+
     host = os.getenv('HOST', '0.0.0.0')
     port = int(os.getenv('PORT', 5000))
     app.run(host=host, port=port, debug=True)
-
@@ -0,0 +1,204 @@
+"""
+批量解析渲染（多进程）
+
+文本解析和生成Excel都是纯 CPU 计算，受 GIL 限制在线程中无法并行，
+因此批量请求中的各项（或多页文本的各页）分发到进程池中执行，一个请求可以用满所有 CPU 核心。
+
+工作进程只依赖 text_parser / workbook_cache / excel_utils，不导入 Flask 应用和数据库；
+生成的工作簿直接写入共享的缓存目录（临时文件 + 原子重命名），由主进程登记到容量统计中。
+"""
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from excel_utils import write_sheet_part
+from metrics import STAGE_LATENCY, observe_workbook
+from text_parser import parse_text_table
+from workbook_cache import WorkbookCache, table_digest
+
+
+def render_text(raw_text, text_format, directory):
+    """
+    在工作进程中解析文本并生成工作簿
+
+    Returns:
+        {"table_data", "text_format", "excel_path", "created", "timings"}，文本无法解析时为 {"error": 原因}
+        timings 为各阶段耗时（秒），由主进程记录到运行指标中
+    """
+    started = time.perf_counter()
+    try:
+        table_data, text_format = parse_text_table(raw_text, text_format)
+    except ValueError as e:
+        return {'error': str(e)}
+    parsed = time.perf_counter()
+    excel_path, created = WorkbookCache(directory).get_or_create(table_data)
+    timings = {'parse': parsed - started}
+    if created:
+        timings['render'] = time.perf_counter() - parsed
+    return {
+        'table_data': table_data,
+        'text_format': text_format,
+        'excel_path': excel_path,
+        'created': created,
+        'timings': timings,
+    }
+
+
+def render_sheet_text(raw_text, text_format, directory):
+    """
+    在工作进程中解析一页文本，并把该页的工作表渲染为压缩好的部件文件（见 excel_utils.write_sheet_part）
+
+    Returns:
+        {"table_data", "text_format", "digest", "part_path", "part", "timings"}，文本无法解析时为 {"error": 原因}
+        部件文件写在 directory 中，由调用方拼装工作簿后删除
+    """
+    started = time.perf_counter()
+    try:
+        table_data, text_format = parse_text_table(raw_text, text_format)
+    except ValueError as e:
+        return {'error': str(e)}
+    parsed = time.perf_counter()
+    part_path = os.path.join(directory, f".{uuid.uuid4().hex}.part")
+    try:
+        with open(part_path, 'wb') as f:
+            part = write_sheet_part(table_data.get('headers', []), table_data.get('rows', []), f)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    rendered = time.perf_counter()
+    return {
+        'table_data': table_data,
+        'text_format': text_format,
+        'digest': table_digest(table_data),
+        'part_path': part_path,
+        'part': part,
+        'timings': {'parse': parsed - started, 'render_sheet': rendered - parsed},
+    }
+
+
+class BatchRenderer:
+    """
+    进程池批量渲染器
+
+    进程池在第一次使用时创建（spawn 方式启动，不继承主进程中的线程和数据库连接）；
+    工作进程异常退出导致进程池损坏时丢弃该进程池，下次调用重新创建。
+    """
+
+    def __init__(self, directory, max_workers=None):
+        self.directory = directory
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+            return self._executor
+
+    def _discard(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def render(self, items):
+        """
+        并行渲染多项文本
+
+        Args:
+            items: [(raw_text, text_format), ...]
+
+        Returns:
+            与 items 顺序一致的结果列表，每项为 render_text 的返回值；
+            工作进程中出现意外错误时该项为 {"error": 原因}
+        """
+        results, in_worker = self._map(render_text, items)
+        for result in results:
+            self._observe(result, in_worker)
+        return results
+
+    def render_sheets(self, items):
+        """
+        并行解析多页文本并渲染各页的工作表部件
+
+        Args:
+            items: [(raw_text, text_format), ...]，每项为一页
+
+        Returns:
+            与 items 顺序一致的结果列表，每项为 render_sheet_text 的返回值或 {"error": 原因}
+        """
+        results, _ = self._map(render_sheet_text, items)
+        for result in results:
+            timings = result.get('timings')
+            if timings:
+                for stage, seconds in timings.items():
+                    STAGE_LATENCY.observe(seconds, stage=stage)
+        return results
+
+    def _map(self, func, items):
+        """
+        对每项执行 func(raw_text, text_format, directory)
+
+        Returns:
+            (结果列表, 是否在工作进程中执行)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # 只有一项或只有一个工作进程时，直接在当前线程执行，省去进程间传输
+        if len(items) <= 1 or self.max_workers <= 1:
+            return [self._call_inline(func, raw_text, text_format) for raw_text, text_format in items], False
+
+        executor = self._get_executor()
+        try:
+            futures = [
+                executor.submit(func, raw_text, text_format, self.directory)
+                for raw_text, text_format in items
+            ]
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                self._discard(executor)
+                results.append({'error': '渲染进程异常退出'})
+            except Exception as e:
+                results.append({'error': str(e)})
+        return results, True
+
+    def _call_inline(self, func, raw_text, text_format):
+        try:
+            return func(raw_text, text_format, self.directory)
+        except Exception as e:
+            return {'error': str(e)}
+
+    @staticmethod
+    def _observe(result, in_worker):
+        """
+        记录各阶段耗时；工作进程中生成工作簿时记录的指标留在了子进程里，
+        这里按返回的耗时补记（在当前进程执行时已由 WorkbookCache 记录）
+        """
+        timings = result.get('timings')
+        if not timings:
+            return
+        STAGE_LATENCY.observe(timings['parse'], stage='parse')
+        if in_worker and result['created']:
+            STAGE_LATENCY.observe(timings['render'], stage='render')
+            observe_workbook(result['excel_path'])
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
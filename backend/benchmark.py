@@ -0,0 +1,391 @@
+"""
+性能基准测试
+
+覆盖文本解析、Excel生成（单表 / 多页）以及通过 Flask 测试客户端走完整的
+解析 → 保存 → 历史列表 → 下载 流程。测试数据为固定随机种子生成的合成表格，
+规模从 10 到 100 万个单元格，形状分为：
+- tall：4 列，行数多
+- wide：200 列（单元格不足时为单元格数），行数少
+- cjk：8 列中文内容（多字节字符、列宽计算和 XML 转义的开销不同）
+
+每个用例在独立的子进程中运行，峰值内存互不影响。结果以 JSON 输出，包括耗时、
+峰值内存（RSS）和输出字节数，可与其他版本的结果对比：
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+    python benchmark.py --sizes 10,10000 --shapes tall --cases parse,excel   # 快速检查
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+CASES = ('parse', 'excel', 'multi_page', 'flow')
+SHAPES = ('tall', 'wide', 'cjk')
+DEFAULT_SIZES = (10, 1000, 10000, 100000, 1000000)
+
+# 多页用例的页数
+MULTI_PAGE_PAGES = 4
+
+_CJK_WORDS = ['北京', '上海', '广州', '深圳', '销售额', '数量', '单价', '备注', '已完成', '处理中',
+              '华东区', '华南区', '产品名称', '客户', '张三', '李四', '王五', '合计', '第一季度', '同比增长']
+
+
+# ===== 合成数据 =====
+
+def table_shape(shape, cells):
+    """返回 (列数, 数据行数)，单元格数（不含表头）约为 cells"""
+    if shape == 'tall':
+        cols = 4
+    elif shape == 'wide':
+        cols = 200
+    else:
+        cols = 8
+    cols = max(1, min(cols, cells))
+    return cols, max(1, cells // cols)
+
+
+def _cell(rng, shape, col):
+    if shape == 'cjk':
+        if col % 4 == 3:
+            return f"{rng.randint(0, 99999)}.{rng.randint(0, 99):02d}"
+        return ''.join(rng.choice(_CJK_WORDS) for _ in range(rng.randint(1, 3)))
+    if col % 3 == 0:
+        return str(rng.randint(0, 10 ** 6))
+    if col % 3 == 1:
+        return f"{rng.random() * 1000:.2f}"
+    return f"item{rng.randint(0, 10 ** 5)}"
+
+
+def make_table(shape, cells, seed=0):
+    """生成表格数据 {"headers": [...], "rows": [[...], ...]}"""
+    rng = random.Random(f"{shape}-{cells}-{seed}")
+    cols, rows = table_shape(shape, cells)
+    headers = [f"列{i + 1}" if shape == 'cjk' else f"col{i + 1}" for i in range(cols)]
+    return {
+        'headers': headers,
+        'rows': [[_cell(rng, shape, c) for c in range(cols)] for _ in range(rows)],
+    }
+
+
+def table_to_text(table_data):
+    """表格转为制表符分隔的文本（与从 Excel 复制粘贴的格式相同）"""
+    lines = ['\t'.join(table_data['headers'])]
+    lines.extend('\t'.join(row) for row in table_data['rows'])
+    return '\n'.join(lines) + '\n'
+
+
+def make_text(shape, cells, seed=0):
+    return table_to_text(make_table(shape, cells, seed))
+
+
+def make_multi_page(shape, cells):
+    per_page = max(1, cells // MULTI_PAGE_PAGES)
+    pages = []
+    for page in range(MULTI_PAGE_PAGES):
+        table = make_table(shape, per_page, seed=page)
+        pages.append({'page': page + 1, **table})
+    return {'pages': pages}
+
+
+# ===== 内存统计 =====
+
+def _reset_peak_rss():
+    """重置进程的峰值 RSS（Linux 4.0+ 支持），成功时返回 True"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_bytes():
+    """进程的峰值 RSS（字节）"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS 返回字节，Linux 返回 KB
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _current_rss_bytes():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+# ===== 用例 =====
+
+def _load_app(workdir):
+    """导入 Flask 应用：使用临时数据库和上传目录，关闭限流，放开请求体大小限制"""
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'benchmark.db')}"
+    os.environ['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+    os.environ['RATE_LIMIT_PER_SECOND'] = '0'
+    os.environ['MAX_FILE_SIZE'] = str(2 * 1024 * 1024 * 1024)
+    os.environ['SAVE_COALESCE_WINDOW_MS'] = '0'
+    import app as app_module
+    return app_module
+
+
+def _setup_parse(shape, cells, workdir):
+    parse_plain_text_table = _load_app(workdir).parse_plain_text_table
+    text = make_text(shape, cells)
+
+    def run(i):
+        table_data = parse_plain_text_table(text, 'auto')
+        return len(json.dumps(table_data, ensure_ascii=False).encode('utf-8'))
+    return run
+
+
+def _setup_excel(shape, cells, workdir):
+    from excel_utils import create_excel_from_table
+    table_data = make_table(shape, cells)
+
+    def run(i):
+        path = os.path.join(workdir, f"table_{i}.xlsx")
+        create_excel_from_table(table_data, path)
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    return run
+
+
+def _setup_multi_page(shape, cells, workdir):
+    from excel_utils import create_excel_from_multi_page
+    data = make_multi_page(shape, cells)
+
+    def run(i):
+        path = os.path.join(workdir, f"multi_{i}.xlsx")
+        create_excel_from_multi_page(data, path)
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    return run
+
+
+def _setup_flow(shape, cells, workdir):
+    """
+    通过测试客户端走完整流程；每轮在文本末尾追加不同的一行，避免命中解析缓存和工作簿缓存
+    """
+    app_module = _load_app(workdir)
+    app, db = app_module.app, app_module.db
+    with app.app_context():
+        db.create_all()
+    client = app.test_client()
+    resp = client.post('/api/register', json={'username': 'benchmark', 'password': 'benchmark'})
+    user_id = resp.get_json()['user']['id']
+
+    text = make_text(shape, cells)
+    cols, _ = table_shape(shape, cells)
+
+    def check(resp, step):
+        if resp.status_code >= 400:
+            raise RuntimeError(f"{step} 失败: HTTP {resp.status_code} {resp.get_data(as_text=True)[:200]}")
+        return resp
+
+    def run(i):
+        raw_text = text + '\t'.join([f"run{i}"] * cols) + '\n'
+        parsed = check(client.post('/api/manual/parse', json={'user_id': user_id, 'raw_text': raw_text}), 'parse')
+        data = parsed.get_json()['data']
+        saved = check(client.post('/api/manual/save', json={
+            'user_id': user_id,
+            'title': data['title'],
+            'raw_text': raw_text,
+            'table_data': data['table_data'],
+            'excel_path': data['excel_path'],
+        }), 'save')
+        record_id = saved.get_json()['record']['id']
+        check(client.get(f'/api/users/{user_id}/manual-records?limit=50'), 'list')
+        download = check(client.get(f'/api/manual/{record_id}/download-excel?user_id={user_id}'), 'download')
+        return len(download.get_data())
+    return run
+
+
+SETUPS = {
+    'parse': _setup_parse,
+    'excel': _setup_excel,
+    'multi_page': _setup_multi_page,
+    'flow': _setup_flow,
+}
+
+
+def run_case(case, shape, cells, repeat):
+    """在当前进程中运行一个用例（由子进程调用），返回结果字典"""
+    workdir = tempfile.mkdtemp(prefix='benchmark-')
+    try:
+        run = SETUPS[case](shape, cells, workdir)
+        baseline_rss = _current_rss_bytes()
+        peak_is_per_case = _reset_peak_rss()
+        timings = []
+        output_bytes = None
+        for i in range(repeat):
+            started = time.perf_counter()
+            output_bytes = run(i)
+            timings.append(time.perf_counter() - started)
+        peak_rss = _peak_rss_bytes()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    cols, rows = table_shape(shape, cells)
+    return {
+        'case': case,
+        'shape': shape,
+        'cells': cells,
+        'rows': rows,
+        'cols': cols,
+        'repeat': repeat,
+        'seconds_min': min(timings),
+        'seconds_median': statistics.median(timings),
+        'seconds_all': timings,
+        'peak_rss_bytes': peak_rss,
+        # 无法重置峰值时，峰值包含准备测试数据的内存
+        'peak_rss_includes_setup': not peak_is_per_case,
+        'rss_growth_bytes': peak_rss - baseline_rss if baseline_rss is not None else None,
+        'output_bytes': output_bytes,
+    }
+
+
+# ===== 调度与报告 =====
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=10,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_in_subprocess(case, shape, cells, repeat, timeout):
+    cmd = [sys.executable, os.path.abspath(__file__), '--run-one', case, shape, str(cells), '--repeat', str(repeat)]
+    try:
+        proc = subprocess.run(cmd, cwd=BACKEND_DIR, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {'case': case, 'shape': shape, 'cells': cells, 'error': f'超时（{timeout}秒）'}
+    # 应用启动时可能打印日志，结果是输出的最后一行
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        return {'case': case, 'shape': shape, 'cells': cells,
+                'error': (proc.stderr.strip().splitlines() or ['未知错误'])[-1]}
+    return json.loads(lines[-1])
+
+
+def _format_bytes(n):
+    if n is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n) < 1024 or unit == 'GB':
+            return f"{n:.0f}{unit}" if unit == 'B' else f"{n:.1f}{unit}"
+        n /= 1024
+
+
+def _key(result):
+    return result['case'], result['shape'], result['cells']
+
+
+def print_report(results, baseline=None, file=sys.stderr):
+    """输出便于阅读的结果表（标准错误输出，不影响标准输出中的 JSON）"""
+    previous = {_key(r): r for r in (baseline or {}).get('results', []) if 'error' not in r}
+    header = f"{'case':<11}{'shape':<6}{'cells':>9}{'median':>11}{'peak RSS':>11}{'output':>11}"
+    if previous:
+        header += f"{'vs base':>10}"
+    print(header, file=file)
+    for r in results:
+        prefix = f"{r['case']:<11}{r['shape']:<6}{r['cells']:>9}"
+        if 'error' in r:
+            print(f"{prefix}  错误: {r['error']}", file=file)
+            continue
+        line = (f"{prefix}{r['seconds_median'] * 1000:>9.1f}ms"
+                f"{_format_bytes(r['peak_rss_bytes']):>11}{_format_bytes(r['output_bytes']):>11}")
+        old = previous.get(_key(r))
+        if old:
+            line += f"{r['seconds_median'] / old['seconds_median']:>9.2f}x"
+        print(line, file=file)
+
+
+def _parse_list(value, allowed=None):
+    items = [v.strip() for v in value.split(',') if v.strip()]
+    if allowed:
+        unknown = [v for v in items if v not in allowed]
+        if unknown:
+            raise argparse.ArgumentTypeError(f"未知的取值 {unknown}，可选 {list(allowed)}")
+    return items
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='解析 / Excel生成 / 完整接口流程的性能基准测试')
+    parser.add_argument('--cases', type=lambda v: _parse_list(v, CASES), default=list(CASES))
+    parser.add_argument('--shapes', type=lambda v: _parse_list(v, SHAPES), default=list(SHAPES))
+    parser.add_argument('--sizes', type=lambda v: [int(s) for s in _parse_list(v)], default=list(DEFAULT_SIZES),
+                        help='单元格数，逗号分隔')
+    parser.add_argument('--repeat', type=int, default=3, help='每个用例的运行次数（取中位数）')
+    parser.add_argument('--timeout', type=int, default=1800, help='单个用例的超时秒数')
+    parser.add_argument('--output', help='结果 JSON 文件路径，不指定时输出到标准输出')
+    parser.add_argument('--compare', help='对比的历史结果 JSON 文件')
+    parser.add_argument('--run-one', nargs=3, metavar=('CASE', 'SHAPE', 'CELLS'), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        case, shape, cells = args.run_one
+        result = run_case(case, shape, int(cells), args.repeat)
+        sys.stdout.write('\n' + json.dumps(result) + '\n')
+        return 0
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = []
+    for case in args.cases:
+        for shape in args.shapes:
+            for cells in args.sizes:
+                print(f"运行 {case} / {shape} / {cells} ...", file=sys.stderr)
+                results.append(run_in_subprocess(case, shape, cells, args.repeat, args.timeout))
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'git_revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+    print_report(results, baseline)
+    return 1 if any('error' in r for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
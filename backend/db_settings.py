@@ -0,0 +1,91 @@
+"""
+数据库连接配置
+
+- SQLite（默认）：每个新连接设置 WAL 日志模式、同步级别、页缓存、内存映射和忙等待超时，
+  读写可以并发进行，写锁冲突时等待而不是立即报 "database is locked"
+- 服务器数据库（通过 DATABASE_URL 指定，如 PostgreSQL / MySQL）：显式配置连接池大小、
+  溢出连接数、获取连接超时和连接回收时间，并在取出连接前检测连接是否可用
+"""
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+SQLITE_PRAGMAS = ('journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'busy_timeout')
+
+
+def is_sqlite(database_uri):
+    return make_url(database_uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(config):
+    """根据数据库类型生成 SQLALCHEMY_ENGINE_OPTIONS"""
+    if is_sqlite(config['SQLALCHEMY_DATABASE_URI']):
+        return {
+            'connect_args': {
+                # sqlite3 驱动层的忙等待（秒），与 busy_timeout pragma 保持一致
+                'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000,
+                # 后台线程（渲染队列、清理线程）与请求线程共用连接池
+                'check_same_thread': False,
+            },
+        }
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+
+def configure_engine(engine, config):
+    """为 SQLite 引擎注册连接初始化（每个新连接执行一次 pragma），其他数据库不做处理"""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        # 负数表示以 KiB 为单位
+        f"PRAGMA cache_size=-{int(config['SQLITE_CACHE_SIZE_KB'])}",
+        f"PRAGMA mmap_size={int(config['SQLITE_MMAP_SIZE'])}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT_MS'])}",
+    ]
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+
+def database_settings(engine):
+    """查询当前实际生效的数据库设置（pragma 可能因文件系统不支持而未生效，以查询结果为准）"""
+    settings = {'backend': engine.dialect.name, 'pool': type(engine.pool).__name__}
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as conn:
+            for name in SQLITE_PRAGMAS:
+                settings[name] = conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+    else:
+        pool = engine.pool
+        for name in ('size', 'timeout'):
+            getter = getattr(pool, name, None)
+            if callable(getter):
+                settings[f'pool_{name}'] = getter()
+        settings['max_overflow'] = getattr(pool, '_max_overflow', None)
+        settings['pool_recycle'] = getattr(pool, '_recycle', None)
+    return settings
+
+
+def report_database_settings(engine, config):
+    """启动检查：打印实际生效的数据库设置，与配置不一致时给出提示"""
+    settings = database_settings(engine)
+    print('数据库设置: ' + ', '.join(f'{k}={v}' for k, v in settings.items()))
+
+    if settings['backend'] == 'sqlite':
+        expected = str(config['SQLITE_JOURNAL_MODE']).lower()
+        actual = str(settings.get('journal_mode', '')).lower()
+        if actual != expected:
+            print(f"警告: SQLite journal_mode 配置为 {expected}，实际为 {actual}（数据库所在文件系统可能不支持）")
+    return settings
@@ -1,138 +1,629 @@
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, Border, Side
-from openpyxl.utils import get_column_letter
+"""
+Excel 生成工具
+
+不再使用 openpyxl 的内存工作簿模型，而是直接流式写出 xlsx（zip + XML）：
+- 行数据逐行序列化并压缩写入，内存占用与表格大小无关
+- 所有单元格共用 styles.xml 中预定义的命名样式（表头 / 数据），不再逐个单元格创建样式对象
+- 列宽在写入行的同一遍中统计，不再对 rows 做第二遍扫描
+"""
 import os
+import re
+import struct
+import tempfile
+import time
 import uuid
+import zipfile
+import zlib
+from functools import lru_cache
 
 
-def create_excel_from_table(table_data, output_path):
-    """从表格数据创建Excel文件"""
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "表格数据"
-    
-    # 获取表头和行数据
-    headers = table_data.get('headers', [])
-    rows = table_data.get('rows', [])
-    
-    # 样式定义（不使用背景颜色，保持简洁，所有文字黑色，不换行）
-    # 明确设置黑色字体（000000是黑色）
-    header_font = Font(bold=True, size=11, color="000000")  # 黑色加粗
-    data_font = Font(size=11, color="000000")  # 黑色普通
-    border = Border(
-        left=Side(style='thin', color="000000"),
-        right=Side(style='thin', color="000000"),
-        top=Side(style='thin', color="000000"),
-        bottom=Side(style='thin', color="000000")
-    )
-    center_alignment = Alignment(horizontal='center', vertical='center', wrap_text=False, shrink_to_fit=False)
-    left_alignment = Alignment(horizontal='left', vertical='center', wrap_text=False, shrink_to_fit=False)
-    
-    # 写入表头
+# 样式索引（对应 styles.xml 中 cellXfs 的顺序）
+STYLE_HEADER = 1
+STYLE_DATA = 2
+
+# 列宽范围（与原 openpyxl 实现一致：内容长度 + 2，最小10，最大50）
+MIN_COLUMN_WIDTH = 10
+MAX_COLUMN_WIDTH = 50
+
+# 每累计多少行向 zip 流写一次（减少小块写入的开销）
+ROWS_PER_FLUSH = 256
+
+# 未预先给出列宽时，sheetData 先写入临时缓冲；超过该大小后转存到临时文件，保证内存恒定
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+# 流式输出时每次从缓冲区读取 / 向调用方交付的数据块大小
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# 压缩级别：xlsx 中的 XML 重复度很高，低压缩级别即可获得大部分收益且速度快得多
+ZIP_COMPRESSLEVEL = 1
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+ZIP_MIMETYPE = 'application/zip'
+
+_NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_XML_DECL = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# XML 1.0 不允许的控制字符（openpyxl 遇到会直接抛异常，这里直接剔除）
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+# 工作表名称中不允许出现的字符
+_INVALID_SHEET_CHARS = re.compile(r'[\[\]:*?/\\]')
+
+_XML_ESCAPES = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;'})
+
+# 黑色细边框、黑色字体、居中不换行（不使用背景颜色，保持简洁）
+_STYLES_XML = (
+    _XML_DECL
+    + f'<styleSheet xmlns="{_NS_MAIN}">'
+    '<fonts count="2">'
+    '<font><sz val="11"/><color rgb="FF000000"/><name val="Calibri"/><family val="2"/></font>'
+    '<font><b/><sz val="11"/><color rgb="FF000000"/><name val="Calibri"/><family val="2"/></font>'
+    '</fonts>'
+    '<fills count="2">'
+    '<fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill>'
+    '</fills>'
+    '<borders count="2">'
+    '<border><left/><right/><top/><bottom/><diagonal/></border>'
+    '<border>'
+    '<left style="thin"><color rgb="FF000000"/></left>'
+    '<right style="thin"><color rgb="FF000000"/></right>'
+    '<top style="thin"><color rgb="FF000000"/></top>'
+    '<bottom style="thin"><color rgb="FF000000"/></bottom>'
+    '<diagonal/>'
+    '</border>'
+    '</borders>'
+    '<cellStyleXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="1" applyFont="1" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="1" applyFont="1" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+    '</cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="1" xfId="1" applyFont="1" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="1" xfId="2" applyFont="1" applyBorder="1" applyAlignment="1">'
+    '<alignment horizontal="center" vertical="center"/></xf>'
+    '</cellXfs>'
+    '<cellStyles count="3">'
+    '<cellStyle name="Normal" xfId="0" builtinId="0"/>'
+    '<cellStyle name="表头" xfId="1"/>'
+    '<cellStyle name="数据" xfId="2"/>'
+    '</cellStyles>'
+    '</styleSheet>'
+)
+
+_ROOT_RELS_XML = (
+    _XML_DECL
+    + f'<Relationships xmlns="{_NS_PKG_REL}">'
+    f'<Relationship Id="rId1" Type="{_NS_REL}/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+
+_SHEET_HEAD = (
+    _XML_DECL
+    + f'<worksheet xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}">'
+)
+_SHEET_DATA_OPEN = '<sheetData>'
+_SHEET_TAIL = '</sheetData></worksheet>'
+
+
+@lru_cache(maxsize=None)
+def _column_letter(col_idx):
+    """0 起始的列序号转换为列字母（A, B, ..., AA, ...）"""
+    n = col_idx + 1
+    letters = ''
+    while n:
+        n, rem = divmod(n - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _xml_text(text):
+    """转义单元格文本，并剔除 XML 不允许的控制字符"""
+    text = text.translate(_XML_ESCAPES)
+    if _ILLEGAL_XML_CHARS.search(text):
+        text = _ILLEGAL_XML_CHARS.sub('', text)
+    return text
+
+
+def column_width(max_length):
+    """根据列内最长内容计算列宽（最小10，最大50）"""
+    return min(max(max_length + 2, MIN_COLUMN_WIDTH), MAX_COLUMN_WIDTH)
+
+
+def compute_column_widths(headers, rows):
+    """预先统计每列的最大内容长度（用于无需缓冲、直接流式输出的场景）"""
+    lengths = [len(str(h)) if h is not None else 0 for h in headers]
+    for row in rows:
+        if len(row) > len(lengths):
+            lengths.extend([0] * (len(row) - len(lengths)))
+        for col_idx, value in enumerate(row):
+            length = len(str(value)) if value is not None else 0
+            if length > lengths[col_idx]:
+                lengths[col_idx] = length
+    return lengths
+
+
+def render_row(row_num, values, style, lengths=None):
+    """
+    将一行序列化为 sheetData 中的 <row> 元素
+
+    Args:
+        row_num: 行号（1 起始）
+        values: 单元格值列表
+        style: 样式索引（STYLE_HEADER / STYLE_DATA）
+        lengths: 如果提供，同时更新每列的最大内容长度（原地修改）
+    """
+    parts = [f'<row r="{row_num}">']
+    for col_idx, value in enumerate(values):
+        text = str(value) if value is not None else ""
+        ref = f'{_column_letter(col_idx)}{row_num}'
+        if lengths is not None:
+            if col_idx >= len(lengths):
+                lengths.append(0)
+            if len(text) > lengths[col_idx]:
+                lengths[col_idx] = len(text)
+        if text:
+            space = ' xml:space="preserve"' if text[0].isspace() or text[-1].isspace() else ''
+            parts.append(
+                f'<c r="{ref}" s="{style}" t="inlineStr"><is><t{space}>{_xml_text(text)}</t></is></c>'
+            )
+        else:
+            parts.append(f'<c r="{ref}" s="{style}"/>')
+    parts.append('</row>')
+    return ''.join(parts)
+
+
+def iter_sheet_rows(headers, rows, lengths=None):
+    """逐块生成 sheetData 的行 XML（表头 + 数据行），每块包含若干行"""
+    buffer = []
     if headers:
-        for col_idx, header in enumerate(headers, start=1):
-            cell = ws.cell(row=1, column=col_idx, value=str(header))
-            cell.font = header_font
-            cell.border = border
-            cell.alignment = center_alignment
-            # 不设置 fill，使用默认的白色背景（无填充）
-    
-    # 写入数据行
-    for row_idx, row_data in enumerate(rows, start=2):
-        for col_idx, cell_value in enumerate(row_data, start=1):
-            cell = ws.cell(row=row_idx, column=col_idx, value=str(cell_value) if cell_value is not None else "")
-            cell.font = data_font
-            cell.border = border
-            cell.alignment = center_alignment  # 数据行也居中
-            # 不设置 fill，使用默认的白色背景（无填充）
-    
-    # 自动调整列宽
-    for col_idx in range(1, len(headers) + 1):
-        column_letter = get_column_letter(col_idx)
-        max_length = 0
-        
-        # 检查表头长度
-        if headers and col_idx <= len(headers):
-            max_length = len(str(headers[col_idx - 1]))
-        
-        # 检查数据行长度
-        for row in rows:
-            if col_idx <= len(row):
-                cell_value = str(row[col_idx - 1]) if row[col_idx - 1] is not None else ""
-                max_length = max(max_length, len(cell_value))
-        
-        # 设置列宽（最小10，最大50）
-        adjusted_width = min(max(max_length + 2, 10), 50)
-        ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # 保存文件
-    wb.save(output_path)
+        buffer.append(render_row(1, headers, STYLE_HEADER, lengths))
+    for row_num, row_data in enumerate(rows, start=2):
+        buffer.append(render_row(row_num, row_data, STYLE_DATA, lengths))
+        if len(buffer) >= ROWS_PER_FLUSH:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def render_cols(lengths):
+    """根据每列最大内容长度生成 <cols> 元素"""
+    if not lengths:
+        return ''
+    cols = ''.join(
+        f'<col min="{i}" max="{i}" width="{column_width(length)}" customWidth="1"/>'
+        for i, length in enumerate(lengths, start=1)
+    )
+    return f'<cols>{cols}</cols>'
+
+
+def _sheet_name(title, used):
+    """清理工作表名称（去除非法字符、截断到31个字符、去重）"""
+    name = _INVALID_SHEET_CHARS.sub('_', str(title or '')).strip("'") or 'Sheet'
+    name = name[:31]
+    candidate, n = name, 1
+    while candidate.lower() in used:
+        n += 1
+        suffix = f'_{n}'
+        candidate = name[:31 - len(suffix)] + suffix
+    used.add(candidate.lower())
+    return candidate
+
+
+def _workbook_parts(sheet_names):
+    """工作簿级别的元数据部件 [(归档内路径, XML)]，工作表依次为 sheet1.xml、sheet2.xml ……"""
+    sheets = ''.join(
+        f'<sheet name="{_xml_text(name)}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, name in enumerate(sheet_names, start=1)
+    )
+    workbook_xml = (
+        _XML_DECL
+        + f'<workbook xmlns="{_NS_MAIN}" xmlns:r="{_NS_REL}"><sheets>{sheets}</sheets></workbook>'
+    )
+
+    count = len(sheet_names)
+    rels = ''.join(
+        f'<Relationship Id="rId{i}" Type="{_NS_REL}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, count + 1)
+    )
+    rels += f'<Relationship Id="rId{count + 1}" Type="{_NS_REL}/styles" Target="styles.xml"/>'
+    workbook_rels_xml = _XML_DECL + f'<Relationships xmlns="{_NS_PKG_REL}">{rels}</Relationships>'
+
+    overrides = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, count + 1)
+    )
+    content_types_xml = (
+        _XML_DECL
+        + '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        f'{overrides}</Types>'
+    )
+
+    return [
+        ('xl/styles.xml', _STYLES_XML),
+        ('xl/workbook.xml', workbook_xml),
+        ('xl/_rels/workbook.xml.rels', workbook_rels_xml),
+        ('_rels/.rels', _ROOT_RELS_XML),
+        ('[Content_Types].xml', content_types_xml),
+    ]
+
+
+class _ChunkBuffer:
+    """只支持 write() 的内存缓冲区，供流式输出时逐块取走已生成的数据"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+class XlsxStreamWriter:
+    """
+    流式 xlsx 写入器
+
+    用法：
+        with XlsxStreamWriter(fileobj) as writer:
+            writer.write_sheet("表格数据", headers, rows)
+
+    fileobj 只需支持 write()（可以是不可 seek 的流，例如 HTTP 响应缓冲区）。
+    """
+
+    def __init__(self, fileobj):
+        self._zip = zipfile.ZipFile(
+            fileobj, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=ZIP_COMPRESSLEVEL
+        )
+        self._sheet_names = []
+        self._used_names = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+    def abort(self):
+        """出错时丢弃未完成的工作簿（不再写入元数据部件）"""
+        try:
+            self._zip.close()
+        except Exception:
+            pass
+
+    def _open_sheet(self, title):
+        name = _sheet_name(title, self._used_names)
+        self._sheet_names.append(name)
+        part = f'xl/worksheets/sheet{len(self._sheet_names)}.xml'
+        return self._zip.open(part, 'w', force_zip64=True)
+
+    def write_sheet(self, title, headers, rows, column_lengths=None):
+        """
+        写入一个工作表
+
+        Args:
+            title: 工作表名称
+            headers: 表头列表
+            rows: 数据行（任意可迭代对象，逐行消费）
+            column_lengths: 每列最大内容长度。提供时直接流式写出；
+                否则在写入行的同时统计，sheetData 先写入临时缓冲，最后补上 <cols>
+        """
+        for _ in self.iter_write_sheet(title, headers, rows, column_lengths):
+            pass
+
+    def iter_write_sheet(self, title, headers, rows, column_lengths=None):
+        """与 write_sheet 相同，但每写入一块行数据就 yield 一次，便于调用方及时取走已压缩的数据"""
+        if column_lengths is not None:
+            with self._open_sheet(title) as sheet:
+                sheet.write((_SHEET_HEAD + render_cols(column_lengths) + _SHEET_DATA_OPEN).encode('utf-8'))
+                for chunk in iter_sheet_rows(headers, rows):
+                    sheet.write(chunk.encode('utf-8'))
+                    yield
+                sheet.write(_SHEET_TAIL.encode('utf-8'))
+            yield
+            return
+
+        lengths = []
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as spool:
+            for chunk in iter_sheet_rows(headers, rows, lengths):
+                spool.write(chunk.encode('utf-8'))
+            spool.seek(0)
+            with self._open_sheet(title) as sheet:
+                sheet.write((_SHEET_HEAD + render_cols(lengths) + _SHEET_DATA_OPEN).encode('utf-8'))
+                while True:
+                    block = spool.read(STREAM_CHUNK_SIZE)
+                    if not block:
+                        break
+                    sheet.write(block)
+                    yield
+                sheet.write(_SHEET_TAIL.encode('utf-8'))
+            yield
+
+    def close(self):
+        """写入工作簿级别的元数据部件并结束 zip"""
+        if not self._sheet_names:
+            # 工作簿至少需要一个工作表
+            self.write_sheet('Sheet', [], [], column_lengths=[])
+
+        for arcname, xml in _workbook_parts(self._sheet_names):
+            self._zip.writestr(arcname, xml)
+        self._zip.close()
+
+
+def _write_atomic(output_path, write):
+    """先写入同目录下的临时文件，完成后再原子替换，避免读到写了一半的文件"""
+    directory = os.path.dirname(os.path.abspath(output_path))
+    tmp_path = os.path.join(directory, f'.{uuid.uuid4().hex}.tmp')
+    try:
+        with open(tmp_path, 'wb') as f:
+            write(f)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
     return output_path
 
 
+def write_excel_from_table(table_data, fileobj):
+    """将表格数据以 xlsx 格式写入文件对象"""
+    with XlsxStreamWriter(fileobj) as writer:
+        writer.write_sheet("表格数据", table_data.get('headers', []), table_data.get('rows', []))
+
+
+def write_excel_from_rows(headers, rows, fileobj, title="表格数据"):
+    """将逐行产出的数据以 xlsx 格式写入文件对象（rows 可以是生成器，只遍历一次）"""
+    with XlsxStreamWriter(fileobj) as writer:
+        writer.write_sheet(title, headers, rows)
+
+
+def write_excel_from_multi_page(multi_page_data, fileobj):
+    """将多页表格数据以 xlsx 格式写入文件对象（每页一个工作表）"""
+    with XlsxStreamWriter(fileobj) as writer:
+        for page_idx, page_data in enumerate(multi_page_data.get('pages', [])):
+            page_num = page_data.get('page', page_idx + 1)
+            writer.write_sheet(
+                f"第{page_num}页",
+                page_data.get('headers', []),
+                page_data.get('rows', []),
+            )
+
+
+def create_excel_from_table(table_data, output_path):
+    """从表格数据创建Excel文件"""
+    return _write_atomic(output_path, lambda f: write_excel_from_table(table_data, f))
+
+
 def create_excel_from_multi_page(multi_page_data, output_path):
     """从多页表格数据创建Excel文件（每页一个工作表）"""
-    wb = Workbook()
-    wb.remove(wb.active)  # 删除默认工作表
-    
-    pages = multi_page_data.get('pages', [])
-    
-    for page_idx, page_data in enumerate(pages):
-        # 创建新工作表
-        page_num = page_data.get('page', page_idx + 1)
-        ws = wb.create_sheet(title=f"第{page_num}页")
-        
-        # 获取表头和行数据
-        headers = page_data.get('headers', [])
-        rows = page_data.get('rows', [])
-        
-        # 样式定义（不使用背景颜色，保持简洁，所有文字黑色，不换行）
-        header_font = Font(bold=True, size=11, color="000000")  # 黑色加粗
-        data_font = Font(size=11, color="000000")  # 黑色普通
-        border = Border(
-            left=Side(style='thin', color="000000"),
-            right=Side(style='thin', color="000000"),
-            top=Side(style='thin', color="000000"),
-            bottom=Side(style='thin', color="000000")
+    return _write_atomic(output_path, lambda f: write_excel_from_multi_page(multi_page_data, f))
+
+
+def iter_excel_from_sheets(sheets):
+    """
+    逐块生成包含多个工作表的 xlsx 文件内容（bytes），不落盘，适合直接作为 HTTP 响应体流式返回
+
+    Args:
+        sheets: 可迭代的 (工作表名称, 表头, 数据行列表)，可以是生成器；
+            每个工作表写完后才取下一个，内存中同时只需持有一个工作表的数据
+
+    列宽根据当前工作表的数据预先统计，因此无需缓冲 sheetData，内存占用只取决于块大小和单个工作表。
+    """
+    buffer = _ChunkBuffer()
+    writer = XlsxStreamWriter(buffer)
+    try:
+        written = 0
+        for title, headers, rows in sheets:
+            for _ in writer.iter_write_sheet(
+                title, headers, rows, column_lengths=compute_column_widths(headers, rows)
+            ):
+                data = buffer.drain()
+                if data:
+                    yield data
+            written += 1
+        if not written:
+            # 工作簿至少需要一个工作表
+            writer.write_sheet("Sheet", [], [])
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+def iter_excel_from_table(table_data):
+    """逐块生成单个表格的 xlsx 文件内容（bytes），不落盘"""
+    return iter_excel_from_sheets([
+        ("表格数据", table_data.get('headers', []), table_data.get('rows', [])),
+    ])
+
+
+def iter_zip_of_files(entries):
+    """
+    逐块生成包含多个文件的 ZIP 归档（bytes），边读取文件边输出，不缓冲整个归档
+
+    Args:
+        entries: 可迭代的 (归档内文件名, 磁盘文件路径)，可以是生成器（按需生成文件）
+
+    xlsx 本身已经是压缩格式，归档中直接存储（ZIP_STORED），不再重复压缩。
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for arcname, path in entries:
+            with open(path, 'rb') as src, zf.open(arcname, 'w', force_zip64=True) as dst:
+                while True:
+                    chunk = src.read(STREAM_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    data = buffer.drain()
+    if data:
+        yield data
+
+
+# ===== 分别渲染的工作表部件（多进程并行渲染后拼装为一个工作簿） =====
+
+# ZIP 结构（不使用 Zip64，单个部件和整个工作簿都不能超过 4GB）
+_ZIP_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_ZIP_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_ZIP_END_RECORD = struct.Struct('<IHHHHIIH')
+_ZIP_VERSION = 20
+_ZIP_LIMIT = 0xFFFFFFFF
+
+
+def write_sheet_part(headers, rows, fileobj):
+    """
+    将一个工作表的 XML 以原始 deflate 流写入文件对象（不含 zip 头），
+    之后可由 write_excel_from_sheet_parts 直接拷贝进工作簿，不再重新压缩
+
+    Returns:
+        {"crc32", "compress_size", "file_size"}
+    """
+    compressor = zlib.compressobj(ZIP_COMPRESSLEVEL, zlib.DEFLATED, -15)
+    crc = 0
+    file_size = 0
+    compress_size = 0
+
+    def write(text):
+        nonlocal crc, file_size, compress_size
+        data = text.encode('utf-8')
+        crc = zlib.crc32(data, crc)
+        file_size += len(data)
+        compressed = compressor.compress(data)
+        if compressed:
+            fileobj.write(compressed)
+            compress_size += len(compressed)
+
+    write(_SHEET_HEAD + render_cols(compute_column_widths(headers, rows)) + _SHEET_DATA_OPEN)
+    for chunk in iter_sheet_rows(headers, rows):
+        write(chunk)
+    write(_SHEET_TAIL)
+    compressed = compressor.flush()
+    fileobj.write(compressed)
+    compress_size += len(compressed)
+    return {'crc32': crc, 'compress_size': compress_size, 'file_size': file_size}
+
+
+class _RawZipWriter:
+    """只写的 ZIP 写入器：可以直接写入已压缩好的 deflate 数据（zipfile 不支持）"""
+
+    def __init__(self, fileobj):
+        self._fp = fileobj
+        self._offset = 0
+        self._entries = []
+        t = time.localtime()
+        self._dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+        self._dos_date = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+    def _write(self, data):
+        self._fp.write(data)
+        self._offset += len(data)
+
+    def add_compressed(self, arcname, chunks, crc32, compress_size, file_size):
+        """写入一个已经 deflate 压缩的文件，chunks 为压缩数据块的可迭代对象"""
+        if max(self._offset, compress_size, file_size) >= _ZIP_LIMIT:
+            raise ValueError('工作簿超过 4GB，无法拼装')
+        name = arcname.encode('utf-8')
+        entry = (name, crc32, compress_size, file_size, self._offset)
+        self._write(_ZIP_LOCAL_HEADER.pack(
+            0x04034b50, _ZIP_VERSION, 0x800, zipfile.ZIP_DEFLATED, self._dos_time, self._dos_date,
+            crc32, compress_size, file_size, len(name), 0,
+        ) + name)
+        written = 0
+        for chunk in chunks:
+            self._write(chunk)
+            written += len(chunk)
+        if written != compress_size:
+            raise ValueError(f'{arcname} 的压缩数据长度不一致')
+        self._entries.append(entry)
+
+    def add_bytes(self, arcname, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        compressor = zlib.compressobj(ZIP_COMPRESSLEVEL, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        self.add_compressed(arcname, [compressed], zlib.crc32(data), len(compressed), len(data))
+
+    def close(self):
+        start = self._offset
+        for name, crc32, compress_size, file_size, offset in self._entries:
+            self._write(_ZIP_CENTRAL_HEADER.pack(
+                0x02014b50, _ZIP_VERSION, _ZIP_VERSION, 0x800, zipfile.ZIP_DEFLATED,
+                self._dos_time, self._dos_date, crc32, compress_size, file_size,
+                len(name), 0, 0, 0, 0, 0, offset,
+            ) + name)
+        if self._offset >= _ZIP_LIMIT:
+            raise ValueError('工作簿超过 4GB，无法拼装')
+        count = len(self._entries)
+        self._write(_ZIP_END_RECORD.pack(0x06054b50, 0, 0, count, count, self._offset - start, start, 0))
+
+
+def _iter_file(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+def write_excel_from_sheet_parts(parts, fileobj):
+    """
+    将 write_sheet_part 生成的工作表部件拼装为工作簿
+
+    Args:
+        parts: [(工作表名称, 部件文件路径, write_sheet_part 的返回值), ...]，按工作表顺序
+    """
+    writer = _RawZipWriter(fileobj)
+    used = set()
+    names = []
+    for i, (title, path, info) in enumerate(parts, start=1):
+        names.append(_sheet_name(title, used))
+        writer.add_compressed(
+            f'xl/worksheets/sheet{i}.xml', _iter_file(path),
+            info['crc32'], info['compress_size'], info['file_size'],
         )
-        center_alignment = Alignment(horizontal='center', vertical='center', wrap_text=False, shrink_to_fit=False)
-        left_alignment = Alignment(horizontal='left', vertical='center', wrap_text=False, shrink_to_fit=False)
-        
-        # 写入表头
-        if headers:
-            for col_idx, header in enumerate(headers, start=1):
-                cell = ws.cell(row=1, column=col_idx, value=str(header))
-                cell.font = header_font
-                cell.border = border
-                cell.alignment = center_alignment
-                # 不设置 fill，使用默认的白色背景（无填充）
-        
-        # 写入数据行
-        for row_idx, row_data in enumerate(rows, start=2):
-            for col_idx, cell_value in enumerate(row_data, start=1):
-                cell = ws.cell(row=row_idx, column=col_idx, value=str(cell_value) if cell_value is not None else "")
-                cell.font = data_font
-                cell.border = border
-                cell.alignment = center_alignment  # 数据行也居中
-                # 不设置 fill，使用默认的白色背景（无填充）
-        
-        # 自动调整列宽
-        for col_idx in range(1, len(headers) + 1):
-            column_letter = get_column_letter(col_idx)
-            max_length = 0
-            
-            if headers and col_idx <= len(headers):
-                max_length = len(str(headers[col_idx - 1]))
-            
-            for row in rows:
-                if col_idx <= len(row):
-                    cell_value = str(row[col_idx - 1]) if row[col_idx - 1] is not None else ""
-                    max_length = max(max_length, len(cell_value))
-            
-            adjusted_width = min(max(max_length + 2, 10), 50)
-            ws.column_dimensions[column_letter].width = adjusted_width
-    
-    # 保存文件
-    wb.save(output_path)
-    return output_path
+    if not names:
+        # 工作簿至少需要一个工作表
+        names.append('Sheet')
+        writer.add_bytes('xl/worksheets/sheet1.xml', _SHEET_HEAD + _SHEET_DATA_OPEN + _SHEET_TAIL)
+    for arcname, xml in _workbook_parts(names):
+        writer.add_bytes(arcname, xml)
+    writer.close()
+
 
+def create_excel_from_sheet_parts(parts, output_path):
+    """由工作表部件创建Excel文件（见 write_excel_from_sheet_parts）"""
+    return _write_atomic(output_path, lambda f: write_excel_from_sheet_parts(parts, f))
@@ -0,0 +1,54 @@
+"""
+gunicorn 配置（生产环境）
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+所有参数都可以通过环境变量调整：
+- WEB_WORKERS: 工作进程数（默认 CPU 核心数 * 2 + 1，最多 8 个；SQLite 下进程过多只会增加写锁竞争）
+  每个工作进程的批量解析进程池默认为 CPU 核心数 / 工作进程数（至少 1 个），可用 BATCH_PARSE_WORKERS 指定
+- WEB_THREADS: 每个工作进程的线程数（默认 4）
+- WEB_MAX_REQUESTS / WEB_MAX_REQUESTS_JITTER: 工作进程处理一定数量的请求后自动重启，回收内存增长
+- WEB_TIMEOUT: 单个请求的最长处理时间（秒）
+- WEB_GRACEFUL_TIMEOUT: 收到关闭信号后等待进行中的请求和渲染任务完成的时间（秒）
+"""
+import multiprocessing
+import os
+
+bind = f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '5000')}"
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_WORKERS') or min(multiprocessing.cpu_count() * 2 + 1, 8))
+# 供应用按工作进程数确定每个进程的批量解析进程池大小（BATCH_PARSE_WORKERS）
+os.environ['WEB_WORKERS'] = str(workers)
+threads = int(os.getenv('WEB_THREADS', 4))
+
+# 在主进程中加载应用（见 wsgi.py），工作进程 fork 后共享已导入的模块
+preload_app = True
+
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 1000))
+# 随机抖动，避免所有工作进程同时重启
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 100))
+
+timeout = int(os.getenv('WEB_TIMEOUT', 120))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    """工作进程 fork 之后：丢弃从主进程继承的数据库连接，启动本进程的后台线程"""
+    from app import app, db, start_background_workers
+
+    with app.app_context():
+        # close=False：不关闭主进程仍在使用的连接，只让本进程重新建立连接
+        db.engine.dispose(close=False)
+    start_background_workers()
+
+
+def worker_exit(server, worker):
+    """工作进程退出前（max_requests 回收或收到关闭信号）：等待后台任务完成后再退出"""
+    from app import stop_background_workers
+
+    stop_background_workers(timeout=graceful_timeout)
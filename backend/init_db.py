@@ -1,10 +1,12 @@
 """初始化数据库"""
 from app import app, db
-from models import User, FileRecord, TextRecord
+from models import User, FileRecord, TextRecord, ensure_schema
+from db_settings import report_database_settings
 
 with app.app_context():
-    # 创建所有表
-    db.create_all()
+    report_database_settings(db.engine, app.config)
+    # 创建所有表及缺失的索引
+    ensure_schema()
     print("数据库初始化完成！")
     print("已创建表：users, file_records, text_records")
 
@@ -0,0 +1,161 @@
+"""
+孤立Excel文件清理（后台定时执行，不在请求路径上）
+
+- 维护一份被历史记录引用的文件名索引：首次全量加载（只查询 id / excel_path 两列），
+  之后每轮只增量读取 id 更大的新记录，并定期全量重建
+- 每轮只检查索引中没有、且超过最大存活时间的文件；删除前再用 excel_path 索引精确确认一次
+- 删除历史记录时的文件清理由 unlink_queue 负责，这里只处理从未被保存的临时文件
+- 每轮清理后依次执行 add_task 注册的其他维护任务（如过期的后台解析任务）
+"""
+import os
+import threading
+import time
+import traceback
+
+from metrics import STAGE_LATENCY, ORPHANS_DELETED
+from models import db, TextRecord
+
+# 临时文件 / 工作表部件的最短保留时间（秒），与 max_age_seconds 无关：
+# 即使立即清理（max_age_seconds=0），也不能删除正在写入的临时文件
+TEMP_FILE_MIN_AGE_SECONDS = 600
+
+
+class OrphanJanitor:
+    """定时清理 uploads/excel 中未被任何历史记录引用的文件"""
+
+    def __init__(self, app, directory, project_root, max_age_seconds=3600,
+                 interval_seconds=300, full_rescan_seconds=3600):
+        self.app = app
+        self.directory = directory
+        self.project_root = project_root
+        self.max_age_seconds = max_age_seconds
+        self.interval_seconds = interval_seconds
+        self.full_rescan_seconds = full_rescan_seconds
+
+        self._referenced = set()  # 被引用的文件名
+        self._last_record_id = 0
+        self._last_full_scan = 0.0
+        self._tasks = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """启动后台清理线程（重复调用无副作用）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='excel-janitor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def add_task(self, task):
+        """注册每轮清理后执行的维护任务（无参数，在应用上下文中调用）"""
+        self._tasks.append(task)
+
+    def _loop(self):
+        while not self._stop.wait(self.interval_seconds):
+            try:
+                with self.app.app_context():
+                    deleted = self.run_once()
+                if deleted:
+                    print(f"后台清理了 {len(deleted)} 个孤立文件")
+            except Exception:
+                print(f"清理孤立文件时出错:\n{traceback.format_exc()}")
+            for task in self._tasks:
+                try:
+                    with self.app.app_context():
+                        task()
+                except Exception:
+                    print(f"执行维护任务 {task.__name__} 时出错:\n{traceback.format_exc()}")
+
+    def _refresh_index(self, full=False):
+        """刷新被引用文件名索引：全量重建或只读取新增记录"""
+        now = time.time()
+        if full or now - self._last_full_scan >= self.full_rescan_seconds:
+            rows = db.session.query(TextRecord.id, TextRecord.excel_path).all()
+            self._referenced = set()
+            self._last_record_id = 0
+            self._last_full_scan = now
+        else:
+            rows = db.session.query(TextRecord.id, TextRecord.excel_path).filter(
+                TextRecord.id > self._last_record_id
+            ).all()
+
+        for record_id, excel_path in rows:
+            if excel_path:
+                self._referenced.add(os.path.basename(excel_path))
+            if record_id > self._last_record_id:
+                self._last_record_id = record_id
+
+    def _is_referenced(self, path):
+        """按 excel_path 索引精确确认文件是否被引用（兼容相对路径存储）"""
+        candidates = [path, os.path.relpath(path, self.project_root)]
+        return db.session.query(TextRecord.id).filter(
+            TextRecord.excel_path.in_(candidates)
+        ).first() is not None
+
+    def run_once(self, max_age_seconds=None, full=False):
+        """
+        执行一轮清理，需在应用上下文中调用
+
+        Args:
+            max_age_seconds: 只删除超过该时间未使用的文件（默认使用初始化时的配置）
+            full: 是否全量重建引用索引
+
+        Returns:
+            删除的文件名列表
+        """
+        if max_age_seconds is None:
+            max_age_seconds = self.max_age_seconds
+
+        with self._lock, STAGE_LATENCY.time(stage='cleanup'):
+            self._refresh_index(full=full)
+            now = time.time()
+            cutoff = now - max_age_seconds
+            temp_cutoff = now - max(max_age_seconds, TEMP_FILE_MIN_AGE_SECONDS)
+
+            deleted = []
+            try:
+                entries = list(os.scandir(self.directory))
+            except FileNotFoundError:
+                return deleted
+
+            for entry in entries:
+                name = entry.name
+                if name.endswith(('.tmp', '.part')):
+                    # 写入过程中进程异常退出留下的临时文件 / 工作表部件
+                    self._remove_stale_temp(entry, temp_cutoff)
+                    continue
+                if not name.endswith('.xlsx') or name in self._referenced:
+                    continue
+                try:
+                    if entry.stat().st_mtime > cutoff:
+                        continue
+                    path = os.path.abspath(entry.path)
+                    if self._is_referenced(path):
+                        self._referenced.add(name)
+                        continue
+                    os.remove(path)
+                    deleted.append(name)
+                except FileNotFoundError:
+                    continue
+                except Exception as e:
+                    print(f"删除孤立文件失败 {name}: {str(e)}")
+
+            ORPHANS_DELETED.inc(len(deleted))
+            return deleted
+
+    @staticmethod
+    def _remove_stale_temp(entry, cutoff):
+        try:
+            if entry.stat().st_mtime <= cutoff:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"删除临时文件失败 {entry.name}: {str(e)}")
@@ -0,0 +1,415 @@
+"""
+本地压力测试
+
+模拟真实用户会话压测本地启动的后端：注册/登录，然后循环执行
+解析（manual/parse）→ 保存（manual/save）→ 历史列表 → 下载，每保存若干条批量删除一次。
+按接口统计 p50/p95/p99 延迟、吞吐量和错误率，可设置 SLO 阈值，超出时以非零状态退出。
+
+    # 压测已经启动的后端
+    python loadtest.py --url http://127.0.0.1:5000 --users 20 --duration 60
+
+    # 自动用 gunicorn 启动一个使用临时数据库的后端（关闭限流），压测结束后关闭
+    python loadtest.py --start --users 20 --duration 60 --slo-p95-ms 500 --max-error-rate 0.01
+
+注意：按用户限流默认开启，压测已有的后端时 429 会计入错误（单独列出），
+需要时以 RATE_LIMIT_PER_SECOND=0 启动后端，或使用 --start。
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from benchmark import SHAPES, make_text
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 每次解析的表格大小（单元格数）及其权重：大多数是小表格，偶尔有大表格
+DEFAULT_TABLE_SIZES = ((100, 60), (1000, 30), (10000, 9), (100000, 1))
+
+
+class RequestFailed(Exception):
+    """请求失败（网络错误、HTTP 错误状态或 success=false），会话中断本轮循环"""
+
+
+class Stats:
+    """按接口记录每个请求的耗时和结果（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint, seconds, error=None):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            if error is not None:
+                self.errors[endpoint][error] += 1
+
+    def summary(self, elapsed):
+        with self._lock:
+            endpoints = sorted(self.latencies)
+            result = {}
+            for endpoint in endpoints:
+                values = sorted(self.latencies[endpoint])
+                errors = dict(self.errors[endpoint])
+                error_count = sum(errors.values())
+                result[endpoint] = {
+                    'requests': len(values),
+                    'throughput_rps': len(values) / elapsed if elapsed else 0.0,
+                    'error_rate': error_count / len(values),
+                    'errors': errors,
+                    'p50_ms': percentile(values, 50) * 1000,
+                    'p95_ms': percentile(values, 95) * 1000,
+                    'p99_ms': percentile(values, 99) * 1000,
+                    'max_ms': values[-1] * 1000,
+                }
+            return result
+
+
+def percentile(sorted_values, p):
+    """最近秩法百分位数"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Client:
+    """一个虚拟用户的 HTTP 客户端（长连接），请求结果记录到 Stats"""
+
+    def __init__(self, base_url, stats, timeout):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == 'https' else 80)
+        self.https = parts.scheme == 'https'
+        self.stats = stats
+        self.timeout = timeout
+        self.token = None
+        self._conn = None
+
+    def _connection(self):
+        if self._conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            self._conn = cls(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def request(self, endpoint, method, path, body=None):
+        """
+        发送请求并记录耗时；endpoint 为统计用的接口名（路径中不含ID）
+
+        Returns:
+            (状态码, 响应体字节)；失败时抛出 RequestFailed
+        """
+        headers = {'Accept-Encoding': 'identity'}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if self.token:
+            headers['Authorization'] = f'Bearer {self.token}'
+
+        started = time.perf_counter()
+        try:
+            conn = self._connection()
+            conn.request(method, path, body=payload, headers=headers)
+            resp = conn.getresponse()
+            data = resp.read()
+            status = resp.status
+        except (OSError, http.client.HTTPException) as e:
+            self.close()
+            self.stats.record(endpoint, time.perf_counter() - started, type(e).__name__)
+            raise RequestFailed(f'{endpoint}: {e}')
+        elapsed = time.perf_counter() - started
+
+        error = None
+        if status >= 400:
+            error = f'HTTP {status}'
+        elif data[:1] == b'{':
+            # 登录等接口失败时返回 200 + success=false
+            try:
+                if json.loads(data).get('success') is False:
+                    error = 'success=false'
+            except ValueError:
+                error = 'invalid json'
+        self.stats.record(endpoint, elapsed, error)
+        if error:
+            raise RequestFailed(f'{endpoint}: {error}')
+        return status, data
+
+    def json(self, endpoint, method, path, body=None):
+        _, data = self.request(endpoint, method, path, body)
+        return json.loads(data)
+
+
+class UserSession(threading.Thread):
+    """一个虚拟用户：注册并登录，然后循环执行 解析 → 保存 → 列表 → 下载，定期批量删除"""
+
+    def __init__(self, index, args, stats, deadline, texts):
+        super().__init__(name=f'loadtest-user-{index}', daemon=True)
+        self.args = args
+        self.client = Client(args.url, stats, args.timeout)
+        self.deadline = deadline
+        self.texts = texts
+        self.rng = random.Random(index)
+        self.iterations = 0
+
+    def run(self):
+        try:
+            if not self._login():
+                return
+            saved_ids = []
+            while time.monotonic() < self.deadline:
+                if self.args.iterations and self.iterations >= self.args.iterations:
+                    break
+                try:
+                    saved_ids.append(self._iteration())
+                    if len(saved_ids) >= self.args.delete_every:
+                        self._batch_delete(saved_ids)
+                        saved_ids = []
+                except RequestFailed:
+                    pass
+                self.iterations += 1
+                if self.args.think_time:
+                    time.sleep(self.rng.uniform(0, 2 * self.args.think_time))
+            if saved_ids:
+                try:
+                    self._batch_delete(saved_ids)
+                except RequestFailed:
+                    pass
+        finally:
+            self.client.close()
+
+    def _login(self):
+        username = f'lt{uuid.uuid4().hex[:12]}'
+        password = 'loadtest-password'
+        try:
+            self.user_id = self.client.json('POST /api/register', 'POST', '/api/register',
+                                            {'username': username, 'password': password})['user']['id']
+            self.client.token = self.client.json('POST /api/login', 'POST', '/api/login',
+                                                 {'username': username, 'password': password}).get('token')
+        except RequestFailed:
+            return False
+        return True
+
+    def _pick_text(self):
+        keys = list(self.texts)
+        key = self.rng.choices(keys, weights=[weight for _, weight, _ in keys])[0]
+        # 追加一行随机内容，避免所有请求都命中解析缓存和工作簿缓存
+        return self.texts[key] + f'loadtest\t{self.rng.random()}\n'
+
+    def _iteration(self):
+        client = self.client
+        raw_text = self._pick_text()
+        parsed = client.json('POST /api/manual/parse', 'POST', '/api/manual/parse',
+                             {'user_id': self.user_id, 'raw_text': raw_text})['data']
+        record = client.json('POST /api/manual/save', 'POST', '/api/manual/save', {
+            'user_id': self.user_id,
+            'title': f"{parsed['title']}-{uuid.uuid4().hex[:6]}",
+            'raw_text': raw_text,
+            'table_data': parsed['table_data'],
+            'excel_path': parsed['excel_path'],
+        })['record']
+        client.request('GET /api/users/<id>/manual-records', 'GET',
+                       f'/api/users/{self.user_id}/manual-records?limit=50')
+        client.request('GET /api/manual/<id>/download-excel', 'GET',
+                       f"/api/manual/{record['id']}/download-excel")
+        return record['id']
+
+    def _batch_delete(self, record_ids):
+        self.client.json('POST /api/manual/batch-delete', 'POST', '/api/manual/batch-delete',
+                         {'user_id': self.user_id, 'record_ids': record_ids})
+
+
+def build_texts(table_sizes):
+    """预先生成各种大小和形状的表格文本：{(单元格数, 权重, 形状): 文本}"""
+    texts = {}
+    for cells, weight in table_sizes:
+        for shape in SHAPES:
+            texts[(cells, weight, shape)] = make_text(shape, cells)
+    return texts
+
+
+# ===== 启动本地后端 =====
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_backend(workers, threads):
+    """
+    用 gunicorn 启动一个使用临时数据库和上传目录的后端（关闭限流），返回 (进程, 地址, 临时目录)
+    """
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    port = _free_port()
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'loadtest.db')}",
+        UPLOAD_FOLDER=os.path.join(workdir, 'uploads'),
+        RATE_LIMIT_PER_SECOND='0',
+        MAX_FILE_SIZE=str(200 * 1024 * 1024),
+        HOST='127.0.0.1',
+        PORT=str(port),
+        WEB_WORKERS=str(workers),
+        WEB_THREADS=str(threads),
+    )
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"后端启动失败，日志见 {log.name}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                conn.close()
+                return proc, url, workdir
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError(f"等待后端启动超时，日志见 {log.name}")
+
+
+def stop_backend(proc, workdir, keep=False):
+    proc.terminate()
+    try:
+        proc.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+    if keep:
+        print(f"后端日志和数据保留在 {workdir}", file=sys.stderr)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ===== 报告 =====
+
+def print_report(summary, elapsed, slo_failures, file=sys.stderr):
+    print(f"\n持续 {elapsed:.1f} 秒", file=file)
+    print(f"{'endpoint':<40}{'reqs':>7}{'rps':>8}{'err%':>7}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}", file=file)
+    for endpoint, s in summary.items():
+        print(f"{endpoint:<40}{s['requests']:>7}{s['throughput_rps']:>8.1f}{s['error_rate'] * 100:>6.1f}%"
+              f"{s['p50_ms']:>7.0f}ms{s['p95_ms']:>7.0f}ms{s['p99_ms']:>7.0f}ms{s['max_ms']:>7.0f}ms", file=file)
+        for error, count in sorted(s['errors'].items()):
+            print(f"    {error}: {count}", file=file)
+    for failure in slo_failures:
+        print(f"SLO 未达标: {failure}", file=file)
+
+
+def check_slo(summary, slo_p95_ms, slo_p99_ms, max_error_rate):
+    failures = []
+    for endpoint, s in summary.items():
+        if slo_p95_ms is not None and s['p95_ms'] > slo_p95_ms:
+            failures.append(f"{endpoint} p95 {s['p95_ms']:.0f}ms > {slo_p95_ms}ms")
+        if slo_p99_ms is not None and s['p99_ms'] > slo_p99_ms:
+            failures.append(f"{endpoint} p99 {s['p99_ms']:.0f}ms > {slo_p99_ms}ms")
+        if max_error_rate is not None and s['error_rate'] > max_error_rate:
+            failures.append(f"{endpoint} 错误率 {s['error_rate']:.2%} > {max_error_rate:.2%}")
+    return failures
+
+
+def _parse_table_sizes(value):
+    sizes = []
+    for item in value.split(','):
+        cells, _, weight = item.strip().partition(':')
+        sizes.append((int(cells), float(weight or 1)))
+    return tuple(sizes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='模拟用户会话压测本地后端')
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='后端地址（使用 --start 时忽略）')
+    parser.add_argument('--start', action='store_true', help='用 gunicorn 启动使用临时数据库的后端')
+    parser.add_argument('--web-workers', type=int, default=2, help='--start 时的 gunicorn 工作进程数')
+    parser.add_argument('--web-threads', type=int, default=4, help='--start 时每个工作进程的线程数')
+    parser.add_argument('--keep', action='store_true', help='保留 --start 启动的后端的日志和数据')
+    parser.add_argument('--users', type=int, default=10, help='并发的虚拟用户数')
+    parser.add_argument('--duration', type=float, default=30, help='压测持续时间（秒）')
+    parser.add_argument('--iterations', type=int, default=0, help='每个用户最多执行的轮数，0 表示不限')
+    parser.add_argument('--ramp-up', type=float, default=0, help='在该时间内逐个启动虚拟用户（秒）')
+    parser.add_argument('--think-time', type=float, default=0, help='每轮之间的平均等待时间（秒）')
+    parser.add_argument('--delete-every', type=int, default=5, help='每保存多少条记录批量删除一次')
+    parser.add_argument('--table-sizes', type=_parse_table_sizes, default=DEFAULT_TABLE_SIZES,
+                        help='表格大小和权重，如 100:60,1000:30,10000:10')
+    parser.add_argument('--timeout', type=float, default=120, help='单个请求的超时（秒）')
+    parser.add_argument('--slo-p95-ms', type=float, help='任一接口 p95 超过该值时视为不达标')
+    parser.add_argument('--slo-p99-ms', type=float, help='任一接口 p99 超过该值时视为不达标')
+    parser.add_argument('--max-error-rate', type=float, help='任一接口错误率超过该值（0~1）时视为不达标')
+    parser.add_argument('--output', help='结果 JSON 文件路径，不指定时输出到标准输出')
+    args = parser.parse_args(argv)
+
+    texts = build_texts(args.table_sizes)
+
+    backend = None
+    if args.start:
+        proc, args.url, workdir = start_backend(args.web_workers, args.web_threads)
+        backend = (proc, workdir)
+        print(f"后端已启动: {args.url}", file=sys.stderr)
+
+    stats = Stats()
+    try:
+        started = time.monotonic()
+        deadline = started + args.ramp_up + args.duration
+        sessions = []
+        for i in range(args.users):
+            session = UserSession(i, args, stats, deadline, texts)
+            session.start()
+            sessions.append(session)
+            if args.ramp_up and args.users > 1:
+                time.sleep(args.ramp_up / (args.users - 1))
+        for session in sessions:
+            session.join()
+        elapsed = time.monotonic() - started
+    finally:
+        if backend:
+            stop_backend(*backend, keep=args.keep)
+
+    summary = stats.summary(elapsed)
+    failures = check_slo(summary, args.slo_p95_ms, args.slo_p99_ms, args.max_error_rate)
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'url': args.url,
+            'users': args.users,
+            'duration_seconds': elapsed,
+            'iterations': sum(s.iterations for s in sessions),
+            'table_sizes': [list(t) for t in args.table_sizes],
+        },
+        'endpoints': summary,
+        'slo_failures': failures,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write('\n')
+    print_report(summary, elapsed, failures)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,210 @@
+"""
+运行指标（Prometheus 文本格式）
+
+不依赖 prometheus_client，只实现本项目用到的计数器、直方图和按需计算的仪表盘：
+- 请求延迟：按接口、方法、状态码分组的直方图
+- 阶段耗时：文本解析、Excel生成、孤立文件清理、数据库提交等分别统计
+- 处理的行数/单元格数、生成的工作簿数量和字节数
+
+指标保存在进程内存中；多进程部署时每个工作进程各自统计，/api/metrics 返回处理该请求的进程的数据。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'table_extractor_'
+
+# 延迟直方图的桶上限（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = ''
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}')
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(k)} {_format_value(v)}' for k, v in items]
+
+
+class Histogram(_Metric):
+    """分桶统计的直方图"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}  # key -> [各桶计数..., 总和]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            data = self._values.get(key)
+            if data is None:
+                data = self._values[key] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    data[i] += 1
+                    break
+            data[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """统计 with 代码块的耗时（秒），代码块抛出异常时同样记录"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self.header()
+        for key, data in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, data):
+                cumulative += count
+                labels = key + (('le', _format_value(float(bound))),)
+                lines.append(f'{self.name}_bucket{_format_labels(labels)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(key)} {_format_value(data[-1])}')
+            lines.append(f'{self.name}_count{_format_labels(key)} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """抓取时才计算的仪表盘：callback 返回数值，或 [(标签字典, 数值), ...]"""
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, callback):
+        super().__init__(name, documentation)
+        self.callback = callback
+
+    def render(self):
+        value = self.callback()
+        samples = value if isinstance(value, list) else [({}, value)]
+        return self.header() + [
+            f'{self.name}{_format_labels(sorted(labels.items()))} {_format_value(v)}' for labels, v in samples
+        ]
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """生成 Prometheus 文本格式（text/plain; version=0.0.4）"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())
+            except Exception as e:
+                lines.append(f'# {metric.name} 采集失败: {_escape(e)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    'http_request_duration_seconds', '接口处理耗时（到返回响应头为止）', ['endpoint', 'method', 'status'],
+))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    'stage_duration_seconds', '各处理阶段耗时：parse / render / render_sheet / assemble / stream_import / cleanup / unlink / db_commit', ['stage'],
+))
+ROWS_PROCESSED = REGISTRY.register(Counter('rows_processed_total', '解析的数据行数'))
+CELLS_PROCESSED = REGISTRY.register(Counter('cells_processed_total', '解析的单元格数（含表头）'))
+WORKBOOKS_GENERATED = REGISTRY.register(Counter('workbooks_generated_total', '生成的Excel文件数'))
+WORKBOOK_BYTES = REGISTRY.register(Counter('workbook_bytes_total', '生成的Excel文件总字节数'))
+ORPHANS_DELETED = REGISTRY.register(Counter('orphan_files_deleted_total', '孤立文件清理删除的文件数'))
+DB_QUERIES = REGISTRY.register(Counter('db_queries_total', '请求中执行的SQL语句数', ['endpoint']))
+DB_QUERY_SECONDS = REGISTRY.register(Counter('db_query_seconds_total', '请求中执行SQL语句的总耗时（秒）', ['endpoint']))
+
+
+def observe_table(table_data):
+    """记录一张解析完成的表格的行数和单元格数"""
+    rows = table_data.get('rows', [])
+    ROWS_PROCESSED.inc(len(rows))
+    CELLS_PROCESSED.inc(len(table_data.get('headers', [])) + sum(len(r) for r in rows))
+
+
+def observe_workbook(path_or_size):
+    """记录一个新生成的工作簿（文件路径或字节数）"""
+    size = path_or_size if isinstance(path_or_size, int) else os.path.getsize(path_or_size)
+    WORKBOOKS_GENERATED.inc()
+    WORKBOOK_BYTES.inc(size)
+
+
+def instrument_session_commits(session_class):
+    """统计 SQLAlchemy 会话提交耗时（从 before_commit 到 after_commit，包括自动 flush）"""
+    from sqlalchemy import event
+
+    @event.listens_for(session_class, 'before_commit')
+    def _before_commit(session):
+        session.info['_commit_started'] = time.perf_counter()
+
+    @event.listens_for(session_class, 'after_commit')
+    def _after_commit(session):
+        started = session.info.pop('_commit_started', None)
+        if started is not None:
+            STAGE_LATENCY.observe(time.perf_counter() - started, stage='db_commit')
+
+    @event.listens_for(session_class, 'after_rollback')
+    def _after_rollback(session):
+        session.info.pop('_commit_started', None)
@@ -2,6 +2,10 @@ from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
 import json
 
+from sqlalchemy import or_
+
+from storage_codec import encode_text, decode_text, encode_table, decode_table
+
 db = SQLAlchemy()
 
 
@@ -47,6 +51,9 @@ class FileRecord(db.Model):
     
     # 生成的Excel文件路径
     excel_path = db.Column(db.String(500), nullable=True)
+
+    # 后台解析任务的表格结果（见 storage_codec，按列压缩存储）
+    result_blob = db.Column(db.LargeBinary, nullable=True)
     
     # 时间戳
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -83,33 +90,212 @@ class FileRecord(db.Model):
         self.excel_path = path
         self.completed_at = datetime.utcnow()
 
+    def get_table_result(self):
+        """获取后台解析任务的表格结果（兼容旧版写入 ai_result 的 JSON 明文）"""
+        if self.result_blob is not None:
+            return decode_table(self.result_blob)
+        return json.loads(self.ai_result) if self.ai_result else None
+
+    def mark_failed(self, error):
+        """标记为处理失败，并记录错误信息"""
+        for column, value in self.failed_values(error).items():
+            setattr(self, column, value)
+
+    # 后台解析任务的状态变更可能与超时检查并发，用条件更新代替先读后写：
+    # UPDATE ... WHERE id = ? AND status IN (...)，状态已被改变时不写入
+
+    @classmethod
+    def update_if_status(cls, job_id, statuses, values):
+        """任务仍处于 statuses 中的某个状态时写入 values，返回是否写入（由调用方提交）"""
+        updated = cls.query.filter(cls.id == job_id, cls.status.in_(statuses)).update(
+            values, synchronize_session=False
+        )
+        return updated == 1
+
+    @staticmethod
+    def processing_values():
+        return {'status': 'processing', 'processed_at': datetime.utcnow()}
+
+    @staticmethod
+    def completed_values(table_data, excel_path):
+        """完成时写入的列：表格结果按列压缩存储"""
+        return {
+            'status': 'completed',
+            'result_blob': encode_table(table_data),
+            'file_path': excel_path,
+            'excel_path': excel_path,
+            'completed_at': datetime.utcnow(),
+        }
+
+    @staticmethod
+    def failed_values(error):
+        return {
+            'status': 'failed',
+            'ai_result': json.dumps({'error': error}, ensure_ascii=False),
+            'result_blob': None,
+            'completed_at': datetime.utcnow(),
+        }
+
 
 class TextRecord(db.Model):
     """手动文本记录模型（不依赖大模型，用户自己粘贴文本）"""
     __tablename__ = 'text_records'
+    __table_args__ = (
+        # 历史记录列表按用户、时间倒序分页
+        db.Index('ix_text_records_user_created', 'user_id', 'created_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     title = db.Column(db.String(50), nullable=False)  # 例如：2026年1月12日13:34:45
+
+    # 旧版存储格式：原始文本 / 表格JSON 明文（新记录写入空字符串，内容保存在下面的压缩列中）
     raw_text = db.Column(db.Text, nullable=False)    # 用户粘贴的原始文本
+    table_json = db.Column(db.Text, nullable=False)  # 解析后的表格数据（JSON）
 
-    # 解析后的表格数据（JSON）
-    table_json = db.Column(db.Text, nullable=False)
+    # 紧凑存储格式（见 storage_codec）：压缩后的原始文本、按列存储并压缩的表格数据
+    raw_text_blob = db.Column(db.LargeBinary, nullable=True)
+    table_blob = db.Column(db.LargeBinary, nullable=True)
 
-    # 生成的 Excel 文件路径
-    excel_path = db.Column(db.String(500), nullable=False)
+    # 生成的 Excel 文件路径（按表格内容寻址，多条记录可共享同一文件）
+    excel_path = db.Column(db.String(500), nullable=False, index=True)
+
+    # 表格尺寸（列表摘要中展示，避免为此解析 table_json）
+    row_count = db.Column(db.Integer, nullable=True)
+    col_count = db.Column(db.Integer, nullable=True)
 
     created_at = db.Column(db.DateTime, default=datetime.now)
 
+    # 列表摘要只需要的列
+    SUMMARY_COLUMNS = ('id', 'user_id', 'title', 'excel_path', 'row_count', 'col_count', 'created_at')
+
+    def set_raw_text(self, text):
+        """设置原始文本（压缩存储）"""
+        self.raw_text_blob = encode_text(text)
+        self.raw_text = ''
+
+    def get_raw_text(self):
+        """获取原始文本（兼容旧版明文存储）"""
+        if self.raw_text_blob is not None:
+            return decode_text(self.raw_text_blob)
+        return self.raw_text
+
+    def set_table_data(self, data):
+        """设置表格数据（按列压缩存储），同时记录表格尺寸"""
+        self.table_blob = encode_table(data)
+        self.table_json = ''
+        self.row_count, self.col_count = table_dimensions(data)
+
+    def get_table_data(self):
+        """获取表格数据（兼容旧版 JSON 明文存储）"""
+        if self.table_blob is not None:
+            return decode_table(self.table_blob)
+        return json.loads(self.table_json) if self.table_json else None
+
+    @property
+    def is_compact(self):
+        return self.raw_text_blob is not None and self.table_blob is not None
+
     def to_dict(self):
         return {
             'id': self.id,
             'user_id': self.user_id,
             'title': self.title,
-            'raw_text': self.raw_text,
-            'table': json.loads(self.table_json) if self.table_json else None,
+            'raw_text': self.get_raw_text(),
+            'table': self.get_table_data(),
+            'excel_path': self.excel_path,
+            'row_count': self.row_count,
+            'col_count': self.col_count,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+        }
+
+    def to_summary_dict(self):
+        """摘要信息（不包含原始文本和表格内容）"""
+        return {
+            'id': self.id,
+            'user_id': self.user_id,
+            'title': self.title,
             'excel_path': self.excel_path,
+            'row_count': self.row_count,
+            'col_count': self.col_count,
             'created_at': self.created_at.isoformat() if self.created_at else None,
         }
 
 
+def table_dimensions(data):
+    """表格尺寸：(数据行数, 列数)"""
+    if not isinstance(data, dict):
+        return 0, 0
+    headers = data.get('headers') or []
+    rows = data.get('rows') or []
+    if not isinstance(headers, list) or not isinstance(rows, list):
+        # 旧版保存接口不检查表格结构
+        return 0, 0
+    col_count = max([len(headers)] + [len(r) for r in rows if isinstance(r, list)]) if (headers or rows) else 0
+    return len(rows), col_count
+
+
+def ensure_schema():
+    """
+    创建缺失的表、列和索引（db.create_all 不会修改已存在的表）
+    需在应用上下文中调用
+    """
+    db.create_all()
+
+    # 为已存在的表补建新增的列（新增列均可为空）
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {col['name'] for col in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                with db.engine.begin() as conn:
+                    conn.execute(db.text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+    backfill_table_dimensions()
+    compact_legacy_records()
+
+
+def backfill_table_dimensions(batch_size=500):
+    """为旧记录补充表格尺寸"""
+    while True:
+        records = TextRecord.query.filter(TextRecord.row_count.is_(None)).limit(batch_size).all()
+        if not records:
+            break
+        for record in records:
+            try:
+                record.row_count, record.col_count = table_dimensions(record.get_table_data())
+            except ValueError:
+                record.row_count, record.col_count = 0, 0
+        db.session.commit()
+
+
+def compact_legacy_records(batch_size=200):
+    """将旧版明文存储的记录转换为紧凑存储格式（读取路径同时兼容两种格式，可随时中断）"""
+    converted = 0
+    while True:
+        records = TextRecord.query.filter(
+            or_(TextRecord.raw_text_blob.is_(None), TextRecord.table_blob.is_(None))
+        ).limit(batch_size).all()
+        if not records:
+            break
+        for record in records:
+            if record.raw_text_blob is None:
+                record.set_raw_text(record.raw_text)
+            if record.table_blob is None:
+                # 旧版保存接口不检查表格结构：JSON 无效或结构不符时按空表格转换，保证迁移能够结束
+                try:
+                    table_data = json.loads(record.table_json) if record.table_json else {}
+                    record.set_table_data(table_data)
+                except ValueError:
+                    print(f"历史记录 {record.id} 的表格数据格式错误，已按空表格转换")
+                    record.set_table_data({})
+        db.session.commit()
+        converted += len(records)
+    if converted:
+        print(f"已将 {converted} 条历史记录转换为紧凑存储格式（SQLite 可执行 VACUUM 回收空间）")
+    return converted
@@ -0,0 +1,182 @@
+"""
+按需的请求性能剖析
+
+默认关闭。开启方式（二选一，可同时使用）：
+- 管理员请求头：配置 PROFILE_ADMIN_TOKEN 后，携带 X-Profile-Token: <令牌> 的请求会被剖析
+- 抽样：PROFILE_SAMPLE_RATE（0~1）按比例随机剖析请求，可用 PROFILE_ENDPOINTS 限定接口
+
+被剖析的请求同时记录 CPU（cProfile）和内存分配（tracemalloc），结果写入剖析目录：
+- <id>.prof：pstats 格式，可用 python -m pstats 或 snakeviz 查看
+- <id>.txt：请求信息、耗时最多的函数、内存峰值和分配最多的代码行
+
+目录总大小超过上限时按修改时间删除最旧的结果。
+tracemalloc 是进程全局的，同一进程内同一时间只剖析一个请求，其余请求照常处理、不剖析。
+"""
+import cProfile
+import hmac
+import io
+import os
+import pstats
+import random
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+# 摘要中列出的函数数和代码行数
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 30
+
+
+class _Session:
+    """一次剖析：CPU 剖析器、内存快照和请求信息"""
+
+    def __init__(self, profile_id, trigger, tracemalloc_frames):
+        self.profile_id = profile_id
+        self.trigger = trigger
+        self.started_at = datetime.now()
+        self.profiler = cProfile.Profile()
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start(tracemalloc_frames)
+        else:
+            tracemalloc.reset_peak()
+        self.snapshot_before = tracemalloc.take_snapshot()
+        self.wall_started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.profiler.enable()
+
+    def finish(self):
+        self.profiler.disable()
+        self.wall_seconds = time.perf_counter() - self.wall_started
+        self.cpu_seconds = time.process_time() - self.cpu_started
+        self.snapshot_after = tracemalloc.take_snapshot()
+        _, self.peak_bytes = tracemalloc.get_traced_memory()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+
+
+class RequestProfiler:
+    """请求剖析器：决定是否剖析、执行剖析、保存结果并控制目录大小"""
+
+    def __init__(self, directory, admin_token='', sample_rate=0.0, endpoints=(),
+                 max_bytes=100 * 1024 * 1024, tracemalloc_frames=1):
+        self.directory = directory
+        self.admin_token = admin_token
+        self.sample_rate = sample_rate
+        self.endpoints = set(endpoints)
+        self.max_bytes = max_bytes
+        self.tracemalloc_frames = tracemalloc_frames
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.admin_token) or self.sample_rate > 0
+
+    def _trigger(self, endpoint, headers):
+        """返回触发方式（'header' / 'sample'），不剖析时返回 None"""
+        token = headers.get('X-Profile-Token')
+        # 按字节比较：compare_digest 不接受含非 ASCII 字符的 str
+        if token and self.admin_token and hmac.compare_digest(token.encode('utf-8'), self.admin_token.encode('utf-8')):
+            return 'header'
+        if self.sample_rate > 0 and (not self.endpoints or endpoint in self.endpoints):
+            if random.random() < self.sample_rate:
+                return 'sample'
+        return None
+
+    def start(self, endpoint, headers):
+        """
+        按需开始剖析
+
+        Returns:
+            剖析会话；不需要剖析或已有请求正在剖析时返回 None
+        """
+        if not self.enabled:
+            return None
+        trigger = self._trigger(endpoint, headers)
+        if trigger is None or not self._busy.acquire(blocking=False):
+            return None
+        try:
+            profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{endpoint or 'unmatched'}-{uuid.uuid4().hex[:8]}"
+            return _Session(profile_id, trigger, self.tracemalloc_frames)
+        except Exception:
+            self._busy.release()
+            raise
+
+    def finish(self, session, request_info):
+        """
+        结束剖析并写入结果
+
+        Args:
+            request_info: 写入摘要的请求信息，如 {"method", "path", "status", "content_length"}
+        """
+        try:
+            session.finish()
+        finally:
+            self._busy.release()
+        try:
+            self._write(session, request_info)
+            self.enforce_retention()
+        except OSError as e:
+            print(f"保存剖析结果失败 {session.profile_id}: {str(e)}")
+
+    def _write(self, session, request_info):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, session.profile_id)
+        session.profiler.dump_stats(base + '.prof')
+
+        out = io.StringIO()
+        out.write(f"剖析ID: {session.profile_id}\n")
+        out.write(f"开始时间: {session.started_at.isoformat(timespec='seconds')}\n")
+        out.write(f"触发方式: {session.trigger}\n")
+        for key, value in request_info.items():
+            out.write(f"{key}: {value}\n")
+        out.write(f"耗时: {session.wall_seconds * 1000:.1f} ms（CPU {session.cpu_seconds * 1000:.1f} ms）\n")
+        out.write(f"内存峰值: {session.peak_bytes / 1024:.1f} KB\n")
+
+        out.write(f"\n===== 累计耗时最多的 {TOP_FUNCTIONS} 个函数 =====\n")
+        stats = pstats.Stats(session.profiler, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_FUNCTIONS)
+
+        out.write(f"\n===== 新增分配最多的 {TOP_ALLOCATIONS} 处代码 =====\n")
+        diff = session.snapshot_after.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        )).compare_to(session.snapshot_before, 'lineno')
+        for stat in diff[:TOP_ALLOCATIONS]:
+            out.write(f"{stat}\n")
+
+        with open(base + '.txt', 'w', encoding='utf-8') as f:
+            f.write(out.getvalue())
+
+    def enforce_retention(self):
+        """目录总大小超过上限时删除最旧的结果，返回删除的文件数"""
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        entries = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"删除剖析结果失败 {path}: {str(e)}")
+                continue
+            total -= size
+        return removed
@@ -0,0 +1,132 @@
+"""
+SQL 查询统计
+
+通过 SQLAlchemy 引擎事件统计每个请求执行的查询：
+- 查询次数和数据库总耗时，写入响应头 X-DB-Query-Count / X-DB-Time-Ms 和 Server-Timing
+- 慢查询：耗时超过阈值的语句连同参数一起打印
+- N+1：同一条语句在一个请求中执行次数达到阈值时打印提示（通常是循环中逐条查询关联数据）
+
+统计对象保存在 contextvar 中，只统计请求线程中执行的查询；
+后台线程（清理、渲染队列等）中的查询只参与慢查询检测。
+"""
+import contextvars
+import time
+from collections import Counter
+
+from sqlalchemy import event
+
+# 慢查询日志中每个参数和整条语句的最大长度（raw_text / table_data 可能很大）
+MAX_PARAM_LENGTH = 200
+MAX_STATEMENT_LENGTH = 2000
+
+_current = contextvars.ContextVar('query_stats', default=None)
+
+
+class RequestQueries:
+    """一个请求中执行的查询"""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def add(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """执行次数达到阈值的语句：[(语句, 次数), ...]"""
+        return [(stmt, n) for stmt, n in self.statements.most_common() if n >= threshold]
+
+
+def _truncate(text, limit):
+    text = str(text)
+    return text if len(text) <= limit else f"{text[:limit]}…（共{len(text)}字符）"
+
+
+def format_parameters(parameters):
+    if parameters is None:
+        return '()'
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{k}: {_truncate(repr(v), MAX_PARAM_LENGTH)}' for k, v in parameters.items()) + '}'
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            # executemany：只显示第一组参数
+            return f"{format_parameters(parameters[0])} 等{len(parameters)}组"
+        return '(' + ', '.join(_truncate(repr(v), MAX_PARAM_LENGTH) for v in parameters) + ')'
+    return _truncate(repr(parameters), MAX_PARAM_LENGTH)
+
+
+class QueryInstrumentation:
+    """
+    查询统计
+
+    Args:
+        slow_query_seconds: 慢查询阈值（秒），0 表示不记录慢查询
+        n_plus_one_threshold: 同一语句在一个请求中执行多少次视为 N+1，0 表示不检测
+        log_parameters: 慢查询日志是否包含参数
+    """
+
+    def __init__(self, slow_query_seconds=0.2, n_plus_one_threshold=10, log_parameters=True):
+        self.slow_query_seconds = slow_query_seconds
+        self.n_plus_one_threshold = n_plus_one_threshold
+        self.log_parameters = log_parameters
+
+    def install(self, engine):
+        """在引擎上注册事件"""
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info['_query_started'].pop()
+            self._record(statement, parameters, time.perf_counter() - started)
+
+        @event.listens_for(engine, 'handle_error')
+        def _handle_error(exception_context):
+            conn = exception_context.connection
+            if conn is not None and conn.info.get('_query_started'):
+                conn.info['_query_started'].pop()
+
+    def _record(self, statement, parameters, seconds):
+        queries = _current.get()
+        if queries is not None:
+            queries.add(statement, seconds)
+        if self.slow_query_seconds and seconds >= self.slow_query_seconds:
+            message = f"慢查询 {seconds * 1000:.1f} ms: {_truncate(statement, MAX_STATEMENT_LENGTH)}"
+            if self.log_parameters:
+                message += f"\n  参数: {format_parameters(parameters)}"
+            print(message)
+
+    def begin(self):
+        """开始统计当前请求，返回 end() 需要的标记"""
+        return _current.set(RequestQueries())
+
+    @staticmethod
+    def current():
+        """当前请求的统计（未开始统计时为 None）"""
+        return _current.get()
+
+    def end(self, token, description=''):
+        """
+        结束统计当前请求，检测 N+1 并返回统计结果
+
+        Args:
+            description: 打印 N+1 提示时标识请求，如 "GET /api/users/<int:user_id>/manual-records"
+        """
+        queries = _current.get()
+        try:
+            _current.reset(token)
+        except ValueError:
+            # 流式响应结束时可能不在开始统计时的上下文中
+            _current.set(None)
+        if queries is None:
+            return None
+        if self.n_plus_one_threshold:
+            for statement, n in queries.repeated(self.n_plus_one_threshold):
+                print(f"可能的 N+1 查询（{description}，同一语句执行 {n} 次）: "
+                      f"{_truncate(statement, MAX_STATEMENT_LENGTH)}")
+        return queries
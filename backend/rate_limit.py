@@ -0,0 +1,144 @@
+"""
+按用户限流（令牌桶）
+
+每个用户一个令牌桶：容量为 burst，以每秒 rate 个的速度补充，每次生成消耗一个令牌。
+桶为空时拒绝请求，并给出需要等待的秒数（用于 Retry-After 响应头）。
+
+- MemoryBucketStore：桶保存在进程内存中，检查时没有任何 I/O（默认）
+- SQLiteBucketStore：桶保存在共享的 SQLite 文件中，多个工作进程共用同一份限额
+"""
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryBucketStore:
+    """
+    进程内令牌桶
+
+    桶按最近使用时间排序（OrderedDict），每次检查后从最久未使用的一端清理已经补满的桶
+    （补满的桶与不存在等价），均摊 O(1)，不扫描全部桶。
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = OrderedDict()  # key -> (tokens, updated)，最久未使用的在前
+        self._lock = threading.Lock()
+
+    def acquire(self, key, cost=1):
+        """
+        尝试消耗令牌
+
+        Returns:
+            (allowed, retry_after): 被拒绝时 retry_after 为需要等待的秒数
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = _refill(tokens, updated, now, self.rate, self.burst)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            self._prune(now)
+        return (True, 0.0) if allowed else (False, (cost - tokens) / self.rate)
+
+    def _prune(self, now):
+        while self._buckets:
+            key, (tokens, updated) = next(iter(self._buckets.items()))
+            if _refill(tokens, updated, now, self.rate, self.burst) < self.burst:
+                break
+            del self._buckets[key]
+
+
+class SQLiteBucketStore:
+    """
+    共享 SQLite 文件中的令牌桶（多进程部署时使用）
+
+    每次检查在一个 BEGIN IMMEDIATE 事务中读取并更新桶，多个进程之间互斥；
+    使用独立的小数据库文件，不与业务数据库争用写锁。
+    """
+
+    def __init__(self, path, rate, burst, timeout=5.0):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.timeout = timeout
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS rate_buckets '
+                '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def acquire(self, key, cost=1):
+        # 跨进程共享，使用墙上时间
+        now = time.time()
+        key = str(key)
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+            tokens, updated = row if row else (self.burst, now)
+            tokens = _refill(tokens, min(updated, now), now, self.rate, self.burst)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                (key, tokens, now),
+            )
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return (True, 0.0) if allowed else (False, (cost - tokens) / self.rate)
+
+
+class RateLimiter:
+    """限流器：包装具体的令牌桶存储，rate 为 0 时不限流"""
+
+    def __init__(self, store):
+        self.store = store
+
+    def check(self, key, cost=1):
+        """
+        Returns:
+            None 表示允许；被拒绝时返回建议的 Retry-After 秒数（整数，至少为1）
+        """
+        if self.store is None:
+            return None
+        allowed, retry_after = self.store.acquire(key, cost)
+        if allowed:
+            return None
+        return max(1, math.ceil(retry_after))
+
+
+def create_rate_limiter(rate, burst, shared_path=None):
+    """
+    Args:
+        rate: 每秒补充的令牌数，0 表示不限流
+        burst: 桶容量（允许的突发次数）
+        shared_path: 可选，共享 SQLite 文件路径；为空时使用进程内存
+    """
+    if rate <= 0:
+        return RateLimiter(None)
+    if shared_path:
+        return RateLimiter(SQLiteBucketStore(shared_path, rate, burst))
+    return RateLimiter(MemoryBucketStore(rate, burst))
@@ -0,0 +1,62 @@
+"""
+后台渲染队列
+
+解析和生成Excel放到工作线程池中执行，请求线程只负责创建任务并立即返回任务ID。
+任务状态持久化在 FileRecord 中（uploaded -> processing -> completed / failed），
+客户端通过任务ID轮询状态和结果。
+"""
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """排队中的任务数已达上限"""
+
+
+class RenderQueue:
+    """
+    基于线程池的本地任务队列
+
+    handler(job_id, *args) 在应用上下文中执行，负责更新任务状态；
+    handler 抛出的异常只记录日志，不会影响工作线程。
+    """
+
+    def __init__(self, app, handler, max_workers=2, max_pending=100):
+        self.app = app
+        self.handler = handler
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='render')
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        """排队中和执行中的任务数"""
+        return self._pending
+
+    def submit(self, job_id, *args):
+        """提交任务，队列已满时抛出 QueueFullError"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise QueueFullError('渲染任务过多，请稍后再试')
+            self._pending += 1
+        try:
+            self._executor.submit(self._run, job_id, args)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+
+    def _run(self, job_id, args):
+        try:
+            with self.app.app_context():
+                self.handler(job_id, *args)
+        except Exception:
+            print(f"渲染任务 {job_id} 执行出错:\n{traceback.format_exc()}")
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,102 @@
+"""
+会话令牌
+
+登录成功后签发带时间戳的签名令牌（itsdangerous，HMAC-SHA1 签名，校验时使用恒定时间比较），
+客户端通过 Authorization: Bearer <token> 携带。
+
+校验通过的令牌缓存在进程内的有界 LRU 中（键为令牌的 SHA-256 摘要，不保存令牌原文），
+同一令牌的后续请求不再重新计算签名，也不再查询用户表。
+
+下载令牌：浏览器直接打开下载链接时无法携带 Authorization 头，改用短期有效的下载令牌作为查询参数，
+文件由浏览器边下载边写入磁盘。下载令牌使用独立的 salt，不能当作会话令牌使用。
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from itsdangerous import BadSignature, SignatureExpired, URLSafeTimedSerializer
+
+Principal = namedtuple('Principal', ['user_id', 'username'])
+
+_SALT = 'table-extractor-session'
+_DOWNLOAD_SALT = 'table-extractor-download'
+
+
+class InvalidToken(Exception):
+    """令牌无效或已过期"""
+
+
+class SessionTokens:
+    """会话令牌的签发与校验"""
+
+    def __init__(self, secret_key, max_age_seconds, cache_size=10000, download_max_age_seconds=60):
+        self.max_age_seconds = max_age_seconds
+        self.cache_size = cache_size
+        self.download_max_age_seconds = download_max_age_seconds
+        self._serializer = URLSafeTimedSerializer(secret_key, salt=_SALT)
+        self._download_serializer = URLSafeTimedSerializer(secret_key, salt=_DOWNLOAD_SALT)
+        # 令牌摘要 -> (Principal, 过期时间)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def issue(self, user):
+        """为用户签发令牌"""
+        return self._serializer.dumps({'uid': user.id, 'name': user.username})
+
+    def verify(self, token, load_user=None):
+        """
+        校验令牌，返回 Principal；令牌无效或已过期时抛出 InvalidToken
+
+        Args:
+            load_user: 可选，首次校验某个令牌时调用 load_user(user_id) 确认用户仍然存在
+        """
+        key = hashlib.sha256(token.encode('utf-8')).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                principal, expires_at = entry
+                if now < expires_at:
+                    self._cache.move_to_end(key)
+                    return principal
+                del self._cache[key]
+
+        try:
+            payload, issued_at = self._serializer.loads(
+                token, max_age=self.max_age_seconds, return_timestamp=True
+            )
+        except SignatureExpired:
+            raise InvalidToken('登录已过期')
+        except BadSignature:
+            raise InvalidToken('无效的登录凭证')
+
+        if not isinstance(payload, dict) or not isinstance(payload.get('uid'), int):
+            raise InvalidToken('无效的登录凭证')
+        if load_user is not None and load_user(payload['uid']) is None:
+            raise InvalidToken('用户不存在')
+
+        principal = Principal(payload['uid'], payload.get('name'))
+        expires_at = issued_at.timestamp() + self.max_age_seconds
+        with self._lock:
+            self._cache[key] = (principal, expires_at)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return principal
+
+    def issue_download(self, user_id):
+        """为用户签发短期有效的下载令牌"""
+        return self._download_serializer.dumps({'uid': user_id})
+
+    def verify_download(self, token):
+        """校验下载令牌，返回 Principal；令牌无效或已过期时抛出 InvalidToken"""
+        try:
+            payload = self._download_serializer.loads(token, max_age=self.download_max_age_seconds)
+        except SignatureExpired:
+            raise InvalidToken('下载链接已过期，请重新下载')
+        except BadSignature:
+            raise InvalidToken('无效的下载链接')
+        if not isinstance(payload, dict) or not isinstance(payload.get('uid'), int):
+            raise InvalidToken('无效的下载链接')
+        return Principal(payload['uid'], None)
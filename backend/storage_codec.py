@@ -0,0 +1,85 @@
+"""
+历史记录内容的紧凑存储格式
+
+每个编码后的值都以 1 字节的格式版本开头，后接 zlib 压缩数据：
+- 文本：UTF-8 编码后压缩
+- 表格：按列存储（同一列的值相邻，重复度高，压缩效果更好），JSON 序列化后压缩
+  {"h": 表头, "c": [[第1列的所有值], [第2列的所有值], ...], "n": 行数, "l": 各行长度（仅当行长度不一致时）}
+"""
+import json
+import zlib
+
+FORMAT_V1 = 1
+
+COMPRESS_LEVEL = 6
+
+
+def _compress(version, data):
+    return bytes([version]) + zlib.compress(data, COMPRESS_LEVEL)
+
+
+def _decompress(blob):
+    if not blob:
+        raise ValueError('空的编码数据')
+    version = blob[0]
+    if version != FORMAT_V1:
+        raise ValueError(f'不支持的存储格式版本: {version}')
+    return zlib.decompress(blob[1:])
+
+
+def encode_text(text):
+    """压缩文本"""
+    return _compress(FORMAT_V1, (text or '').encode('utf-8'))
+
+
+def decode_text(blob):
+    """解压文本"""
+    return _decompress(blob).decode('utf-8')
+
+
+def encode_table(data):
+    """将 {"headers": [...], "rows": [[...], ...]} 编码为按列存储的压缩格式，结构不符时抛出 ValueError"""
+    if not isinstance(data, dict):
+        raise ValueError(f'表格数据应为对象，实际为 {type(data).__name__}')
+    headers = data.get('headers') or []
+    rows = data.get('rows') or []
+    if not isinstance(headers, list) or not all(isinstance(r, list) for r in rows):
+        raise ValueError('表格数据应为 {"headers": [...], "rows": [[...], ...]}')
+    lengths = [len(r) for r in rows]
+    width = max(lengths) if lengths else 0
+
+    if lengths and min(lengths) == width:
+        columns = [list(col) for col in zip(*rows)]
+    else:
+        columns = [[r[i] if i < len(r) else "" for r in rows] for i in range(width)]
+
+    doc = {'h': headers, 'c': columns, 'n': len(rows)}
+    if lengths and min(lengths) != width:
+        doc['l'] = lengths
+    # 保留表头/行之外的其他字段（如果有）
+    extra = {k: v for k, v in data.items() if k not in ('headers', 'rows')}
+    if extra:
+        doc['x'] = extra
+
+    payload = json.dumps(doc, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return _compress(FORMAT_V1, payload)
+
+
+def decode_table(blob):
+    """解码按列存储的表格，还原为 {"headers": [...], "rows": [[...], ...]}"""
+    doc = json.loads(_decompress(blob))
+    columns = doc.get('c') or []
+    row_count = doc.get('n', 0)
+
+    if columns:
+        rows = [list(r) for r in zip(*columns)]
+    else:
+        rows = [[] for _ in range(row_count)]
+
+    lengths = doc.get('l')
+    if lengths:
+        rows = [r[:n] for r, n in zip(rows, lengths)]
+
+    data = {'headers': doc.get('h') or [], 'rows': rows}
+    data.update(doc.get('x') or {})
+    return data
@@ -0,0 +1,57 @@
+"""旧版明文存储的历史记录迁移为紧凑存储格式"""
+import json
+
+import pytest
+from flask import Flask
+
+from models import db, User, TextRecord, ensure_schema
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'legacy.db'}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+
+def seed_legacy(table_json, user_id, raw_text='a b\\n1 2'):
+    """按旧版格式写入一条记录：原始文本和表格JSON明文，没有压缩列和表格尺寸"""
+    db.session.execute(
+        TextRecord.__table__.insert().values(
+            user_id=user_id, title='旧记录', raw_text=raw_text, table_json=table_json,
+            excel_path='uploads/excel/legacy.xlsx',
+        )
+    )
+    db.session.commit()
+
+
+def test_migration_finishes_with_malformed_legacy_rows(app):
+    user = User(username='alice', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+
+    valid = {'headers': ['a', 'b'], 'rows': [['1', '2'], ['3']]}
+    seed_legacy(json.dumps(valid), user.id)
+    seed_legacy(json.dumps([['a', 'b']]), user.id)           # JSON 有效但不是表格结构
+    seed_legacy(json.dumps({'headers': 'a', 'rows': 1}), user.id)
+    seed_legacy('{not json', user.id)
+    seed_legacy('', user.id, raw_text='')
+
+    ensure_schema()
+
+    records = TextRecord.query.order_by(TextRecord.id).all()
+    assert len(records) == 5
+    assert all(r.is_compact for r in records)
+    assert all(r.table_json == '' and r.raw_text == '' for r in records)
+
+    assert records[0].get_table_data() == valid
+    assert (records[0].row_count, records[0].col_count) == (2, 2)
+    assert records[0].get_raw_text() == 'a b\\n1 2'
+    for record in records[1:]:
+        assert record.get_table_data() == {'headers': [], 'rows': []}
+        assert (record.row_count, record.col_count) == (0, 0)
+    assert records[4].get_raw_text() == ''
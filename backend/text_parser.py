@@ -0,0 +1,235 @@
+"""
+纯文本表格解析
+
+自动识别粘贴文本的格式，并一次遍历生成列数对齐的表格：
+- markdown: Markdown / 竖线分隔表格（| a | b |，自动跳过 |---|---| 分隔行）
+- tsv: 制表符分隔（从 Excel / 网页表格复制时的格式，单元格可以包含空格）
+- csv: 逗号分隔（支持引号包裹的字段）
+- fixed: 等宽对齐的列（列之间至少2个空格，单元格内可以包含单个空格）
+- whitespace: 任意空白字符分隔（默认格式，与旧版解析规则一致）
+
+第一行为表头，后续为数据行；列数不足的行用空字符串补齐。
+"""
+import csv
+import io
+import itertools
+import re
+
+FORMATS = ('whitespace', 'tsv', 'csv', 'markdown', 'fixed')
+
+# 用于识别格式的样本行数
+SNIFF_LINES = 50
+# 样本中至少有该比例的行符合某种格式的特征，才认为是该格式
+SNIFF_RATIO = 0.8
+
+_MARKDOWN_SEPARATOR = re.compile(r'^\s*\|?\s*:?-{1,}:?\s*(\|\s*:?-{1,}:?\s*)*\|?\s*$')
+_MARKDOWN_SPLIT = re.compile(r'(?<!\\)\|')
+_MULTI_SPACE = re.compile(r' {2,}|\t')
+# 千分位数字中的逗号（1,000），不作为 CSV 分隔符的依据
+_THOUSANDS_COMMA = re.compile(r'(?<=\d),(?=\d{3}(?!\d))')
+
+
+def _take_sample(lines):
+    """
+    从行迭代器中读取前若干个非空行作为格式识别样本
+
+    Returns:
+        (样本行列表（已去掉换行符）, 已读取的原始行列表)
+    """
+    sample = []
+    consumed = []
+    for line in lines:
+        consumed.append(line)
+        line = line.rstrip('\r\n')
+        if line.strip():
+            sample.append(line)
+            if len(sample) >= SNIFF_LINES:
+                break
+    return sample, consumed
+
+
+def _consistent(counts, minimum=1):
+    """样本中绝大多数行的字段数相同且不少于 minimum"""
+    if not counts:
+        return False
+    mode = max(set(counts), key=counts.count)
+    return mode >= minimum and counts.count(mode) >= len(counts) * SNIFF_RATIO
+
+
+def sniff_format(raw_text):
+    """根据前若干行识别文本格式，返回 FORMATS 中的一种"""
+    # 逐行读取，避免为了取样本而切分整段文本
+    sample, _ = _take_sample(io.StringIO(raw_text))
+    return _sniff_sample(sample)
+
+
+def _sniff_sample(sample):
+    if not sample:
+        return 'whitespace'
+    threshold = len(sample) * SNIFF_RATIO
+
+    pipe_lines = [line for line in sample if '|' in line]
+    if len(pipe_lines) >= threshold and _consistent([len(_MARKDOWN_SPLIT.findall(l)) for l in sample]):
+        return 'markdown'
+
+    if sum(1 for line in sample if '\t' in line) >= threshold and _consistent(
+        [line.count('\t') for line in sample]
+    ):
+        return 'tsv'
+
+    # 用 csv 模块计数，引号内的逗号不计入
+    comma_counts = [len(cells) - 1 for cells in csv.reader(_THOUSANDS_COMMA.sub('', line) for line in sample)]
+    if _consistent(comma_counts):
+        return 'csv'
+
+    whitespace_counts = [len(line.split()) for line in sample]
+    multi_space_counts = [len(_MULTI_SPACE.split(line.strip())) for line in sample]
+    if _consistent(multi_space_counts, minimum=2) and (
+        not _consistent(whitespace_counts) or
+        max(multi_space_counts) < max(whitespace_counts)
+    ):
+        # 按2个以上空格分列更整齐，说明单元格内部有空格
+        return 'fixed'
+
+    return 'whitespace'
+
+
+# 以下行迭代器接受任意行序列（行尾可以带或不带换行符），逐行产出单元格列表
+
+
+def _iter_whitespace(lines):
+    for line in lines:
+        cells = line.split()
+        if cells:
+            yield cells
+
+
+def _iter_tsv(lines):
+    for line in lines:
+        if line[-1:] in ('\n', '\r'):
+            line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        cells = line.split('\t')
+        # 只有单元格首尾可能有空白时才逐个 strip
+        if ' \t' in line or '\t ' in line or line[0] == ' ' or line[-1] == ' ':
+            cells = [cell.strip() for cell in cells]
+        yield cells
+
+
+def _iter_csv(lines):
+    # 行尾保留换行符时，引号内的换行可以被正确还原
+    for cells in csv.reader(lines):
+        if any(cell.strip() for cell in cells):
+            yield [cell.strip() for cell in cells]
+
+
+def _iter_markdown(lines):
+    for line in lines:
+        stripped = line.strip()
+        if not stripped or _MARKDOWN_SEPARATOR.match(stripped):
+            continue
+        if stripped.startswith('|'):
+            stripped = stripped[1:]
+        if stripped.endswith('|') and not stripped.endswith('\\|'):
+            stripped = stripped[:-1]
+        yield [cell.strip().replace('\\|', '|') for cell in _MARKDOWN_SPLIT.split(stripped)]
+
+
+def _iter_fixed(lines):
+    for line in lines:
+        stripped = line.strip()
+        if stripped:
+            yield _MULTI_SPACE.split(stripped)
+
+
+_ROW_ITERATORS = {
+    'whitespace': _iter_whitespace,
+    'tsv': _iter_tsv,
+    'csv': _iter_csv,
+    'markdown': _iter_markdown,
+    'fixed': _iter_fixed,
+}
+
+
+def parse_text_table(raw_text, text_format='auto'):
+    """
+    将纯文本解析为表格
+
+    Args:
+        raw_text: 用户粘贴的文本
+        text_format: 'auto'（自动识别）或 FORMATS 中的一种
+
+    Returns:
+        ({"headers": [...], "rows": [[...], ...]}, 实际使用的格式)
+    """
+    if not raw_text or not raw_text.strip():
+        raise ValueError("文本内容为空")
+
+    if text_format in (None, '', 'auto'):
+        text_format = sniff_format(raw_text)
+    if text_format not in _ROW_ITERATORS:
+        raise ValueError(f"不支持的文本格式: {text_format}")
+
+    # CSV 需要保留换行符以支持引号内换行，其余格式直接按行切分（更快）
+    lines = io.StringIO(raw_text) if text_format == 'csv' else raw_text.splitlines()
+    rows_iter = _ROW_ITERATORS[text_format](lines)
+    headers = next(rows_iter, None)
+    if headers is None:
+        raise ValueError("文本中没有有效内容")
+
+    # 边解析边补齐到当前最大列数；出现更宽的行时记录下来，最后只补齐之前较短的行
+    width = len(headers)
+    rows = []
+    widened = False
+    for cells in rows_iter:
+        n = len(cells)
+        if n < width:
+            cells.extend([""] * (width - n))
+        elif n > width:
+            width = n
+            widened = True
+        rows.append(cells)
+
+    if widened:
+        if len(headers) < width:
+            headers.extend([""] * (width - len(headers)))
+        for cells in rows:
+            if len(cells) < width:
+                cells.extend([""] * (width - len(cells)))
+
+    return {"headers": headers, "rows": rows}, text_format
+
+
+def iter_text_table(lines, text_format='auto'):
+    """
+    流式解析：从行迭代器（例如请求体的文本流）中逐行解析表格，不需要一次性持有全部文本
+
+    数据行在产出时按表头列数补齐；比表头更宽的行保留多出的单元格（表头已经产出，无法回补）。
+
+    Returns:
+        (表头, 数据行迭代器, 实际使用的格式)
+    """
+    lines = iter(lines)
+    sample, consumed = _take_sample(lines)
+    if not sample:
+        raise ValueError("文本内容为空")
+
+    if text_format in (None, '', 'auto'):
+        text_format = _sniff_sample(sample)
+    if text_format not in _ROW_ITERATORS:
+        raise ValueError(f"不支持的文本格式: {text_format}")
+
+    rows_iter = _ROW_ITERATORS[text_format](itertools.chain(consumed, lines))
+    headers = next(rows_iter, None)
+    if headers is None:
+        raise ValueError("文本中没有有效内容")
+
+    def padded_rows():
+        width = len(headers)
+        for cells in rows_iter:
+            if len(cells) < width:
+                cells.extend([""] * (width - len(cells)))
+            yield cells
+
+    return headers, padded_rows(), text_format
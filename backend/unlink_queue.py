@@ -0,0 +1,149 @@
+"""
+后台文件删除队列
+
+删除历史记录时，请求只负责删除数据库记录，Excel文件交给后台线程删除：
+- 删除前确认文件已不再被任何历史记录引用（Excel文件按表格内容共享，引用计数为0时才删除）
+- 删除失败（例如 Windows 上文件正被下载占用）时按指数退避重试，超过最大次数后放弃，
+  残留文件由孤立文件清理（janitor）兜底
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+
+from metrics import STAGE_LATENCY
+from models import db, TextRecord
+
+
+class UnlinkQueue:
+    """带重试的后台文件删除队列"""
+
+    def __init__(self, app, max_attempts=5, retry_delay_seconds=2.0):
+        self.app = app
+        self.max_attempts = max_attempts
+        self.retry_delay_seconds = retry_delay_seconds
+
+        # (到期时间, 序号, 路径, 已尝试次数)
+        self._heap = []
+        self._counter = itertools.count()
+        self._queued = set()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+
+    def start(self):
+        """启动后台删除线程（重复调用无副作用）"""
+        with self._cond:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop = False
+            self._thread = threading.Thread(target=self._loop, name='excel-unlink', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def pending(self):
+        """等待删除（包括等待重试）的文件数"""
+        with self._cond:
+            return len(self._heap)
+
+    def submit(self, excel_paths):
+        """提交待删除的文件路径（需在删除记录并提交之后调用），立即返回"""
+        now = time.monotonic()
+        with self._cond:
+            for path in excel_paths:
+                if not path or path in self._queued:
+                    continue
+                self._queued.add(path)
+                heapq.heappush(self._heap, (now, next(self._counter), path, 0))
+            self._cond.notify()
+        self.start()
+
+    def _next_batch(self):
+        """等待并取出所有已到期的任务，停止时返回 None"""
+        with self._cond:
+            while True:
+                if self._stop:
+                    return None
+                if self._heap:
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+            now = time.monotonic()
+            batch = []
+            while self._heap and self._heap[0][0] <= now:
+                _, _, path, attempts = heapq.heappop(self._heap)
+                self._queued.discard(path)
+                batch.append((path, attempts))
+            return batch
+
+    def _retry(self, path, attempts):
+        if attempts >= self.max_attempts:
+            print(f"删除Excel文件失败，已放弃（重试{attempts}次）: {path}")
+            return
+        due = time.monotonic() + self.retry_delay_seconds * (2 ** (attempts - 1))
+        with self._cond:
+            if path in self._queued:
+                return
+            self._queued.add(path)
+            heapq.heappush(self._heap, (due, next(self._counter), path, attempts))
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                with self.app.app_context(), STAGE_LATENCY.time(stage='unlink'):
+                    self.run_batch(batch)
+            except Exception:
+                print(f"删除Excel文件时出错:\n{traceback.format_exc()}")
+                for path, attempts in batch:
+                    self._retry(path, attempts + 1)
+
+    def run_batch(self, batch):
+        """
+        删除一批文件，需在应用上下文中调用
+
+        Args:
+            batch: [(路径, 已尝试次数), ...]
+
+        Returns:
+            删除的文件数
+        """
+        paths = {path for path, _ in batch}
+        try:
+            still_referenced = {
+                row[0] for row in db.session.query(TextRecord.excel_path).filter(
+                    TextRecord.excel_path.in_(paths)
+                ).distinct()
+            }
+        finally:
+            db.session.remove()
+
+        deleted_count = 0
+        for path, attempts in batch:
+            if path in still_referenced:
+                continue
+            try:
+                os.remove(path)
+                deleted_count += 1
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"删除Excel文件失败（第{attempts + 1}次）: {str(e)}")
+                self._retry(path, attempts + 1)
+        return deleted_count
@@ -0,0 +1,286 @@
+"""
+内容寻址的 Excel 工作簿缓存
+
+工作簿文件名由规范化后的表格数据（headers/rows）的哈希决定：
+- 相同的表格只渲染一次，重复请求直接返回已有文件
+- 多条 TextRecord 可以共享同一个 excel_path，删除文件前需确认没有其他记录引用（引用计数）
+- 文件可随时由 table_json 重新生成，因此目录按容量上限做 LRU 淘汰，首次下载时再按需生成
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from excel_utils import create_excel_from_table, create_excel_from_sheet_parts, write_excel_from_rows
+from metrics import STAGE_LATENCY, observe_workbook
+
+# 渲染格式版本：Excel 生成逻辑（样式、列宽规则等）变化时递增，使旧缓存失效
+WORKBOOK_FORMAT_VERSION = 1
+
+_LOCK_STRIPES = 64
+
+
+def _normalize_cells(values):
+    return [str(v) if v is not None else "" for v in values]
+
+
+class TableHasher:
+    """增量计算规范化表格数据的 SHA-256 摘要（逐行更新，不拼接整张表）"""
+
+    def __init__(self, headers):
+        self._hasher = hashlib.sha256(f"v{WORKBOOK_FORMAT_VERSION}\n".encode('utf-8'))
+        self._update(headers)
+
+    def _update(self, values):
+        self._hasher.update(json.dumps(_normalize_cells(values), ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    def add_row(self, row):
+        self._hasher.update(b'\n')
+        self._update(row)
+
+    def hexdigest(self):
+        return self._hasher.hexdigest()
+
+
+def table_digest(table_data):
+    """计算规范化表格数据的 SHA-256 摘要"""
+    hasher = TableHasher(table_data.get('headers', []))
+    for row in table_data.get('rows', []):
+        hasher.add_row(row)
+    return hasher.hexdigest()
+
+
+def multi_page_digest(sheets):
+    """
+    多页工作簿的摘要
+
+    Args:
+        sheets: [(工作表名称, 该页表格的 table_digest), ...]
+    """
+    hasher = hashlib.sha256(f"v{WORKBOOK_FORMAT_VERSION}\nmulti-page\n".encode('utf-8'))
+    for title, digest in sheets:
+        hasher.update(json.dumps([title, digest], ensure_ascii=False).encode('utf-8'))
+        hasher.update(b'\n')
+    return hasher.hexdigest()
+
+
+def text_digest(raw_text):
+    """原始文本的 SHA-256 摘要"""
+    return hashlib.sha256(raw_text.encode('utf-8')).hexdigest()
+
+
+class WorkbookCache:
+    """
+    按表格内容寻址的工作簿文件缓存（有容量上限，按最近使用时间淘汰）
+
+    工作簿可以随时由表格数据重新生成，因此缓存中的任何文件都允许被淘汰：
+    - 每次命中都会刷新文件修改时间，修改时间即“最近使用时间”
+    - 新文件写入后累计的估算大小超过上限时，扫描目录并删除最久未使用的文件，
+      直到总大小降到上限的 90%（扫描以磁盘为准，多进程共享同一目录时也能正确收敛）
+    - 最近 EVICTION_GRACE_SECONDS 秒内使用过的文件不会被淘汰，避免删除正在下载的文件
+    """
+
+    EVICTION_GRACE_SECONDS = 60
+    LOW_WATER_RATIO = 0.9
+
+    def __init__(self, directory, max_bytes=0):
+        self.directory = directory
+        self.max_bytes = max_bytes  # 0 表示不限制
+        # 分段锁：同一摘要的并发请求只渲染一次
+        self._locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+        self._evict_lock = threading.Lock()
+        self._approx_bytes = None
+
+    def path_for(self, digest):
+        return os.path.abspath(os.path.join(self.directory, f"{digest}.xlsx"))
+
+    def path_for_table(self, table_data):
+        """表格对应的工作簿路径（不生成文件）"""
+        return self.path_for(table_digest(table_data))
+
+    def touch(self, path):
+        """标记文件被使用（刷新修改时间），文件不存在时返回 False"""
+        try:
+            os.utime(path, None)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def get_or_create(self, table_data):
+        """
+        返回表格对应的工作簿路径，不存在时生成
+
+        Returns:
+            (excel_path, created): created 为 False 表示命中缓存
+        """
+        digest = table_digest(table_data)
+        path = self.path_for(digest)
+        with self._locks[int(digest[:8], 16) % _LOCK_STRIPES]:
+            # 刷新修改时间，同时避免刚命中的文件被淘汰或被孤立文件清理按“超过1小时”删除
+            if self.touch(path):
+                return path, False
+            os.makedirs(self.directory, exist_ok=True)
+            with STAGE_LATENCY.time(stage='render'):
+                create_excel_from_table(table_data, path)
+        observe_workbook(path)
+        self._note_created(path)
+        return path, True
+
+    def create_from_rows(self, headers, rows):
+        """
+        由逐行产出的数据直接生成工作簿（用于流式导入，不需要完整的表格数据）
+
+        摘要在写入的同时计算；写完后按摘要重命名，已存在相同内容的文件时直接复用。
+
+        Returns:
+            (excel_path, created)
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        hasher = TableHasher(headers)
+
+        def hashed_rows():
+            for row in rows:
+                hasher.add_row(row)
+                yield row
+
+        tmp_path = os.path.join(self.directory, f".{uuid.uuid4().hex}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                write_excel_from_rows(headers, hashed_rows(), f)
+            digest = hasher.hexdigest()
+            path = self.path_for(digest)
+            with self._locks[int(digest[:8], 16) % _LOCK_STRIPES]:
+                if self.touch(path):
+                    os.remove(tmp_path)
+                    return path, False
+                os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        observe_workbook(path)
+        self._note_created(path)
+        return path, True
+
+    def create_from_sheet_parts(self, digest, parts):
+        """
+        由分别渲染好的工作表部件拼装工作簿（用于多页解析），已存在相同摘要的文件时直接复用
+
+        Args:
+            digest: multi_page_digest 计算的摘要
+            parts: [(工作表名称, 部件文件路径, 部件信息), ...]，见 excel_utils.write_excel_from_sheet_parts
+
+        Returns:
+            (excel_path, created)；部件文件由调用方删除
+        """
+        path = self.path_for(digest)
+        with self._locks[int(digest[:8], 16) % _LOCK_STRIPES]:
+            if self.touch(path):
+                return path, False
+            os.makedirs(self.directory, exist_ok=True)
+            with STAGE_LATENCY.time(stage='assemble'):
+                create_excel_from_sheet_parts(parts, path)
+        observe_workbook(path)
+        self._note_created(path)
+        return path, True
+
+    def adopt(self, path):
+        """登记由其他进程（如批量渲染的工作进程）写入缓存目录的新文件，计入容量统计"""
+        self._note_created(path)
+
+    def _scan(self):
+        """扫描缓存目录，返回 [(mtime, size, path), ...]"""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if not entry.name.endswith('.xlsx'):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except FileNotFoundError:
+            pass
+        return entries
+
+    def _note_created(self, path):
+        if not self.max_bytes:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        with self._evict_lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = sum(size for _, size, _ in self._scan())
+            else:
+                self._approx_bytes += size
+            if self._approx_bytes > self.max_bytes:
+                self._approx_bytes = self._evict()
+
+    def _evict(self):
+        """按最近使用时间淘汰文件，返回淘汰后的总大小"""
+        entries = self._scan()
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * self.LOW_WATER_RATIO
+        protected_after = time.time() - self.EVICTION_GRACE_SECONDS
+        for mtime, size, path in sorted(entries):
+            if total <= target or mtime > protected_after:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                total -= size
+            except OSError as e:
+                print(f"淘汰Excel缓存文件失败 {path}: {str(e)}")
+        return total
+
+    def usage(self):
+        """缓存目录当前占用的字节数和文件数"""
+        entries = self._scan()
+        return sum(size for _, size, _ in entries), len(entries)
+
+
+class ParseCache:
+    """
+    原始文本 -> 解析结果的进程内 LRU 缓存，重复粘贴时跳过文本解析
+
+    容量按原始文本的字符数计算，超过上限时淘汰最久未使用的条目。
+    返回的表格数据是共享对象，调用方不得修改。
+    """
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, raw_text):
+        key = text_digest(raw_text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, raw_text, table_data):
+        cost = len(raw_text)
+        if cost > self.max_chars:
+            return
+        key = text_digest(raw_text)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[0]
+            self._entries[key] = (cost, table_data)
+            self._size += cost
+            while self._size > self.max_chars and self._entries:
+                _, (evicted_cost, _) = self._entries.popitem(last=False)
+                self._size -= evicted_cost
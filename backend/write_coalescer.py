@@ -0,0 +1,150 @@
+"""
+历史记录保存的合并提交（group commit）
+
+每次保存单独开启事务并提交，在 SQLite 上意味着每条记录一次 fsync 和一次写锁竞争。
+这里由一个后台写线程收集短时间窗口内并发提交的保存请求，在同一个事务中批量插入：
+- 去重规则与逐条保存一致：同一用户、相同 excel_path 和标题的记录已存在时不重复保存，
+  同一批次内的重复请求也只保存一次
+- 每个调用方拿到各自的结果（记录字典、是否为新建）
+- 批量提交失败时回滚并逐条重试，单条记录的错误只影响它自己的调用方
+"""
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import Future
+
+from sqlalchemy import and_, or_
+
+from models import db, TextRecord
+
+
+class SaveCoalescer:
+    """将并发的历史记录保存合并为批量事务"""
+
+    def __init__(self, app, window_seconds=0.005, max_batch=100):
+        self.app = app
+        self.window_seconds = window_seconds
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='save-coalescer', daemon=True)
+                self._thread.start()
+
+    def save(self, record, timeout=30):
+        """
+        提交一条待保存的记录（尚未加入会话的 TextRecord），等待所在批次提交完成
+
+        调用前会结束当前会话的事务并归还连接（未提交的修改会被丢弃），
+        否则大量等待中的请求各自占用一个连接，写线程可能拿不到连接。
+
+        Returns:
+            (记录字典, created): created 为 False 表示相同记录已存在，返回的是已有记录
+        """
+        db.session.close()
+        future = Future()
+        self._ensure_started()
+        self._queue.put((record, future))
+        return future.result(timeout=timeout)
+
+    def _collect(self):
+        """阻塞等待第一条请求，然后在时间窗口内继续收集，直到窗口结束或达到批次上限"""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            try:
+                with self.app.app_context():
+                    try:
+                        self._commit_batch(batch)
+                    finally:
+                        db.session.remove()
+            except Exception as e:
+                print(f"批量保存历史记录出错:\n{traceback.format_exc()}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    @staticmethod
+    def _key(record):
+        return (record.user_id, record.excel_path, record.title)
+
+    def _find_existing(self, records):
+        """一次查询找出批次中已存在的记录，返回 {(user_id, excel_path, title): 已有记录}"""
+        conditions = [
+            and_(
+                TextRecord.user_id == user_id,
+                TextRecord.excel_path == excel_path,
+                TextRecord.title == title,
+            )
+            for user_id, excel_path, title in {self._key(r) for r in records}
+        ]
+        existing = {}
+        for record in TextRecord.query.filter(or_(*conditions)).all():
+            existing.setdefault(self._key(record), record)
+        return existing
+
+    def _commit_batch(self, batch):
+        existing = self._find_existing([record for record, _ in batch])
+
+        results = []  # (future, 记录, created)
+        pending = {}
+        for record, future in batch:
+            key = self._key(record)
+            if key in existing:
+                results.append((future, existing[key], False))
+            elif key in pending:
+                # 同一批次内的重复保存：与第一条共用同一条记录
+                results.append((future, pending[key], False))
+            else:
+                pending[key] = record
+                results.append((future, record, True))
+
+        if pending:
+            db.session.add_all(pending.values())
+            try:
+                db.session.flush()
+                # 提交前生成结果（提交后属性会过期，再访问需要重新查询）
+                payloads = [(future, record.to_dict(), created) for future, record, created in results]
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self._commit_one_by_one(batch)
+                return
+        else:
+            payloads = [(future, record.to_dict(), created) for future, record, created in results]
+
+        for future, payload, created in payloads:
+            future.set_result((payload, created))
+
+    def _commit_one_by_one(self, batch):
+        """批量提交失败时逐条保存，只有出错的那条返回异常"""
+        for record, future in batch:
+            try:
+                found = self._find_existing([record]).get(self._key(record))
+                if found is not None:
+                    future.set_result((found.to_dict(), False))
+                    continue
+                db.session.add(record)
+                db.session.flush()
+                payload = record.to_dict()
+                db.session.commit()
+                future.set_result((payload, True))
+            except Exception as e:
+                db.session.rollback()
+                future.set_exception(e)
@@ -0,0 +1,12 @@
+"""
+生产环境 WSGI 入口
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn 以 preload 方式在主进程中导入本模块：应用及其依赖（Flask、SQLAlchemy、Excel生成和文本解析模块）
+只加载一次，启动初始化也只在主进程中执行一次，工作进程 fork 后共享这些内存页。
+后台线程在 gunicorn.conf.py 的 post_fork 中为每个工作进程单独启动。
+"""
+from app import create_app
+
+app = create_app(start_workers=False)
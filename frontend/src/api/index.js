@@ -88,8 +88,18 @@ api.interceptors.response.use(
   }
 )
 
-export default api
-
-
-
+// 浏览器直接下载：先获取短期有效的下载令牌，再通过链接下载（文件边下载边写入磁盘，不在页面内存中缓冲）
+export const openDownload = async (url, params = {}) => {
+  const res = await api.post('/manual/download-token', { user_id: params.user_id })
+  const query = new URLSearchParams({ download_token: res.data.token })
+  Object.entries(params).forEach(([key, value]) => {
+    if (value !== undefined && value !== null) query.set(key, value)
+  })
+  const link = document.createElement('a')
+  link.href = `${api.defaults.baseURL}${url}?${query}`
+  // 空的 download 属性：使用响应头中的文件名
+  link.download = ''
+  link.click()
+}
 
+export default api